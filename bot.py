@@ -4,26 +4,71 @@ Telegram Anonymous Chat Bot
 Fitur: Hobi, Pro Search, Media, Leaderboard, Quiz Poin/Pro, Block, Group, Moderasi Gambar, Feedback, Poll, Mode Rahasia, Multi-Language, Broadcast Pemenang Sensor
 """
 
+import array
+import asyncio
+import contextvars
+import fcntl
+import functools
+import gzip
+import heapq
+import inspect
+import itertools
+import json
 import logging
+import math
+import os
 import sqlite3
+import sys
 import random
+import re
+import shutil
+import socket
+import threading
 import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
 from datetime import datetime, timedelta
-import requests
+from zoneinfo import ZoneInfo
 
 from telegram import (
-    Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton,
-    KeyboardButton, ReplyKeyboardRemove, InputMediaPhoto, LabeledPrice, Poll
+    Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton, KeyboardButton
 )
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ConversationHandler, filters, ContextTypes, PreCheckoutQueryHandler, JobQueue
+    ConversationHandler, PollAnswerHandler, filters, ContextTypes, TypeHandler, ApplicationHandlerStop,
+    BasePersistence, PersistenceInput
 )
+from telegram.error import RetryAfter, TimedOut, NetworkError, BadRequest
+from telegram.request import HTTPXRequest
+
+# Dependensi yang jarang dipakai (requests untuk moderasi, numpy untuk scoring,
+# modul payment) di-import saat pertama dibutuhkan agar boot tetap cepat.
+USE_NUMPY = True
+np = None
+POPCOUNT16 = None
+
+def load_numpy():
+    global np, POPCOUNT16, USE_NUMPY
+    if np is None and USE_NUMPY:
+        try:
+            import numpy
+        except ImportError:
+            USE_NUMPY = False
+            return None
+        POPCOUNT16 = numpy.array([bin(i).count("1") for i in range(1 << 16)], dtype=numpy.int32)
+        np = numpy
+    return np if USE_NUMPY else None
 
 # ========== Konfigurasi ==========
 BOT_TOKEN = "YOUR_BOT_TOKEN"
 OWNER_ID = 123456789
 DB_PATH = "bot_database.db"
+SCHEMA_VERSION = 8                  # naikkan setiap kali DDL di init_db berubah
+STORAGE_BACKEND = "sqlite"          # "sqlite" atau "postgres" untuk profil & session (lihat Storage)
+POSTGRES_DSN = "postgresql://bot@localhost/bot"
+POSTGRES_POOL_MIN = 2
+POSTGRES_POOL_MAX = 20              # koneksi per proses worker
+SQLITE_MAX_VARIABLES = 900          # parameter "?" per query, di bawah SQLITE_MAX_VARIABLE_NUMBER lama (999)
 LANGS = ["English", "Indonesian"]
 GENDERS = ["Male", "Female", "Other"]
 HOBBIES = ["Music", "Sports", "Gaming", "Travel", "Reading", "Cooking", "Drawing", "Coding", "Photography", "Other"]
@@ -32,8 +77,166 @@ PRO_MONTH_PRICE = 3500
 MODERATION_WORDS = ["anjing", "babi", "kontol", "bangsat", "memek", "ngentot"]
 REPORT_REASONS = ["Spam", "SARA", "Pornografi", "Kata Kasar", "Penipuan", "Lainnya"]
 QUIZ_LIMIT_WINNERS = 5
+# Nilai di atas (harga, kata kasar, alasan report, hobi, batas quiz) hanya default;
+# nilai aktif dibaca dari tabel config lewat config.current (/config, /setconfig)
+CONFIG_RELOAD_INTERVAL = 30         # detik antar cek perubahan tabel config dari proses lain
+CONFIG_MAX_HOBBIES = 12             # tabel per mask hobi berukuran 2^n
+QUIZ_PRO_SECONDS = 86400            # hadiah quiz: Pro 1 hari
+REDEEM_POINTS = 7                   # /tukarpro7: 7 poin -> Pro 7 hari
+REDEEM_PRO_SECONDS = 7 * 86400
+# Skor kecocokan partner: hobi sama jauh lebih penting dari selisih usia
+MATCH_HOBBY_WEIGHT = 100
+MATCH_AGE_WEIGHT = 1
+MATCH_AGE_UNKNOWN_PENALTY = 10
+MATCH_TOP_K = 50
+MATCH_AGE_BAND = 5                  # lebar pita usia (tahun) untuk bucket kandidat Pro search
+MATCH_MIN_AGE = 13                  # usia yang diterima di profil: MATCH_MIN_AGE..MATCH_MAX_AGE
+MATCH_MAX_AGE = 100
+MATCH_POOL_CHECK_INTERVAL = 3600    # detik antar pengecekan konsistensi pool vs DB
+# Indeks block dua arah
+BLOCK_CACHE_USERS = 20000           # user yang daftar block-nya disimpan di memori (LRU)
+BLOCK_BLOOM_THRESHOLD = 500         # di atas jumlah ini daftar block disimpan sebagai bloom filter
+BLOCK_BLOOM_FP_RATE = 0.01
+# Ruang tunggu: kriteria dilonggarkan bertahap (detik sejak masuk antrian)
+WAIT_RELAX_AFTER = (30, 60, 120)    # tahap 1: abaikan hobi, 2: usia ±WAIT_AGE_SLACK, 3: abaikan gender & usia ±2x
+WAIT_AGE_SLACK = 5
+WAIT_TIMEOUT = 300
+# Audit log (event append-only) ditulis per batch di belakang layar
+EVENT_BUFFER_CAPACITY = 50000       # ring buffer; event tertua dibuang bila DB macet
+EVENT_FLUSH_BATCH = 500             # flush lebih awal bila buffer mencapai jumlah ini
+EVENT_FLUSH_INTERVAL = 0.5          # detik antar flush terjadwal
+# Polling: ditutup otomatis, suara ditulis ke DB per batch
+POLL_DURATION = 600                 # detik sampai polling ditutup & hasil dikirim
+POLL_MAX_OPTIONS = 10               # batas Telegram
+POLL_FLUSH_INTERVAL = 5             # detik antar flush suara ke poll_votes
+POLL_FLUSH_BATCH = 200              # flush lebih awal bila buffer mencapai jumlah ini
+# Kartu profil partner saat match
+PROFILE_CARD_CACHE_SIZE = 20000     # snapshot profil yang disimpan di memori (LRU)
+PROFILE_CARD_BIO_CHARS = 120
+PROFILE_CARD_THUMB_WIDTH = 320      # lebar maksimum foto yang dipakai ulang setelah kiriman pertama
 NSFW_API_KEY = "YOUR_MODERATECONTENT_API_KEY"
 NSFW_API_URL = "https://api.moderatecontent.com/moderate/"
+NSFW_BACKEND = "api"                # "api" (ModerateContent) atau "local" (model ONNX di process pool)
+NSFW_MODEL_PATH = "models/nsfw.onnx"  # input NHWC float32 0..1, output probabilitas per kelas
+NSFW_UNSAFE_CLASSES = (1, 3, 4)     # hentai, porn, sexy pada urutan kelas nsfw_model (GantMan)
+NSFW_INPUT_SIZE = 224
+NSFW_THRESHOLD = 0.7                # total skor kelas tidak aman untuk menolak foto
+NSFW_WORKERS = 2                    # proses decode + inferensi
+NSFW_BATCH_SIZE = 16                # foto per batch inferensi
+NSFW_BATCH_WAIT = 0.02              # detik menunggu batch terisi sebelum inferensi
+NSFW_VERDICT_CACHE_SIZE = 50000     # hasil per perceptual hash yang disimpan (LRU)
+NSFW_PHASH_DISTANCE = 4             # bit pHash berbeda maksimum agar dianggap foto yang sama
+# Blocklist media (pHash foto, dHash thumbnail stiker) yang ditolak sebelum moderasi
+MEDIA_BLOCK_KINDS = ("photo", "sticker")
+MEDIA_BLOCK_DISTANCE = 5            # bit berbeda maksimum terhadap fingerprint yang diblok
+# Deteksi spam di relay: teks mirip (MinHash) dari banyak pengirim dalam satu window
+SPAM_WINDOW = 600                   # detik
+SPAM_MIN_SENDERS = 5                # pengirim berbeda dengan teks mirip -> spam
+SPAM_MIN_TOKENS = 6                 # teks lebih pendek (salam, "ok") tidak diperiksa
+SPAM_MINHASH_BINS = 16              # panjang signature MinHash
+SPAM_BAND_ROWS = 2                  # bin per band LSH (8 band)
+SPAM_MIN_SIMILARITY = 0.4           # perkiraan Jaccard minimum agar dianggap teks yang sama
+SPAM_MAX_CANDIDATES = 64            # kandidat terbaru yang dibandingkan per bucket band
+SPAM_MAX_RECENT = 100000            # pesan terbaru yang disimpan
+SPAM_LINK_BURST = 3                 # link/mention per user sebelum dibatasi
+SPAM_LINK_REFILL = 1 / 60           # link per detik
+SPAM_LINK_ENTITIES = ("url", "text_link", "mention", "text_mention")
+
+# Anti-flood: token bucket per user
+RATE_LIMIT_BURST = 10               # kapasitas bucket (token)
+RATE_LIMIT_REFILL = 1.0             # token per detik
+RATE_LIMIT_MAX_USERS = 50000        # batas jumlah user yang disimpan di memori (LRU)
+RATE_LIMIT_COSTS = {"light": 1, "media": 2, "heavy": 4}
+RATE_LIMIT_CLASSES = {
+    # Perintah & key tombol (lihat BUTTONS) yang menulis session / memanggil API mahal
+    "/start": "heavy", "/find": "heavy", "/next": "heavy", "/searchpro": "heavy",
+    "/joingroup": "heavy", "/playquiz": "heavy", "/report": "heavy",
+    "find": "heavy", "next": "heavy", "search_pro": "heavy", "join_group": "heavy", "quiz": "heavy",
+}
+RATE_LIMIT_NOTICE_INTERVAL = 15     # detik minimal antar balasan cooldown
+RATE_LIMIT_STRIKES = 30             # pelanggaran dalam satu window -> auto-ban
+RATE_LIMIT_STRIKE_WINDOW = 60       # detik
+RATE_LIMIT_BAN_SECONDS = 3600       # lama ban otomatis
+USER_CACHE_SIZE = 100000            # user (bahasa, username, status ban) yang disimpan di memori
+
+# Outbound Bot API: batas global & per chat (lihat limit resmi Telegram)
+OUTBOX_GLOBAL_RATE = 25             # pesan per detik untuk seluruh bot
+OUTBOX_CHAT_RATE = 1.0              # pesan per detik per chat
+OUTBOX_CHAT_BURST = 3
+OUTBOX_MAX_CHATS = 10000            # bucket per chat yang disimpan (LRU)
+OUTBOX_CONCURRENCY = 16             # request Bot API paralel
+OUTBOX_MAX_RETRIES = 3
+OUTBOX_OWNER_COALESCE_CHARS = 3500  # batas panjang gabungan notifikasi owner
+OUTBOX_GATED_METHODS = ("send", "edit", "copy", "forward")  # request langsung (reply_text dsb) yang ikut batas global
+
+# Shutdown & restart (deploy tanpa memutus chat)
+LIFECYCLE_DRAIN_SECONDS = 15        # batas menunggu antrian kiriman keluar saat SIGTERM
+LIFECYCLE_PERSIST_INTERVAL = 30     # detik antar simpan user_data & state conversation
+LIFECYCLE_LOCK_PATH = DB_PATH + ".lock"  # proses baru menunggu lock ini dilepas proses lama
+LIFECYCLE_LOCK_TIMEOUT = 120        # batas menunggu proses lama (drain + shutdown) sebelum menyerah
+LIFECYCLE_LOCK_LOG_INTERVAL = 10    # detik antar log selama menunggu lock
+
+# Health check HTTP untuk supervisor: /livez, /readyz, /stats (lihat HealthMonitor)
+HEALTH_HOST = "127.0.0.1"
+HEALTH_PORT = 8080                  # 0 = nonaktif
+HEALTH_PROBE_INTERVAL = 0.25        # detik antar detak probe lag event loop
+HEALTH_MAX_LAG = 2.0                # lag event loop di atas ini -> /livez 503
+HEALTH_MAX_OUTBOX = 5000            # antrian kiriman di atas ini -> /readyz 503
+HEALTH_STATS_INTERVAL = 5           # detik antar snapshot /stats
+HEALTH_DB_TIMEOUT = 1.0             # detik menunggu lock SQLite saat cek readiness
+HEALTH_STORAGE_INTERVAL = 2         # detik antar ping storage (profil, session, ledger) dari event loop
+HEALTH_STORAGE_MAX_AGE = 6          # ping storage sukses terakhir lebih tua dari ini -> /readyz 503
+
+# Backup online (/backup, job terjadwal, python bot.py backup|restore)
+BACKUP_DIR = "backups"
+BACKUP_INTERVAL = 6 * 3600          # detik antar snapshot terjadwal
+BACKUP_KEEP = 8                     # snapshot terbaru yang disimpan (rotasi)
+BACKUP_PAGES_PER_STEP = 256         # halaman per langkah backup API
+BACKUP_STEP_SLEEP = 0.002           # jeda antar langkah, membatasi I/O backup
+BACKUP_VERIFY = True                # restore ke file sementara + integrity_check setelah snapshot
+BACKUP_WAL_SHIP = False             # kirim segmen WAL ke BACKUP_DIR/wal (point-in-time recovery)
+BACKUP_WAL_INTERVAL = 10            # detik antar pengiriman segmen WAL
+BACKUP_WAL_CHECKPOINT_PAGES = 1000  # shipper checkpoint sendiri setelah WAL sepanjang ini
+BACKUP_WAL_CHECKPOINT_ROUNDS = 3    # ronde baca ulang ekor WAL per pengiriman demi checkpoint
+
+# Scheduler persisten (tabel scheduled_jobs, /jobs): leaderboard, ronde quiz, expiry Pro, retensi
+SCHEDULER_TIMEZONE = "Asia/Jakarta" # zona default untuk jadwal "daily HH:MM"
+SCHEDULER_TICK = 5                  # detik antar cek job jatuh tempo
+SCHEDULER_MAX_CONCURRENT = 2        # job berjalan bersamaan per proses
+SCHEDULER_LEASE = 300               # detik lease per run, diperpanjang selama job berjalan
+SCHEDULER_RETRY_DELAY = 600         # detik sebelum run yang gagal dicoba lagi
+RETENTION_EVENTS_DAYS = 365         # event audit di luar replay (ban/pro/poin) yang lebih tua dihapus
+RETENTION_REPORTS_DAYS = 180
+RETENTION_BATCH = 5000              # baris per DELETE supaya lock tulis tidak ditahan lama
+
+# Profiling (/profile_start, /profile_stop)
+PROFILE_DIR = "profiles"            # tujuan file .folded (flamegraph.pl / speedscope)
+PROFILE_SAMPLE_INTERVAL = 0.005     # detik antar sample stack event loop
+PROFILE_SLOW_UPDATE_MS = 200        # update di atas ini dicatat lengkap
+PROFILE_MAX_SLOW_TRACES = 1000
+PROFILE_REPORT_TOP = 5
+PROFILE_SQL_CHARS = 80
+
+# Deteksi event loop terblokir (I/O sinkron, CPU berat di handler); aktif juga di produksi
+BLOCK_DETECT = True                 # biaya: satu callback loop + satu wakeup thread per BLOCK_TICK
+BLOCK_TICK = 0.02                   # detik antar detak loop & cek watchdog
+BLOCK_THRESHOLD = 0.1               # loop diam lebih lama dari ini = blocking, stack diambil
+BLOCK_STACK_DEPTH = 8               # frame terdalam yang disimpan per stack
+BLOCK_LAG_SAMPLES = 10000           # detak terakhir untuk persentil lag
+BLOCK_REPORT_TOP = 5
+
+# Ringkasan alert ke owner (digest), bukan satu DM per kejadian
+ALERT_DIGEST_INTERVAL = 300         # detik antar flush terjadwal
+ALERT_DIGEST_MAX_EVENTS = 100       # flush lebih awal bila buffer mencapai jumlah ini
+ALERT_DIGEST_TOP = 5                # user teratas yang ditampilkan per tipe
+ALERT_TITLES = {
+    "profanity": "⚠️ Kata kasar",
+    "nsfw": "🚫 Gambar NSFW",
+    "media_block": "🧷 Media terblokir",
+    "spam": "📢 Spam",
+    "report": "🚩 Report",
+    "quiz_win": "🎉 Pemenang quiz",
+}
 
 # ========== Logging ==========
 logging.basicConfig(
@@ -41,13 +244,392 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ========== Profiling ==========
+# Aktif lewat /profile_start: sampler stack event loop + trace update lambat
+# (handler, statement DB, panggilan Bot API). Saat mati, biayanya satu pengecekan atribut.
+current_trace = contextvars.ContextVar("current_trace", default=None)
+# Code object handler asli (tanpa decorator) -> nama, untuk atribusi stack oleh BlockDetector
+handler_codes = {}
+
+class UpdateTrace:
+    __slots__ = ("label", "started", "total", "spans", "handler")
+
+    def __init__(self, label):
+        self.label = label
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.spans = []             # (path handler induk, jenis, nama, detik)
+        self.handler = None
+
+    def add(self, kind, name, seconds):
+        self.spans.append((self.handler, kind, name, seconds))
+
+    def breakdown(self):
+        totals = {}
+        for _, kind, name, seconds in self.spans:
+            entry = totals.setdefault(f"{kind} {name}", [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+        return sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+
+    def folded(self):
+        # Format folded stack (flamegraph.pl / speedscope), bobot dalam mikrodetik
+        children = {}
+        for parent, _, _, seconds in self.spans:
+            children[parent] = children.get(parent, 0.0) + seconds
+        root = f"update {self.label}"
+        lines = [(root, self.total - children.get(None, 0.0))]
+        for parent, kind, name, seconds in self.spans:
+            path = f"{parent};{kind} {name}" if parent else f"{kind} {name}"
+            if kind == "handler":
+                seconds -= children.get(path, 0.0)
+            lines.append((f"{root};{path}", seconds))
+        return [f"{stack} {max(0, int(seconds * 1e6))}" for stack, seconds in lines]
+
+def update_label(update):
+    # Label tanpa isi pesan user: perintah, key tombol, atau tipe update
+    message = update.effective_message
+    if update.callback_query:
+        return "callback " + (update.callback_query.data or "").split("_", 1)[0]
+    if message is not None and message.text:
+        if message.text[0] == "/":
+            return message.text.split(None, 1)[0].split("@", 1)[0]
+        return "button " + BUTTON_KEYS[message.text] if message.text in BUTTON_KEYS else "text"
+    if message is not None:
+        return "media"
+    return "poll_answer" if update.poll_answer else "other"
+
+class Profiler:
+    def __init__(self):
+        self.tracing = False
+        self.stop_event = None
+        self.sampler = None
+        self.samples = Counter()
+        self.slow = deque(maxlen=PROFILE_MAX_SLOW_TRACES)
+        self.traced = 0
+        self.started_at = 0.0
+
+    def start(self):
+        if self.tracing:
+            return False
+        self.samples = Counter()
+        self.slow.clear()
+        self.traced = 0
+        self.started_at = time.time()
+        self.stop_event = threading.Event()
+        # Dipanggil dari thread event loop: thread inilah yang di-sampling
+        self.sampler = threading.Thread(target=self.sample, args=(threading.get_ident(), self.stop_event, self.samples),
+                                        name="profiler", daemon=True)
+        self.sampler.start()
+        self.tracing = True
+        return True
+
+    def sample(self, thread_id, stop_event, samples):
+        while not stop_event.wait(PROFILE_SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                samples[";".join(reversed(stack))] += 1
+
+    def finish(self, trace):
+        self.traced += 1
+        if trace.total * 1000 >= PROFILE_SLOW_UPDATE_MS:
+            self.slow.append(trace)
+
+    async def stop(self):
+        # Tracing dimatikan di event loop; join sampler & tulis file di thread supaya loop tidak tertahan.
+        # Data sesi ini diteruskan ke dump: start() berikutnya (walau dump belum selesai) memakai data baru
+        if not self.tracing:
+            return None
+        self.tracing = False
+        self.stop_event.set()
+        return await asyncio.to_thread(self.dump, self.sampler, self.samples, list(self.slow), self.traced, self.started_at)
+
+    def dump(self, sampler, samples, slow, traced, started_at):
+        sampler.join()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        samples_path = os.path.join(PROFILE_DIR, f"samples-{stamp}.folded")
+        slow_path = os.path.join(PROFILE_DIR, f"slow-{stamp}.folded")
+        with open(samples_path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(slow_path, "w") as f:
+            for trace in slow:
+                f.write("\n".join(trace.folded()) + "\n")
+        lines = [f"🔬 Profiling selesai ({time.time() - started_at:.0f}s)",
+                 f"Sample: {sum(samples.values())}, update: {traced}, lambat (>{PROFILE_SLOW_UPDATE_MS} ms): {len(slow)}",
+                 f"File: {samples_path}, {slow_path}"]
+        for trace in sorted(slow, key=lambda trace: trace.total, reverse=True)[:PROFILE_REPORT_TOP]:
+            parts = ", ".join(f"{name} {seconds * 1000:.0f}ms×{count}" for name, (count, seconds) in trace.breakdown()[:3])
+            lines.append(f"• {trace.label}: {trace.total * 1000:.0f} ms ({parts})")
+        return "\n".join(lines)
+
+profiler = Profiler()
+
+def traced_callback(callback):
+    name = getattr(callback, "__name__", repr(callback))
+    code = getattr(inspect.unwrap(callback), "__code__", None)
+    if code is not None:
+        handler_codes[code] = name
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        trace = current_trace.get()
+        if trace is None:
+            return await callback(update, context)
+        parent = trace.handler
+        trace.handler = f"{parent};handler {name}" if parent else f"handler {name}"
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            trace.handler = parent
+            trace.add("handler", name, time.perf_counter() - start)
+    return wrapper
+
+def trace_handler(handler):
+    # ConversationHandler: bungkus semua handler di dalamnya
+    if isinstance(handler, ConversationHandler):
+        for inner in handler.entry_points + handler.fallbacks + [h for hs in handler.states.values() for h in hs]:
+            trace_handler(inner)
+    elif getattr(handler, "callback", None) is not None:
+        handler.callback = traced_callback(handler.callback)
+
+class TracedApplication(Application):
+    def add_handler(self, handler, group=0):
+        trace_handler(handler)
+        super().add_handler(handler, group)
+
+    async def process_update(self, update):
+        if not profiler.tracing:
+            return await super().process_update(update)
+        trace = UpdateTrace(update_label(update) if isinstance(update, Update) else type(update).__name__)
+        token = current_trace.set(trace)
+        try:
+            await super().process_update(update)
+        finally:
+            current_trace.reset(token)
+            trace.total = time.perf_counter() - trace.started
+            profiler.finish(trace)
+
+class TracedRequest(HTTPXRequest):
+    async def post(self, url, request_data=None, **kwargs):
+        # Balasan langsung handler (reply_text, edit_message_text, ...) tidak lewat antrian Outbox,
+        # tapi tetap memakai jeda flood control & token global yang sama, dan diulang setelah RetryAfter
+        if outbox_delivering.get() or not url.rsplit("/", 1)[-1].startswith(OUTBOX_GATED_METHODS):
+            return await super().post(url, request_data, **kwargs)
+        for attempt in range(OUTBOX_MAX_RETRIES + 1):
+            await outbox.admit()
+            try:
+                return await super().post(url, request_data, **kwargs)
+            except RetryAfter as e:
+                outbox.pause(e)
+                if attempt == OUTBOX_MAX_RETRIES:
+                    raise
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        trace = current_trace.get()
+        if trace is None:
+            return await super().do_request(url, method, request_data, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await super().do_request(url, method, request_data, **kwargs)
+        finally:
+            trace.add("api", url.rsplit("/", 1)[-1], time.perf_counter() - start)
+
+def sql_label(sql):
+    return " ".join(sql.split())[:PROFILE_SQL_CHARS].replace(";", "")
+
+class TracedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            trace = current_trace.get()
+            if trace is not None:
+                trace.add("db", sql_label(sql), time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            trace = current_trace.get()
+            if trace is not None:
+                trace.add("db", sql_label(sql), time.perf_counter() - start)
+
+class TracedConnection(sqlite3.Connection):
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# ========== Blocking Detector ==========
+# Loop berdetak tiap BLOCK_TICK; watchdog thread melihat detak yang terlambat lebih dari
+# BLOCK_THRESHOLD, mengambil stack thread loop saat itu juga (kode yang sedang memblokir)
+# dan mengatribusikannya ke handler terdalam di stack, atau ke coroutine bot.py terluar
+# (job, task Outbox) bila bukan handler. Durasi dicatat saat loop berdetak lagi.
+class BlockDetector:
+    def __init__(self):
+        self.running = False
+        self.loop = None
+        self.thread_id = None
+        self.stop_event = None
+        self.watchdog = None
+        self.handle = None
+        self.beat = 0.0
+        self.expected = 0.0
+        self.lags = deque(maxlen=BLOCK_LAG_SAMPLES)
+        self.lock = threading.Lock()
+        self.stalls = {}            # (atribusi, stack) -> [jumlah, total detik, maks detik]
+        self.started_at = 0.0
+
+    def start(self):
+        # Dipanggil dari thread event loop
+        if self.running:
+            return False
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        self.reset()
+        self.beat = time.monotonic()
+        self.expected = self.beat + BLOCK_TICK
+        self.handle = self.loop.call_later(BLOCK_TICK, self.tick)
+        self.stop_event = threading.Event()
+        self.watchdog = threading.Thread(target=self.watch, name="block-detector", daemon=True)
+        self.watchdog.start()
+        self.running = True
+        return True
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.handle.cancel()
+        self.stop_event.set()
+        self.watchdog.join()
+
+    def reset(self):
+        with self.lock:
+            self.stalls = {}
+            self.lags.clear()
+            self.started_at = time.time()
+
+    def tick(self):
+        now = time.monotonic()
+        self.lags.append(max(0.0, now - self.expected))
+        self.beat = now
+        self.expected = now + BLOCK_TICK
+        self.handle = self.loop.call_later(BLOCK_TICK, self.tick)
+
+    def watch(self):
+        stalled = None              # (detak terakhir sebelum blocking, key)
+        while not self.stop_event.wait(BLOCK_TICK):
+            beat = self.beat
+            if stalled is not None and beat != stalled[0]:
+                self.record(stalled[1], beat - stalled[0] - BLOCK_TICK)
+                stalled = None
+            if stalled is None and time.monotonic() - beat > BLOCK_THRESHOLD:
+                key = self.capture()
+                if key is not None:
+                    stalled = (beat, key)
+
+    def capture(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return None
+        stack = []
+        handler = None
+        outermost = None
+        while frame is not None:
+            code = frame.f_code
+            if handler is None and code in handler_codes:
+                handler = "handler " + handler_codes[code]
+            if code.co_filename == __file__:
+                outermost = code.co_name
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        owner = handler or (f"task {outermost}" if outermost else "loop")
+        return owner, ";".join(reversed(stack[:BLOCK_STACK_DEPTH]))
+
+    def record(self, key, seconds):
+        with self.lock:
+            entry = self.stalls.get(key)
+            if entry is None:
+                entry = self.stalls[key] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def by_owner(self):
+        # atribusi -> [jumlah, total detik, maks detik], urut total terbesar
+        owners = {}
+        with self.lock:
+            for (owner, _), (count, total, longest) in self.stalls.items():
+                entry = owners.setdefault(owner, [0, 0.0, 0.0])
+                entry[0] += count
+                entry[1] += total
+                entry[2] = max(entry[2], longest)
+        return sorted(owners.items(), key=lambda item: item[1][1], reverse=True)
+
+    def summary(self):
+        lags = list(self.lags)
+        return {
+            "lag_p50": round(percentile(lags, 0.5), 4),
+            "lag_p99": round(percentile(lags, 0.99), 4),
+            "lag_max": round(max(lags), 4) if lags else 0.0,
+            "stalls": {owner: {"count": count, "seconds": round(total, 3), "max": round(longest, 3)}
+                       for owner, (count, total, longest) in self.by_owner()[:BLOCK_REPORT_TOP]},
+        }
+
+    def report(self):
+        info = self.summary()
+        with self.lock:
+            stacks = sorted(self.stalls.items(), key=lambda item: item[1][1], reverse=True)[:BLOCK_REPORT_TOP]
+        lines = [f"🧱 Blocking event loop sejak {datetime.fromtimestamp(self.started_at):%Y-%m-%d %H:%M} "
+                 f"(ambang {BLOCK_THRESHOLD * 1000:.0f} ms)",
+                 f"Lag p50/p99/max: {info['lag_p50'] * 1000:.1f}/{info['lag_p99'] * 1000:.1f}/{info['lag_max'] * 1000:.1f} ms"]
+        if not stacks:
+            lines.append("Tidak ada blocking.")
+        for (owner, stack), (count, total, longest) in stacks:
+            # Tiga frame terdalam: tempat blocking terjadi & pemanggilnya
+            innermost = " ← ".join(reversed(stack.split(";")[-3:]))
+            lines.append(f"• {owner}: {count}× total {total * 1000:.0f} ms, maks {longest * 1000:.0f} ms\n  {innermost}")
+        return "\n".join(lines)
+
+block_detector = BlockDetector()
+
 # ========== Database Layer ==========
 def db():
+    if profiler.tracing:
+        return sqlite3.connect(DB_PATH, factory=TracedConnection)
     return sqlite3.connect(DB_PATH)
 
+def ensure_column(c, table, column, decl):
+    # Migrasi ringan: tambah kolom bila belum ada, True jika baru ditambahkan
+    if column in [row[1] for row in c.execute(f"PRAGMA table_info({table})")]:
+        return False
+    c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
 def init_db():
     with db() as conn:
         c = conn.cursor()
+        # WAL: pembaca (backup, health check) tidak menahan writer; tersimpan di file database
+        c.execute("PRAGMA journal_mode=WAL")
+        # Skema sudah sesuai versi ini: lewati DDL
+        if c.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+            logger.info("Database schema v%d up to date.", SCHEMA_VERSION)
+            return
         # Profil user
         c.execute('''CREATE TABLE IF NOT EXISTS user_profiles (
             user_id INTEGER PRIMARY KEY,
@@ -61,8 +643,14 @@ def init_db():
             is_banned INTEGER DEFAULT 0,
             banned_until INTEGER DEFAULT 0,
             hobbies TEXT,
-            points INTEGER DEFAULT 0
+            points INTEGER DEFAULT 0,
+            hobby_mask INTEGER DEFAULT 0
         )''')
+        # Migrasi: hobi sebagai bitmask atas HOBBIES
+        if ensure_column(c, "user_profiles", "hobby_mask", "INTEGER DEFAULT 0"):
+            rows = c.execute("SELECT user_id, hobbies FROM user_profiles WHERE hobbies IS NOT NULL AND hobbies != ''").fetchall()
+            c.executemany("UPDATE user_profiles SET hobby_mask=? WHERE user_id=?",
+                          [(encode_hobbies(hobbies.split(",")), uid) for uid, hobbies in rows])
         # Laporan
         c.execute('''CREATE TABLE IF NOT EXISTS reports (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -77,6 +665,7 @@ def init_db():
             blocked_id INTEGER,
             PRIMARY KEY(user_id, blocked_id)
         )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_block_list_blocked ON block_list(blocked_id)")
         # Antrian chat
         c.execute('''CREATE TABLE IF NOT EXISTS chat_queue (
             user_id INTEGER PRIMARY KEY,
@@ -84,8 +673,10 @@ def init_db():
             hobby_pref TEXT,
             age_min INTEGER,
             age_max INTEGER,
-            is_pro INTEGER DEFAULT 0
+            is_pro INTEGER DEFAULT 0,
+            enqueued_at INTEGER
         )''')
+        ensure_column(c, "chat_queue", "enqueued_at", "INTEGER")
         # Chat session
         c.execute('''CREATE TABLE IF NOT EXISTS sessions (
             user_id INTEGER PRIMARY KEY,
@@ -122,77 +713,806 @@ def init_db():
             responses TEXT,
             created_at INTEGER
         )''')
-    logger.info("Database initialized.")
+        ensure_column(c, "polls", "creator_id", "INTEGER")
+        ensure_column(c, "polls", "closes_at", "INTEGER")
+        ensure_column(c, "polls", "closed", "INTEGER DEFAULT 0")
+        # Satu pesan poll Telegram per peserta (poll non-anonim tidak bisa di-forward bersama)
+        c.execute('''CREATE TABLE IF NOT EXISTS poll_messages (
+            tg_poll_id TEXT PRIMARY KEY,
+            poll_id INTEGER,
+            chat_id INTEGER,
+            message_id INTEGER
+        )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS poll_votes (
+            poll_id INTEGER,
+            user_id INTEGER,
+            option_id INTEGER,
+            voted_at INTEGER,
+            PRIMARY KEY (poll_id, user_id)
+        )''')
+        # Mutasi poin; idempotency_key mencegah hadiah/penukaran diterapkan dua kali
+        c.execute('''CREATE TABLE IF NOT EXISTS points_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT UNIQUE,
+            user_id INTEGER,
+            delta INTEGER,
+            reason TEXT,
+            created_at INTEGER
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_points_ledger_user ON points_ledger (user_id, id)")
+        # Audit log
+        c.execute('''CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts INTEGER,
+            kind TEXT,
+            actor_id INTEGER,
+            subject_id INTEGER,
+            data TEXT
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_events_subject ON events (subject_id, ts)")
+        # Fingerprint media terlarang (hash 64-bit disimpan bertanda, lihat signed64)
+        c.execute('''CREATE TABLE IF NOT EXISTS media_blocklist (
+            kind TEXT,
+            phash INTEGER,
+            reason TEXT,
+            added_by INTEGER,
+            created_at INTEGER,
+            PRIMARY KEY (kind, phash)
+        )''')
+        # State runtime (user_data, conversation, quiz aktif) yang harus selamat dari restart
+        c.execute('''CREATE TABLE IF NOT EXISTS runtime_state (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at INTEGER
+        )''')
+        # Override konfigurasi runtime (JSON), lihat RuntimeConfig
+        c.execute('''CREATE TABLE IF NOT EXISTS config (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at INTEGER,
+            updated_by INTEGER
+        )''')
+        # Job terjadwal (Scheduler): jadwal, run terakhir & lease antar worker
+        c.execute('''CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            name TEXT PRIMARY KEY,
+            schedule TEXT,
+            timezone TEXT,
+            enabled INTEGER DEFAULT 1,
+            next_run_at INTEGER,
+            last_run_at INTEGER,
+            last_status TEXT,
+            last_duration REAL,
+            runs INTEGER DEFAULT 0,
+            failures INTEGER DEFAULT 0,
+            lease_owner TEXT,
+            lease_until INTEGER
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_user_profiles_pro ON user_profiles (pro_expires_at)")
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    logger.info("Database initialized (schema v%d).", SCHEMA_VERSION)
+
+# ========== Storage ==========
+# Profil, status ban, poin (ledger), pemenang quiz & session di balik satu antarmuka async. SQLiteStorage
+# menjalankan query langsung (tanpa await di tengah, sama seperti modul lain); PostgresStorage
+# memakai pool asyncpg sehingga beberapa proses worker bisa menulis bersamaan. Tabel lain
+# (event, report, grup, polling, config, job) tetap di SQLite lokal lewat db().
+PROFILE_FIELDS = ("gender", "age", "bio", "photo_id", "hobby_mask", "points")
+
+class Storage:
+    # True = read_user() sinkron tersedia, UserCache.get boleh membaca langsung saat miss
+    blocking_reads = False
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def profile_row(self, row):
+        if not row:
+            return {}
+        data = dict(zip(PROFILE_FIELDS, row))
+        data["hobbies"] = decode_hobbies(data["hobby_mask"])
+        return data
+
+class SQLiteStorage(Storage):
+    name = "sqlite"
+    blocking_reads = True
+
+    async def upsert_user(self, user_id, username):
+        with db() as conn:
+            conn.execute("INSERT INTO user_profiles (user_id, username) VALUES (?,?) ON CONFLICT(user_id) DO UPDATE SET username=excluded.username",
+                         (user_id, username))
+            conn.commit()
+
+    async def get_profile(self, user_id):
+        with db() as conn:
+            row = conn.execute("SELECT gender, age, bio, photo_id, hobby_mask, points FROM user_profiles WHERE user_id=?", (user_id,)).fetchone()
+        return self.profile_row(row)
+
+    async def save_profile(self, user_id, gender, age, bio, photo_id, language, hobbies):
+        with db() as conn:
+            conn.execute("UPDATE user_profiles SET gender=?, age=?, bio=?, photo_id=?, language=?, hobbies=?, hobby_mask=? WHERE user_id=?",
+                         (gender, age, bio, photo_id, language, ",".join(hobbies), encode_hobbies(hobbies), user_id))
+            conn.commit()
+
+    async def pro_expires_at(self, user_id):
+        with db() as conn:
+            row = conn.execute("SELECT pro_expires_at FROM user_profiles WHERE user_id=?", (user_id,)).fetchone()
+        return row[0] if row and row[0] else 0
+
+    def read_user(self, user_id):
+        # (language, username, is_banned, banned_until) atau None
+        with db() as conn:
+            return conn.execute("SELECT language, username, is_banned, banned_until FROM user_profiles WHERE user_id=?", (user_id,)).fetchone()
+
+    async def user_row(self, user_id):
+        return self.read_user(user_id)
+
+    async def set_ban(self, user_id, banned_until):
+        # banned_until 0 = ban dicabut
+        with db() as conn:
+            conn.execute("UPDATE user_profiles SET is_banned=?, banned_until=? WHERE user_id=?", (int(banned_until > 0), banned_until, user_id))
+            conn.commit()
+
+    async def apply_ledger(self, user_id, key, delta, reason, pro_seconds, now, quiz_claim=None):
+        # Satu transaksi, lihat ledger_apply
+        with db() as conn:
+            c = conn.cursor()
+            if quiz_claim is not None:
+                quiz_id, prize = quiz_claim
+                c.execute("UPDATE quiz_winners SET prize=? WHERE quiz_id=? AND user_id=? AND prize='pending'", (prize, quiz_id, user_id))
+                if c.rowcount == 0:
+                    return LEDGER_NOT_PENDING, None
+            c.execute("INSERT OR IGNORE INTO points_ledger (idempotency_key, user_id, delta, reason, created_at) VALUES (?,?,?,?,?)",
+                      (key, user_id, delta, reason, now))
+            if c.rowcount == 0:
+                conn.rollback()
+                return LEDGER_DUPLICATE, None
+            # Pro diperpanjang dari sisa waktu (atau dari sekarang bila sudah habis)
+            c.execute("""UPDATE user_profiles SET points=COALESCE(points, 0)+?,
+                         pro_expires_at=CASE WHEN ? > 0 THEN MAX(COALESCE(pro_expires_at, 0), ?)+? ELSE pro_expires_at END
+                         WHERE user_id=? AND COALESCE(points, 0)+? >= 0""",
+                      (delta, pro_seconds, now, pro_seconds, user_id, delta))
+            if c.rowcount == 0:
+                conn.rollback()
+                return LEDGER_INSUFFICIENT, None
+            balance = c.execute("SELECT points, COALESCE(pro_expires_at, 0) FROM user_profiles WHERE user_id=?", (user_id,)).fetchone()
+            conn.commit()
+        return LEDGER_OK, balance
+
+    async def balances(self, user_ids):
+        # user_id -> (banned_until, pro_expires_at, points), untuk replay audit
+        user_ids = list(user_ids)
+        result = {}
+        with db() as conn:
+            # Satu SELECT per potongan, di bawah batas variabel SQLite (999 di build lama)
+            for i in range(0, len(user_ids), SQLITE_MAX_VARIABLES):
+                chunk = user_ids[i:i + SQLITE_MAX_VARIABLES]
+                rows = conn.execute("SELECT user_id, COALESCE(banned_until, 0), COALESCE(pro_expires_at, 0), COALESCE(points, 0) "
+                                    f"FROM user_profiles WHERE user_id IN ({','.join('?' * len(chunk))})", chunk)
+                result.update((row[0], row[1:]) for row in rows)
+        return result
+
+    async def set_balances(self, user_id, banned_until, pro_expires_at, points):
+        with db() as conn:
+            conn.execute("UPDATE user_profiles SET is_banned=?, banned_until=?, pro_expires_at=?, points=? WHERE user_id=?",
+                         (int(banned_until > 0), banned_until, pro_expires_at, points, user_id))
+            conn.commit()
+
+    async def count_users(self):
+        with db() as conn:
+            return conn.execute("SELECT COUNT(*) FROM user_profiles").fetchone()[0]
+
+    async def top_points(self, limit):
+        with db() as conn:
+            return conn.execute("SELECT user_id, points FROM user_profiles ORDER BY points DESC LIMIT ?", (limit,)).fetchall()
+
+    async def user_languages(self):
+        # (user_id, language) seluruh user, untuk broadcast
+        with db() as conn:
+            return conn.execute("SELECT user_id, language FROM user_profiles").fetchall()
+
+    async def pro_expired_between(self, since, until):
+        with db() as conn:
+            return [uid for (uid,) in conn.execute("SELECT user_id FROM user_profiles WHERE pro_expires_at>? AND pro_expires_at<=?", (since, until))]
+
+    async def quiz_winners(self, quiz_id):
+        # [(user_id, prize)] urut menang; prize 'pending' sampai hadiah dipilih
+        with db() as conn:
+            return conn.execute("SELECT user_id, prize FROM quiz_winners WHERE quiz_id=? ORDER BY rowid", (quiz_id,)).fetchall()
+
+    async def add_quiz_winner(self, quiz_id, user_id):
+        with db() as conn:
+            conn.execute("INSERT INTO quiz_winners (quiz_id, user_id, prize) VALUES (?,?,?)", (quiz_id, user_id, "pending"))
+            conn.commit()
+
+    async def quiz_id_used(self, quiz_id):
+        with db() as conn:
+            return conn.execute("SELECT 1 FROM quiz_winners WHERE quiz_id=? LIMIT 1", (quiz_id,)).fetchone() is not None
+
+    async def idle_profiles(self, user_ids=None):
+        # (user_id, gender, age, hobby_mask) untuk user yang tidak sedang chat & tidak diban
+        sql = "SELECT u.user_id, u.gender, u.age, u.hobby_mask FROM user_profiles u LEFT JOIN sessions s ON u.user_id=s.user_id WHERE s.user_id IS NULL AND u.is_banned=0"
+        with db() as conn:
+            if user_ids is None:
+                return conn.execute(sql).fetchall()
+            user_ids = list(user_ids)
+            return conn.execute(sql + f" AND u.user_id IN ({','.join('?' * len(user_ids))})", user_ids).fetchall()
+
+    async def get_session(self, user_id):
+        # (partner_id, started_at, secret_mode) atau None
+        with db() as conn:
+            return conn.execute("SELECT partner_id, started_at, secret_mode FROM sessions WHERE user_id=?", (user_id,)).fetchone()
+
+    async def add_session(self, user_id, partner_id, started_at, secret_mode=False):
+        with db() as conn:
+            conn.executemany("INSERT OR REPLACE INTO sessions (user_id, partner_id, started_at, secret_mode) VALUES (?,?,?,?)",
+                             [(user_id, partner_id, started_at, int(secret_mode)), (partner_id, user_id, started_at, int(secret_mode))])
+            conn.commit()
+
+    async def end_session(self, user_id):
+        # Hapus kedua sisi session; kembalikan (partner_id, started_at) atau None
+        with db() as conn:
+            row = conn.execute("SELECT partner_id, started_at FROM sessions WHERE user_id=?", (user_id,)).fetchone()
+            if row is None:
+                return None
+            conn.executemany("DELETE FROM sessions WHERE user_id=?", [(user_id,), (row[0],)])
+            conn.commit()
+        return row
+
+    async def set_secret_mode(self, user_id):
+        with db() as conn:
+            conn.execute("UPDATE sessions SET secret_mode=1 WHERE user_id=?", (user_id,))
+            conn.commit()
+
+    async def count_sessions(self):
+        with db() as conn:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+# Tabel di PostgreSQL mengikuti kolom SQLite (user_id Telegram butuh BIGINT)
+POSTGRES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_profiles (
+    user_id BIGINT PRIMARY KEY,
+    username TEXT,
+    gender TEXT,
+    age INTEGER,
+    bio TEXT,
+    photo_id TEXT,
+    language TEXT,
+    pro_expires_at BIGINT,
+    is_banned INTEGER DEFAULT 0,
+    banned_until BIGINT DEFAULT 0,
+    hobbies TEXT,
+    points INTEGER DEFAULT 0,
+    hobby_mask INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_user_profiles_pro ON user_profiles (pro_expires_at);
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id BIGINT PRIMARY KEY,
+    partner_id BIGINT,
+    started_at BIGINT,
+    secret_mode INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS points_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    idempotency_key TEXT UNIQUE,
+    user_id BIGINT,
+    delta INTEGER,
+    reason TEXT,
+    created_at BIGINT
+);
+CREATE INDEX IF NOT EXISTS idx_points_ledger_user ON points_ledger (user_id, id);
+CREATE TABLE IF NOT EXISTS quiz_winners (
+    id BIGSERIAL PRIMARY KEY,
+    quiz_id INTEGER,
+    user_id BIGINT,
+    prize TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_quiz_winners_quiz ON quiz_winners (quiz_id, user_id);
+"""
+
+class PostgresStorage(Storage):
+    # asyncpg menyiapkan (prepare) tiap query sekali per koneksi lewat statement cache-nya,
+    # jadi query di sini cukup ditulis sebagai string tetap dengan parameter $n
+    name = "postgres"
+
+    def __init__(self, dsn=None, min_size=None, max_size=None):
+        self.dsn = dsn or POSTGRES_DSN
+        self.min_size = min_size or POSTGRES_POOL_MIN
+        self.max_size = max_size or POSTGRES_POOL_MAX
+        self.pool = None
+
+    async def open(self):
+        import asyncpg
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+        async with self.pool.acquire() as conn:
+            await conn.execute(POSTGRES_SCHEMA)
+        logger.info("PostgreSQL pool opened (%d-%d connections).", self.min_size, self.max_size)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def upsert_user(self, user_id, username):
+        await self.pool.execute("INSERT INTO user_profiles (user_id, username) VALUES ($1, $2) ON CONFLICT (user_id) DO UPDATE SET username=EXCLUDED.username",
+                                user_id, username)
+
+    async def get_profile(self, user_id):
+        row = await self.pool.fetchrow("SELECT gender, age, bio, photo_id, hobby_mask, points FROM user_profiles WHERE user_id=$1", user_id)
+        return self.profile_row(tuple(row) if row else None)
+
+    async def save_profile(self, user_id, gender, age, bio, photo_id, language, hobbies):
+        await self.pool.execute("UPDATE user_profiles SET gender=$1, age=$2, bio=$3, photo_id=$4, language=$5, hobbies=$6, hobby_mask=$7 WHERE user_id=$8",
+                                gender, age, bio, photo_id, language, ",".join(hobbies), encode_hobbies(hobbies), user_id)
+
+    async def pro_expires_at(self, user_id):
+        return await self.pool.fetchval("SELECT pro_expires_at FROM user_profiles WHERE user_id=$1", user_id) or 0
+
+    async def user_row(self, user_id):
+        row = await self.pool.fetchrow("SELECT language, username, is_banned, banned_until FROM user_profiles WHERE user_id=$1", user_id)
+        return tuple(row) if row else None
+
+    async def set_ban(self, user_id, banned_until):
+        await self.pool.execute("UPDATE user_profiles SET is_banned=$1, banned_until=$2 WHERE user_id=$3", int(banned_until > 0), banned_until, user_id)
+
+    async def apply_ledger(self, user_id, key, delta, reason, pro_seconds, now, quiz_claim=None):
+        # UPDATE bersyarat dievaluasi ulang setelah lock baris: saldo tetap tidak pernah minus antar worker
+        async with self.pool.acquire() as conn:
+            transaction = conn.transaction()
+            await transaction.start()
+            try:
+                if quiz_claim is not None:
+                    quiz_id, prize = quiz_claim
+                    claimed = await conn.fetchval("UPDATE quiz_winners SET prize=$1 WHERE quiz_id=$2 AND user_id=$3 AND prize='pending' RETURNING id",
+                                                  prize, quiz_id, user_id)
+                    if claimed is None:
+                        await transaction.rollback()
+                        return LEDGER_NOT_PENDING, None
+                inserted = await conn.fetchval("""INSERT INTO points_ledger (idempotency_key, user_id, delta, reason, created_at)
+                                                VALUES ($1, $2, $3, $4, $5) ON CONFLICT (idempotency_key) DO NOTHING RETURNING id""",
+                                             key, user_id, delta, reason, now)
+                if inserted is None:
+                    await transaction.rollback()
+                    return LEDGER_DUPLICATE, None
+                row = await conn.fetchrow("""UPDATE user_profiles SET points=COALESCE(points, 0)+$1,
+                                             pro_expires_at=CASE WHEN $2 > 0 THEN GREATEST(COALESCE(pro_expires_at, 0), $3)+$2 ELSE pro_expires_at END
+                                             WHERE user_id=$4 AND COALESCE(points, 0)+$1 >= 0 RETURNING points, COALESCE(pro_expires_at, 0)""",
+                                          delta, pro_seconds, now, user_id)
+                if row is None:
+                    await transaction.rollback()
+                    return LEDGER_INSUFFICIENT, None
+            except BaseException:
+                await transaction.rollback()
+                raise
+            await transaction.commit()
+        return LEDGER_OK, tuple(row)
+
+    async def balances(self, user_ids):
+        rows = await self.pool.fetch("SELECT user_id, COALESCE(banned_until, 0), COALESCE(pro_expires_at, 0), COALESCE(points, 0) FROM user_profiles WHERE user_id = ANY($1::bigint[])", list(user_ids))
+        return {row["user_id"]: tuple(row)[1:] for row in rows}
+
+    async def set_balances(self, user_id, banned_until, pro_expires_at, points):
+        await self.pool.execute("UPDATE user_profiles SET is_banned=$1, banned_until=$2, pro_expires_at=$3, points=$4 WHERE user_id=$5",
+                                int(banned_until > 0), banned_until, pro_expires_at, points, user_id)
+
+    async def count_users(self):
+        return await self.pool.fetchval("SELECT COUNT(*) FROM user_profiles")
+
+    async def top_points(self, limit):
+        return [tuple(row) for row in await self.pool.fetch("SELECT user_id, points FROM user_profiles ORDER BY points DESC NULLS LAST LIMIT $1", limit)]
+
+    async def user_languages(self):
+        return [tuple(row) for row in await self.pool.fetch("SELECT user_id, language FROM user_profiles")]
+
+    async def pro_expired_between(self, since, until):
+        return [row[0] for row in await self.pool.fetch("SELECT user_id FROM user_profiles WHERE pro_expires_at>$1 AND pro_expires_at<=$2", since, until)]
+
+    async def quiz_winners(self, quiz_id):
+        return [tuple(row) for row in await self.pool.fetch("SELECT user_id, prize FROM quiz_winners WHERE quiz_id=$1 ORDER BY id", quiz_id)]
+
+    async def add_quiz_winner(self, quiz_id, user_id):
+        await self.pool.execute("INSERT INTO quiz_winners (quiz_id, user_id, prize) VALUES ($1, $2, 'pending')", quiz_id, user_id)
+
+    async def quiz_id_used(self, quiz_id):
+        return await self.pool.fetchval("SELECT 1 FROM quiz_winners WHERE quiz_id=$1 LIMIT 1", quiz_id) is not None
+
+    async def idle_profiles(self, user_ids=None):
+        sql = "SELECT u.user_id, u.gender, u.age, u.hobby_mask FROM user_profiles u LEFT JOIN sessions s ON u.user_id=s.user_id WHERE s.user_id IS NULL AND u.is_banned=0"
+        if user_ids is None:
+            rows = await self.pool.fetch(sql)
+        else:
+            rows = await self.pool.fetch(sql + " AND u.user_id = ANY($1::bigint[])", list(user_ids))
+        return [tuple(row) for row in rows]
+
+    async def get_session(self, user_id):
+        row = await self.pool.fetchrow("SELECT partner_id, started_at, secret_mode FROM sessions WHERE user_id=$1", user_id)
+        return tuple(row) if row else None
+
+    async def add_session(self, user_id, partner_id, started_at, secret_mode=False):
+        async with self.pool.acquire() as conn:
+            await conn.executemany("""INSERT INTO sessions (user_id, partner_id, started_at, secret_mode) VALUES ($1, $2, $3, $4)
+                                      ON CONFLICT (user_id) DO UPDATE SET partner_id=EXCLUDED.partner_id,
+                                      started_at=EXCLUDED.started_at, secret_mode=EXCLUDED.secret_mode""",
+                                   [(user_id, partner_id, started_at, int(secret_mode)), (partner_id, user_id, started_at, int(secret_mode))])
+
+    async def end_session(self, user_id):
+        # DELETE ... RETURNING: dari dua worker yang mengakhiri session yang sama, hanya satu yang dapat baris
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow("DELETE FROM sessions WHERE user_id=$1 RETURNING partner_id, started_at", user_id)
+                if row is None:
+                    return None
+                await conn.execute("DELETE FROM sessions WHERE user_id=$1", row["partner_id"])
+        return tuple(row)
+
+    async def set_secret_mode(self, user_id):
+        await self.pool.execute("UPDATE sessions SET secret_mode=1 WHERE user_id=$1", user_id)
+
+    async def count_sessions(self):
+        return await self.pool.fetchval("SELECT COUNT(*) FROM sessions")
+
+def open_storage(backend=None):
+    backend = backend or STORAGE_BACKEND
+    if backend == "postgres":
+        return PostgresStorage()
+    if backend == "sqlite":
+        return SQLiteStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+storage = open_storage()
+
+# ========== User Cache ==========
+class CachedUser:
+    __slots__ = ("exists", "language", "username", "banned", "banned_until")
+
+    def __init__(self, row):
+        self.exists = row is not None
+        language, username, banned, banned_until = row or (None, None, 0, 0)
+        self.language = language if language in LANGS else DEFAULT_LANG
+        self.username = username
+        self.banned = bool(banned)
+        self.banned_until = banned_until or 0
+
+class UserCache:
+    # Data user yang dibaca hampir di setiap update; satu query saat miss, LRU terbatas
+    def __init__(self, max_users):
+        self.max_users = max_users
+        self.entries = OrderedDict()
+        self.loading = {}           # user_id -> task load() untuk miss di backend async
+        self.hits = 0
+        self.misses = 0
+
+    def store(self, user_id, entry):
+        self.entries[user_id] = entry
+        if len(self.entries) > self.max_users:
+            self.entries.popitem(last=False)
+        return entry
+
+    def get(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is not None:
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        if storage.blocking_reads:
+            return self.store(user_id, CachedUser(storage.read_user(user_id)))
+        # Backend async (PostgreSQL) tidak bisa dibaca dari sini. Pengirim update sudah dimuat
+        # rate_limit_guard; miss lain (partner, peserta poll) memakai default sekali, lalu dimuat
+        if user_id not in self.loading:
+            task = self.loading[user_id] = asyncio.get_running_loop().create_task(self.load(user_id))
+            task.add_done_callback(lambda _: self.loading.pop(user_id, None))
+        return CachedUser(None)
+
+    async def load(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            row = await storage.user_row(user_id)
+            entry = self.entries.get(user_id) or self.store(user_id, CachedUser(row))
+        return entry
+
+    def peek(self, user_id):
+        return self.entries.get(user_id)
+
+user_cache = UserCache(USER_CACHE_SIZE)
+
+# ========== Audit Log ==========
+class EventLog:
+    # Append-only: event dikumpulkan di ring buffer, ditulis per batch di thread executor
+    def __init__(self, capacity):
+        self.buffer = deque(maxlen=capacity)
+        self.flushing = None
+        self.written = 0
+        self.dropped = 0
+
+    def append(self, kind, subject_id, actor_id=None, **data):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append((int(time.time()), kind, actor_id, subject_id, json.dumps(data) if data else None))
+        if len(self.buffer) >= EVENT_FLUSH_BATCH:
+            self.schedule_flush()
+
+    def take(self):
+        batch = list(self.buffer)
+        self.buffer.clear()
+        return batch
+
+    def write(self, batch):
+        with db() as conn:
+            conn.executemany("INSERT INTO events (ts, kind, actor_id, subject_id, data) VALUES (?,?,?,?,?)", batch)
+            conn.commit()
+        self.written += len(batch)
+
+    def schedule_flush(self):
+        if self.flushing is not None or not self.buffer:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        batch = self.take()
+        self.flushing = loop.run_in_executor(None, self.write, batch)
+        self.flushing.add_done_callback(lambda done: self.flush_done(done, batch))
+
+    def flush_done(self, future, batch):
+        self.flushing = None
+        if future.exception() is not None:
+            # Kembalikan ke depan buffer, dicoba lagi di flush berikutnya
+            logger.error("Event log flush of %d events failed: %s", len(batch), future.exception())
+            self.buffer.extendleft(reversed(batch))
+
+    def flush(self):
+        # Sinkron: untuk shutdown dan CLI
+        batch = self.take()
+        if batch:
+            self.write(batch)
+
+event_log = EventLog(EVENT_BUFFER_CAPACITY)
+
+async def event_flush_job(context: ContextTypes.DEFAULT_TYPE):
+    event_log.schedule_flush()
+
+# ========== Points Ledger ==========
+# Hasil ledger_apply; LEDGER_NOT_PENDING = tidak ada hadiah quiz 'pending' milik user itu
+LEDGER_OK, LEDGER_DUPLICATE, LEDGER_INSUFFICIENT, LEDGER_NOT_PENDING = range(4)
+
+async def ledger_apply(user_id, key, delta, reason, pro_seconds=0, quiz_claim=None):
+    # Satu transaksi di storage: baris ledger unik per key + saldo & masa Pro diubah dengan UPDATE
+    # bersyarat. Key yang sama tidak pernah diterapkan dua kali; saldo tidak pernah minus.
+    # quiz_claim (quiz_id, prize) ikut di transaksi yang sama: baris pemenang 'pending' diklaim dulu.
+    result, balance = await storage.apply_ledger(user_id, key, delta, reason, pro_seconds, int(time.time()), quiz_claim)
+    if result != LEDGER_OK:
+        return result, None
+    points, pro_expires_at = balance
+    if delta:
+        event_log.append("points", user_id, delta=delta, source=reason)
+    if pro_seconds:
+        event_log.append("pro_grant", user_id, until=pro_expires_at, source=reason)
+    return LEDGER_OK, (points, pro_expires_at)
 
 # ========== Decorator ==========
 def check_ban_status(func):
+    @functools.wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         user_id = update.effective_user.id
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("SELECT is_banned, banned_until FROM user_profiles WHERE user_id=?", (user_id,))
-            row = c.fetchone()
-            if row and row[0]:
-                banned_until = row[1]
-                if banned_until > int(time.time()):
-                    await update.message.reply_text("🚫 Kamu di-ban hingga " + datetime.fromtimestamp(banned_until).strftime("%Y-%m-%d %H:%M"))
-                    return
-                else:
-                    c.execute("UPDATE user_profiles SET is_banned=0, banned_until=0 WHERE user_id=?", (user_id,))
-                    conn.commit()
-            return await func(update, context, *args, **kwargs)
+        cached = user_cache.get(user_id)
+        if cached.banned:
+            if cached.banned_until > int(time.time()):
+                await update.message.reply_text(tr(user_id, "banned_until", until=datetime.fromtimestamp(cached.banned_until).strftime("%Y-%m-%d %H:%M")))
+                return
+            await storage.set_ban(user_id, 0)
+            await refresh_match_pool(user_id)
+            event_log.append("unban", user_id, reason="expired")
+            cached.banned = False
+            cached.banned_until = 0
+        return await func(update, context, *args, **kwargs)
     return wrapper
 
 def owner_only(func):
+    @functools.wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         if update.effective_user.id != OWNER_ID:
-            await update.message.reply_text("❌ Hanya owner yang bisa menggunakan perintah ini.")
+            await update.message.reply_text(tr(update.effective_user.id, "owner_only"))
             return
         return await func(update, context, *args, **kwargs)
     return wrapper
 
 def auto_update_profile(func):
+    @functools.wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         user = update.effective_user
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("SELECT user_id FROM user_profiles WHERE user_id=?", (user.id,))
-            if not c.fetchone():
-                c.execute("INSERT INTO user_profiles (user_id, username) VALUES (?,?)", (user.id, user.username))
-            else:
-                c.execute("UPDATE user_profiles SET username=? WHERE user_id=?", (user.username, user.id))
-            conn.commit()
+        cached = user_cache.get(user.id)
+        # Tulis ke DB hanya untuk user baru atau username yang berubah
+        if not cached.exists or cached.username != user.username:
+            if not cached.exists:
+                match_pool.add(user.id, None, None, 0)
+            await storage.upsert_user(user.id, user.username)
+            cached.exists = True
+            cached.username = user.username
         return await func(update, context, *args, **kwargs)
     return wrapper
 
+# ========== Runtime Config ==========
+# Snapshot immutable + versi; perubahan membuat snapshot baru lalu menukar config.current
+# (satu assignment), jadi pembaca tidak pernah lock. Pakai satu snapshot per handler:
+# cfg = config.current; cfg["hobbies"], cfg.derived("hobby_bits") saling konsisten.
+CONFIG_DEFAULTS = {
+    "quiz_limit_winners": QUIZ_LIMIT_WINNERS,
+    "pro_week_price": PRO_WEEK_PRICE,
+    "pro_month_price": PRO_MONTH_PRICE,
+    "moderation_words": MODERATION_WORDS,
+    "report_reasons": REPORT_REASONS,
+    "hobbies": HOBBIES,
+}
+
+def parse_config(key, text, current):
+    # Teks dari /setconfig -> nilai tervalidasi; ValueError berisi pesan untuk owner
+    default = CONFIG_DEFAULTS[key]
+    if isinstance(default, int):
+        value = int(text)
+        if value < (1 if key == "quiz_limit_winners" else 0):
+            raise ValueError(f"{key} terlalu kecil")
+        return value
+    value = [item.strip() for item in text.split(",") if item.strip()]
+    if len(set(value)) != len(value):
+        raise ValueError("ada item ganda")
+    if key == "moderation_words":
+        return [word.lower() for word in value]
+    if not value:
+        raise ValueError(f"{key} tidak boleh kosong")
+    if key == "report_reasons" and any(len(f"report_{reason}".encode()) > 64 for reason in value):
+        raise ValueError("alasan report maksimal 57 byte (batas callback_data)")
+    if key == "hobbies":
+        # Bit hobi tersimpan di user_profiles.hobby_mask: hanya boleh menambah di belakang
+        if value[:len(current)] != current:
+            raise ValueError("hobi lama tidak boleh dihapus/diubah urutannya, hanya ditambah di belakang")
+        if len(value) > CONFIG_MAX_HOBBIES:
+            raise ValueError(f"maksimal {CONFIG_MAX_HOBBIES} hobi")
+    return value
+
+def validate_config(key, value, current):
+    # Nilai tersimpan / default lewat validasi yang sama dengan /setconfig (termasuk hobbies append-only)
+    if isinstance(CONFIG_DEFAULTS[key], list) != isinstance(value, list):
+        raise ValueError(f"{key}: tipe nilai salah")
+    return parse_config(key, ",".join(value) if isinstance(value, list) else str(value), current)
+
+def build_profanity(cfg):
+    # Untuk daftar sependek ini substring search lebih cepat dari regex alternation
+    return tuple(word.lower() for word in cfg["moderation_words"])
+
+def build_hobby_bits(cfg):
+    # Bit ke-i = hobbies[i]
+    return {hobby: 1 << i for i, hobby in enumerate(cfg["hobbies"])}
+
+def build_hobby_lists(cfg):
+    bits = cfg.derived("hobby_bits")
+    return [[hobby for hobby, bit in bits.items() if mask & bit] for mask in range(1 << len(bits))]
+
+def build_hobby_indexes(cfg):
+    # Indeks hobi per mask; -1 = tanpa hobi (bucket tersendiri)
+    count = len(cfg["hobbies"])
+    return [tuple(i for i in range(count) if mask >> i & 1) or (-1,) for mask in range(1 << count)]
+
+def build_hobby_keyboard(cfg):
+    return ReplyKeyboardMarkup([cfg["hobbies"]], one_time_keyboard=True, resize_keyboard=True)
+
+def build_report_buttons(cfg):
+    return [InlineKeyboardButton(reason, callback_data=f"report_{reason}") for reason in cfg["report_reasons"]]
+
+# nama -> (key config yang dipakai, builder); hasil dibawa ke snapshot baru bila input tidak berubah
+CONFIG_DERIVED = {
+    "profanity": (("moderation_words",), build_profanity),
+    "hobby_bits": (("hobbies",), build_hobby_bits),
+    "hobby_lists": (("hobbies",), build_hobby_lists),
+    "hobby_indexes": (("hobbies",), build_hobby_indexes),
+    "hobby_keyboard": (("hobbies",), build_hobby_keyboard),
+    "report_buttons": (("report_reasons",), build_report_buttons),
+}
+
+class ConfigSnapshot:
+    __slots__ = ("version", "values", "cache")
+
+    def __init__(self, version, values, previous=None):
+        self.version = version
+        self.values = values
+        self.cache = {}
+        if previous is not None:
+            for name, value in previous.cache.items():
+                if all(previous.values[key] == values[key] for key in CONFIG_DERIVED[name][0]):
+                    self.cache[name] = value
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def derived(self, name):
+        # Dibangun saat pertama diminta; dua pembangun bersamaan menghasilkan nilai yang sama
+        try:
+            return self.cache[name]
+        except KeyError:
+            value = self.cache[name] = CONFIG_DERIVED[name][1](self)
+            return value
+
+class RuntimeConfig:
+    def __init__(self):
+        self.current = ConfigSnapshot(0, dict(CONFIG_DEFAULTS))
+
+    def swap(self, values):
+        self.current = ConfigSnapshot(self.current.version + 1, values, self.current)
+        logger.info("Config v%d active.", self.current.version)
+
+    def load(self):
+        with db() as conn:
+            rows = dict(conn.execute("SELECT key, value FROM config").fetchall())
+        for key in rows.keys() - CONFIG_DEFAULTS.keys():
+            logger.warning("Ignoring unknown config key %s.", key)
+        values = {}
+        for key, default in CONFIG_DEFAULTS.items():
+            try:
+                values[key] = validate_config(key, json.loads(rows[key]) if key in rows else default, self.current[key])
+            except ValueError as e:
+                # Baris rusak atau hobbies memendek (bit hobby_mask user tidak lagi valid): nilai aktif dipertahankan
+                logger.warning("Ignoring invalid config %s: %s", key, e)
+                values[key] = self.current[key]
+        if values != self.current.values:
+            self.swap(values)
+
+    def set(self, key, text, actor_id):
+        value = parse_config(key, text, self.current[key])
+        with db() as conn:
+            conn.execute("INSERT OR REPLACE INTO config (key, value, updated_at, updated_by) VALUES (?,?,?,?)",
+                         (key, json.dumps(value), int(time.time()), actor_id))
+            conn.commit()
+        event_log.append("config", actor_id, actor_id=actor_id, key=key, value=value)
+        self.swap({**self.current.values, key: value})
+        return value
+
+    def reset(self, key, actor_id):
+        # ValueError bila default tidak lolos validasi, mis. hobbies yang sudah ditambah
+        value = validate_config(key, CONFIG_DEFAULTS[key], self.current[key])
+        with db() as conn:
+            conn.execute("DELETE FROM config WHERE key=?", (key,))
+            conn.commit()
+        event_log.append("config", actor_id, actor_id=actor_id, key=key, value=None)
+        self.swap({**self.current.values, key: value})
+
+config = RuntimeConfig()
+
+async def config_reload_job(context: ContextTypes.DEFAULT_TYPE):
+    # Perubahan dari proses lain (worker, CLI) ikut terbaca
+    config.load()
+
 # ========== Helper ==========
-def is_pro(user_id):
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT pro_expires_at FROM user_profiles WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        return bool(row and row[0] and row[0] > int(time.time()))
+def encode_hobbies(hobbies):
+    bits = config.current.derived("hobby_bits")
+    mask = 0
+    for hobby in hobbies:
+        mask |= bits.get(hobby.strip(), 0)
+    return mask
 
-def get_profile(user_id):
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("""SELECT gender, age, bio, photo_id, hobbies, points FROM user_profiles WHERE user_id=?""", (user_id,))
-        row = c.fetchone()
-        if row:
-            data = dict(zip(["gender", "age", "bio", "photo_id", "hobbies", "points"], row))
-            data["hobbies"] = data["hobbies"].split(",") if data["hobbies"] else []
-            return data
-        return {}
+def decode_hobbies(mask):
+    return list(config.current.derived("hobby_lists")[mask or 0])
+
+async def is_pro(user_id):
+    return await storage.pro_expires_at(user_id) > int(time.time())
 
-def profile_complete(user_id):
-    profile = get_profile(user_id)
+async def get_profile(user_id):
+    return await storage.get_profile(user_id)
+
+async def profile_complete(user_id):
+    profile = await get_profile(user_id)
     return all([profile.get("gender"), profile.get("age"), profile.get("bio"), profile.get("photo_id")])
 
-def is_in_chat(user_id):
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT partner_id FROM sessions WHERE user_id=?", (user_id,))
-        return c.fetchone() is not None
+async def partner_of(user_id):
+    session = await storage.get_session(user_id)
+    return session[0] if session else None
+
+async def is_in_chat(user_id):
+    return await storage.get_session(user_id) is not None
 
 def is_blocked(user_id, target_id):
     with db() as conn:
@@ -207,137 +1527,1214 @@ def mask_username(username):
         return username[0] + "**" + username[-1]
     return username[:2] + "*"*(len(username)-3) + username[-1]
 
-def add_session(user_id, partner_id, secret_mode=False):
-    now = int(time.time())
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("INSERT OR REPLACE INTO sessions (user_id, partner_id, started_at, secret_mode) VALUES (?,?,?,?)", (user_id, partner_id, now, int(secret_mode)))
-        c.execute("INSERT OR REPLACE INTO sessions (user_id, partner_id, started_at, secret_mode) VALUES (?,?,?,?)", (partner_id, user_id, now, int(secret_mode)))
-        conn.commit()
-
-def end_session(user_id):
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT partner_id FROM sessions WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        if row:
-            partner_id = row[0]
-            c.execute("DELETE FROM sessions WHERE user_id=?", (user_id,))
-            c.execute("DELETE FROM sessions WHERE user_id=?", (partner_id,))
+async def add_session(user_id, partner_id, secret_mode=False):
+    # Keluarkan dari pool & antrian sebelum await supaya tidak ikut dipasangkan lagi
+    match_pool.remove(user_id)
+    match_pool.remove(partner_id)
+    waiting_room.discard(user_id)
+    waiting_room.discard(partner_id)
+    await storage.add_session(user_id, partner_id, int(time.time()), secret_mode)
+    event_log.append("session_start", user_id, partner=partner_id)
+
+async def end_session(user_id):
+    row = await storage.end_session(user_id)
+    if row is None:
+        return None
+    partner_id, started_at = row
+    await refresh_match_pool(user_id, partner_id)
+    event_log.append("session_end", user_id, partner=partner_id, seconds=int(time.time()) - (started_at or 0))
+    return partner_id
+
+# ========== Block Index ==========
+class BloomFilter:
+    # Untuk user_id (int): negatif = pasti tidak ada, positif = perlu konfirmasi
+    def __init__(self, capacity, fp_rate):
+        self.m = max(64, int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.k = max(1, round(self.m / capacity * math.log(2)))
+        self.bits = bytearray((self.m + 7) // 8)
+
+    def _positions(self, item):
+        h1 = (item * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        h2 = ((item ^ (item >> 31)) * 0xBF58476D1CE4E5B9 & 0xFFFFFFFFFFFFFFFF) | 1
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+class BlockIndex:
+    # outgoing[a] = yang diblok a, incoming[a] = yang memblok a; dimuat lazy per user
+    def __init__(self, max_users, bloom_threshold):
+        self.max_users = max_users
+        self.bloom_threshold = bloom_threshold
+        self.outgoing = OrderedDict()
+        self.incoming = OrderedDict()
+
+    def _entry(self, cache, user_id, query):
+        entry = cache.get(user_id)
+        if entry is not None:
+            cache.move_to_end(user_id)
+            return entry
+        with db() as conn:
+            ids = [row[0] for row in conn.execute(query, (user_id,))]
+        if len(ids) > self.bloom_threshold:
+            entry = BloomFilter(len(ids) * 2, BLOCK_BLOOM_FP_RATE)
+            for other_id in ids:
+                entry.add(other_id)
+        else:
+            entry = set(ids)
+        cache[user_id] = entry
+        if len(cache) > self.max_users:
+            cache.popitem(last=False)
+        return entry
+
+    def blocks(self, user_id, target_id):
+        entry = self._entry(self.outgoing, user_id, "SELECT blocked_id FROM block_list WHERE user_id=?")
+        if target_id not in entry:
+            return False
+        return isinstance(entry, set) or is_blocked(user_id, target_id)
+
+    def blocked_by(self, user_id, other_id):
+        entry = self._entry(self.incoming, user_id, "SELECT user_id FROM block_list WHERE blocked_id=?")
+        if other_id not in entry:
+            return False
+        return isinstance(entry, set) or is_blocked(other_id, user_id)
+
+    def blocked_either(self, user_id, other_id):
+        return self.blocks(user_id, other_id) or self.blocked_by(user_id, other_id)
+
+    def block(self, user_id, blocked_id):
+        # Tulis DB lalu perbarui indeks tanpa await di antaranya, jadi matcher tidak melihat state setengah jadi
+        with db() as conn:
+            c = conn.cursor()
+            c.execute("INSERT OR IGNORE INTO block_list (user_id, blocked_id) VALUES (?,?)", (user_id, blocked_id))
             conn.commit()
-            return partner_id
+        event_log.append("block", blocked_id, actor_id=user_id)
+        entry = self.outgoing.get(user_id)
+        if entry is not None:
+            entry.add(blocked_id)
+        entry = self.incoming.get(blocked_id)
+        if entry is not None:
+            entry.add(user_id)
+
+block_index = BlockIndex(BLOCK_CACHE_USERS, BLOCK_BLOOM_THRESHOLD)
+
+# ========== Match Pool ==========
+class CandidateBuckets:
+    # (gender, pita usia, hobi) -> user idle; satu user ada di satu bucket per hobi yang dimiliki.
+    # Bucket = dict sebagai ordered set: hapus O(1), iterasi mulai dari yang paling lama idle.
+    def __init__(self):
+        self.buckets = {}
+        self.keys = {}
+
+    @staticmethod
+    def band(age):
+        # Usia di atas MATCH_MAX_AGE masuk pita terakhir: semua pita yang ada ikut dipindai candidates()
+        return min(age, MATCH_MAX_AGE) // MATCH_AGE_BAND if age > 0 else -1
+
+    @staticmethod
+    def keys_for(gender_code, age, mask):
+        band = CandidateBuckets.band(age)
+        return tuple((gender_code, band, hobby) for hobby in config.current.derived("hobby_indexes")[mask])
+
+    def add(self, user_id, gender_code, age, mask):
+        keys = self.keys_for(gender_code, age, mask)
+        old = self.keys.get(user_id)
+        if old == keys:
+            return
+        if old:
+            self.remove(user_id)
+        self.keys[user_id] = keys
+        for key in keys:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = {}
+            bucket[user_id] = None
+
+    def remove(self, user_id):
+        for key in self.keys.pop(user_id, ()):
+            bucket = self.buckets[key]
+            del bucket[user_id]
+            if not bucket:
+                del self.buckets[key]
+
+class MatchPool:
+    # Salinan kolom-per-kolom user idle (tidak sedang chat, tidak di-ban) untuk scoring partner
+    def __init__(self, bucketed=False):
+        self.ids = array.array("q")
+        self.genders = array.array("b")
+        self.ages = array.array("h")
+        self.masks = array.array("I")
+        self.pos = {}
+        self.buckets = CandidateBuckets() if bucketed else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, user_id, gender, age, mask):
+        gender_code = GENDERS.index(gender) if gender in GENDERS else -1
+        # Baris lama di DB bisa berisi usia sembarang (sebelum profile_age memvalidasi): dijepit
+        # ke MATCH_MAX_AGE supaya muat di array "h" dan boot tidak gagal
+        age = min(age, MATCH_MAX_AGE) if age and age > 0 else -1
+        i = self.pos.get(user_id)
+        if i is None:
+            self.pos[user_id] = len(self.ids)
+            self.ids.append(user_id)
+            self.genders.append(gender_code)
+            self.ages.append(age)
+            self.masks.append(mask or 0)
+        else:
+            self.genders[i] = gender_code
+            self.ages[i] = age
+            self.masks[i] = mask or 0
+        if self.buckets is not None:
+            self.buckets.add(user_id, gender_code, age, mask or 0)
+
+    def remove(self, user_id):
+        i = self.pos.pop(user_id, None)
+        if i is None:
+            return
+        if self.buckets is not None:
+            self.buckets.remove(user_id)
+        # Swap dengan elemen terakhir agar O(1)
+        last = len(self.ids) - 1
+        if i != last:
+            moved = self.ids[last]
+            self.ids[i] = moved
+            self.genders[i] = self.genders[last]
+            self.ages[i] = self.ages[last]
+            self.masks[i] = self.masks[last]
+            self.pos[moved] = i
+        for column in (self.ids, self.genders, self.ages, self.masks):
+            column.pop()
+
+    def ranked(self, user_id, want_mask, target_age=None, gender=None, age_min=None, age_max=None, limit=MATCH_TOP_K):
+        # Kandidat terbaik (skor tertinggi dulu): hobi sama (popcount AND), selisih usia, filter gender/usia
+        if not self.ids:
+            return []
+        gender_code = GENDERS.index(gender) if gender in GENDERS else None
+        if load_numpy() is not None:
+            return self._ranked_numpy(user_id, want_mask, target_age, gender_code, age_min, age_max, limit)
+        scored = []
+        for pid, g, age, mask in zip(self.ids, self.genders, self.ages, self.masks):
+            if pid == user_id or (gender_code is not None and g != gender_code):
+                continue
+            if age_min and age_max and not (age_min <= age <= age_max):
+                continue
+            score = MATCH_HOBBY_WEIGHT * (mask & want_mask).bit_count()
+            if target_age:
+                score -= MATCH_AGE_WEIGHT * abs(age - target_age) if age > 0 else MATCH_AGE_UNKNOWN_PENALTY
+            scored.append((score, pid))
+        return [pid for _, pid in heapq.nlargest(limit, scored)]
+
+    def candidates(self, user_id, gender=None, hobby=None, own_mask=0, target_age=None, age_min=None, age_max=None):
+        # Kandidat dari bucket, urut preferensi: hobi dicari (atau hobi sendiri) dulu, lalu pita usia terdekat.
+        # Jumlah bucket yang dibuka tidak bergantung pada jumlah user.
+        genders = [GENDERS.index(gender)] if gender in GENDERS else list(range(len(GENDERS))) + [-1]
+        cfg = config.current
+        hobbies = cfg["hobbies"]
+        preferred = [hobbies.index(hobby)] if hobby in hobbies else [i for i in cfg.derived("hobby_indexes")[own_mask or 0] if i >= 0]
+        others = [i for i in range(-1, len(hobbies)) if i not in preferred]
+        band_of = CandidateBuckets.band
+        target_band = band_of(target_age or 0)
+        if age_min and age_max:
+            bands = sorted(range(band_of(age_min), band_of(age_max) + 1), key=lambda band: abs(band - target_band))
+        else:
+            bands = sorted(range(band_of(MATCH_MAX_AGE) + 1), key=lambda band: abs(band - target_band)) + [-1]
+        buckets = self.buckets.buckets
+        for hobbies in (preferred, others):
+            for band in bands:
+                for gender_code in genders:
+                    for hobby_index in hobbies:
+                        bucket = buckets.get((gender_code, band, hobby_index))
+                        if not bucket:
+                            continue
+                        for pid in bucket:
+                            if pid == user_id:
+                                continue
+                            if age_min and age_max and not (age_min <= self.ages[self.pos[pid]] <= age_max):
+                                continue
+                            yield pid
+
+    def _ranked_numpy(self, user_id, want_mask, target_age, gender_code, age_min, age_max, limit):
+        ids = np.frombuffer(self.ids, dtype=np.int64)
+        ages = np.frombuffer(self.ages, dtype=np.int16).astype(np.int32)
+        overlap = np.frombuffer(self.masks, dtype=np.uint32) & np.uint32(want_mask)
+        score = MATCH_HOBBY_WEIGHT * (POPCOUNT16[overlap & 0xFFFF] + POPCOUNT16[overlap >> 16])
+        if target_age:
+            score -= np.where(ages > 0, MATCH_AGE_WEIGHT * np.abs(ages - target_age), MATCH_AGE_UNKNOWN_PENALTY)
+        valid = ids != user_id
+        if gender_code is not None:
+            valid &= np.frombuffer(self.genders, dtype=np.int8) == gender_code
+        if age_min and age_max:
+            valid &= (ages >= age_min) & (ages <= age_max)
+        candidates = np.flatnonzero(valid)
+        if len(candidates) > limit:
+            top = np.argpartition(-score[candidates], limit)[:limit]
+            candidates = candidates[top]
+        candidates = candidates[np.argsort(-score[candidates], kind="stable")]
+        return ids[candidates].tolist()
+
+match_pool = MatchPool(bucketed=True)
+
+async def load_match_pool():
+    for row in await storage.idle_profiles():
+        match_pool.add(*row)
+    logger.info("Match pool loaded: %d idle users.", len(match_pool))
+
+async def refresh_match_pool(*user_ids):
+    # Sinkronkan pool dengan DB untuk user tertentu (setelah session selesai, unban, ubah profil)
+    idle = {row[0]: row[1:] for row in await storage.idle_profiles(user_ids)}
+    for uid in user_ids:
+        if uid in idle:
+            match_pool.add(uid, *idle[uid])
+        else:
+            match_pool.remove(uid)
+
+async def find_partner(user_id, gender_pref=None, hobby_pref=None, age_min=None, age_max=None):
+    # Pencarian Pro: kandidat pertama dari bucket yang belum terhubung dan tidak diblok
+    profile = await get_profile(user_id)
+    target_age = (age_min + age_max) // 2 if age_min and age_max else profile.get("age")
+    for pid in match_pool.candidates(user_id, gender_pref, hobby_pref, profile.get("hobby_mask"), target_age, age_min, age_max):
+        if not block_index.blocked_either(user_id, pid):
+            return pid
     return None
 
-def find_partner(user_id, gender_pref=None, hobby_pref=None, age_min=None, age_max=None):
-    # Cari pasangan yang belum terhubung dan tidak diblok
+async def check_match_pool(repair=False):
+    # Bandingkan pool & bucket dengan DB; kembalikan jumlah user yang tidak konsisten
+    rows = await storage.idle_profiles()
+    expected = {}
+    for user_id, gender, age, mask in rows:
+        gender_code = GENDERS.index(gender) if gender in GENDERS else -1
+        expected[user_id] = (gender_code, age if age else -1, mask or 0)
+    drift = []
+    for user_id, (gender_code, age, mask) in expected.items():
+        i = match_pool.pos.get(user_id)
+        if (i is None or (match_pool.genders[i], match_pool.ages[i], match_pool.masks[i]) != (gender_code, age, mask)
+                or match_pool.buckets.keys.get(user_id) != CandidateBuckets.keys_for(gender_code, age, mask)):
+            drift.append(user_id)
+    drift += [user_id for user_id in match_pool.pos if user_id not in expected]
+    drift += [user_id for user_id in match_pool.buckets.keys if user_id not in expected and user_id not in match_pool.pos]
+    if drift and repair:
+        for user_id in drift:
+            match_pool.remove(user_id)
+            match_pool.buckets.remove(user_id)
+        # Baca ulang dari storage, bukan dari snapshot di atas yang mungkin sudah basi
+        await refresh_match_pool(*drift)
+    return len(drift)
+
+async def match_pool_check_job(context: ContextTypes.DEFAULT_TYPE):
+    drift = await check_match_pool(repair=True)
+    if drift:
+        logger.warning("Match pool drift: %d users resynced from the database.", drift)
+
+# ========== Waiting Room ==========
+class WaitEntry:
+    __slots__ = ("user_id", "gender", "age", "mask", "gender_pref", "hobby_pref",
+                 "age_min", "age_max", "is_pro", "enqueued_at", "stage", "timer")
+
+    def __init__(self, user_id, profile, gender_pref, hobby_pref, age_min, age_max, is_pro, enqueued_at):
+        self.user_id = user_id
+        self.gender = profile.get("gender")
+        self.age = profile.get("age")
+        self.mask = profile.get("hobby_mask") or 0
+        self.gender_pref = gender_pref
+        self.hobby_pref = hobby_pref
+        self.age_min = age_min
+        self.age_max = age_max
+        self.is_pro = is_pro
+        self.enqueued_at = enqueued_at
+        self.stage = 0
+        self.timer = None
+
+    def accepts(self, other):
+        # Apakah kandidat memenuhi kriteria user ini pada tahap pelonggaran sekarang
+        if self.gender_pref and self.stage < 3 and other.gender != self.gender_pref:
+            return False
+        if self.hobby_pref and self.stage < 1 and not other.mask & config.current.derived("hobby_bits").get(self.hobby_pref, 0):
+            return False
+        if self.age_min and self.age_max:
+            slack = WAIT_AGE_SLACK * max(0, self.stage - 1)
+            if not other.age or not self.age_min - slack <= other.age <= self.age_max + slack:
+                return False
+        return True
+
+class WaitingRoom:
+    # Antrian pencarian berbasis event: dicocokkan saat user datang dan saat kriteria dilonggarkan
+    def __init__(self):
+        self.entries = {}
+        self.pool = MatchPool()
+        self.wait_times = deque(maxlen=1000)
+        self.matched = 0
+        self.timeouts = 0
+
+    def __contains__(self, user_id):
+        return user_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    async def enqueue(self, user_id, gender_pref=None, hobby_pref=None, age_min=None, age_max=None, is_pro=False, enqueued_at=None):
+        # Kembalikan partner_id bila langsung cocok, None bila masuk antrian
+        profile = await get_profile(user_id)
+        self.discard(user_id)
+        now = int(time.time())
+        entry = WaitEntry(user_id, profile, gender_pref, hobby_pref, age_min, age_max, is_pro, enqueued_at or now)
+        with db() as conn:
+            c = conn.cursor()
+            c.execute("INSERT OR REPLACE INTO chat_queue (user_id, gender_pref, hobby_pref, age_min, age_max, is_pro, enqueued_at) VALUES (?,?,?,?,?,?,?)",
+                      (user_id, gender_pref, hobby_pref, age_min, age_max, int(is_pro), entry.enqueued_at))
+            conn.commit()
+        self.entries[user_id] = entry
+        self.pool.add(user_id, entry.gender, entry.age, entry.mask)
+        for _ in range(len(WAIT_RELAX_AFTER)):
+            if now - entry.enqueued_at < WAIT_RELAX_AFTER[entry.stage]:
+                break
+            entry.stage += 1
+        self.schedule(entry)
+        return await self.match(entry)
+
+    def schedule(self, entry):
+        deadline = WAIT_RELAX_AFTER[entry.stage] if entry.stage < len(WAIT_RELAX_AFTER) else WAIT_TIMEOUT
+        delay = max(0, entry.enqueued_at + deadline - time.time())
+        entry.timer = asyncio.get_running_loop().call_later(delay, lambda: asyncio.ensure_future(self.advance(entry.user_id)))
+
+    async def advance(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return
+        if entry.stage >= len(WAIT_RELAX_AFTER):
+            self.discard(user_id)
+            self.timeouts += 1
+            outbox.send(PRIO_NOTIFY, "send_message", user_id, tr(user_id, "search_timeout"), reply_markup=menu(user_id, "main"))
+            return
+        entry.stage += 1
+        self.schedule(entry)
+        await self.match(entry)
+
+    async def match(self, entry):
+        want_mask = config.current.derived("hobby_bits").get(entry.hobby_pref, 0) if entry.hobby_pref else entry.mask
+        target_age = (entry.age_min + entry.age_max) // 2 if entry.age_min and entry.age_max else entry.age
+        for limit in (MATCH_TOP_K, len(self.pool)):
+            for pid in self.pool.ranked(entry.user_id, want_mask, target_age, limit=limit):
+                other = self.entries[pid]
+                if entry.accepts(other) and other.accepts(entry) and not block_index.blocked_either(entry.user_id, pid):
+                    await self.pair(entry, other)
+                    return pid
+            if limit >= len(self.pool):
+                break
+        return None
+
+    async def pair(self, entry, other):
+        now = time.time()
+        for e in (entry, other):
+            self.wait_times.append(now - e.enqueued_at)
+        self.matched += 1
+        await add_session(entry.user_id, other.user_id)
+        await announce_match(entry.user_id, other.user_id)
+
+    def discard(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry is None:
+            return False
+        if entry.timer:
+            entry.timer.cancel()
+        self.pool.remove(user_id)
+        with db() as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM chat_queue WHERE user_id=?", (user_id,))
+            conn.commit()
+        return True
+
+    def stats(self):
+        waits = list(self.wait_times)
+        return {
+            "waiting": len(self.entries),
+            "matched": self.matched,
+            "timeouts": self.timeouts,
+            "wait_p50": percentile(waits, 0.5),
+            "wait_p90": percentile(waits, 0.9),
+            "wait_p99": percentile(waits, 0.99),
+        }
+
+waiting_room = WaitingRoom()
+
+async def load_waiting_room():
+    # Pulihkan antrian dari chat_queue setelah restart (user yang sudah chat dilewati)
     with db() as conn:
         c = conn.cursor()
-        block_ids = [row[0] for row in c.execute("SELECT blocked_id FROM block_list WHERE user_id=?", (user_id,))]
-        query = "SELECT u.user_id, u.hobbies FROM user_profiles u LEFT JOIN sessions s ON u.user_id=s.user_id WHERE u.user_id!=? AND s.user_id IS NULL AND u.is_banned=0"
-        params = [user_id]
-        if gender_pref:
-            query += " AND u.gender=?"
-            params.append(gender_pref)
-        if age_min and age_max:
-            query += " AND u.age BETWEEN ? AND ?"
-            params += [age_min, age_max]
-        c.execute(query, tuple(params))
-        partners = c.fetchall()
-        # Prioritas: gender + hobi
-        if hobby_pref:
-            for pid, hobbies_str in partners:
-                if pid in block_ids: continue
-                hobbies = hobbies_str.split(",") if hobbies_str else []
-                if hobby_pref in hobbies:
-                    return pid
-            # Fallback: gender saja
-            for pid, hobbies_str in partners:
-                if pid in block_ids: continue
-                return pid
-            return None
+        rows = c.execute("SELECT user_id, gender_pref, hobby_pref, age_min, age_max, is_pro, enqueued_at FROM chat_queue").fetchall()
+        c.execute("DELETE FROM chat_queue")
+        conn.commit()
+    for uid, gender_pref, hobby_pref, age_min, age_max, pro, enqueued_at in rows:
+        if uid not in waiting_room and not await is_in_chat(uid):
+            await waiting_room.enqueue(uid, gender_pref, hobby_pref, age_min, age_max, bool(pro), enqueued_at)
+    logger.info("Waiting room restored: %d users.", len(waiting_room))
+
+# ========== Anti-Flood ==========
+RL_ALLOW, RL_DROP, RL_NOTICE, RL_BAN = range(4)
+
+class RateLimiter:
+    # Token bucket per user_id. State: [tokens, last_refill, strikes, strike_start, last_notice]
+    def __init__(self, burst, refill, max_users):
+        self.burst = burst
+        self.refill = refill
+        self.max_users = max_users
+        self.buckets = OrderedDict()
+        self.banned = {}  # user_id -> banned_until (epoch), cache agar user yang di-ban tidak menyentuh DB
+
+    def check(self, user_id, cost, now=None):
+        if now is None:
+            now = time.monotonic()
+        state = self.buckets.get(user_id)
+        if state is None:
+            state = [self.burst, now, 0, now, -RATE_LIMIT_NOTICE_INTERVAL]
+            self.buckets[user_id] = state
+            if len(self.buckets) > self.max_users:
+                self.buckets.popitem(last=False)
         else:
-            for pid, hobbies_str in partners:
-                if pid in block_ids: continue
-                return pid
-            return None
+            self.buckets.move_to_end(user_id)
+            tokens = state[0] + (now - state[1]) * self.refill
+            state[0] = tokens if tokens < self.burst else self.burst
+            state[1] = now
+        if state[0] >= cost:
+            state[0] -= cost
+            return RL_ALLOW
+        # Pelanggaran: hitung strike dalam window
+        if now - state[3] > RATE_LIMIT_STRIKE_WINDOW:
+            state[2] = 0
+            state[3] = now
+        state[2] += 1
+        if state[2] >= RATE_LIMIT_STRIKES:
+            state[2] = 0
+            return RL_BAN
+        if now - state[4] >= RATE_LIMIT_NOTICE_INTERVAL:
+            state[4] = now
+            return RL_NOTICE
+        return RL_DROP
+
+rate_limiter = RateLimiter(RATE_LIMIT_BURST, RATE_LIMIT_REFILL, RATE_LIMIT_MAX_USERS)
+
+def update_cost(update: Update):
+    if update.callback_query:
+        return RATE_LIMIT_COSTS["light"]
+    msg = update.message
+    if msg is None:
+        return RATE_LIMIT_COSTS["light"]
+    text = msg.text
+    if text:
+        key = text.split(None, 1)[0].split("@", 1)[0] if text[0] == "/" else BUTTON_KEYS.get(text)
+        return RATE_LIMIT_COSTS[RATE_LIMIT_CLASSES.get(key, "light")]
+    if msg.photo or msg.video or msg.voice:
+        return RATE_LIMIT_COSTS["media"]
+    return RATE_LIMIT_COSTS["light"]
+
+async def ban_temporarily(user_id, seconds):
+    banned_until = int(time.time()) + seconds
+    await storage.set_ban(user_id, banned_until)
+    rate_limiter.banned[user_id] = banned_until
+    event_log.append("ban", user_id, until=banned_until, reason="flood")
+    cached = user_cache.peek(user_id)
+    if cached:
+        cached.banned = True
+        cached.banned_until = banned_until
+    match_pool.remove(user_id)
+    return banned_until
+
+async def rate_limit_notice(update: Update, text):
+    if update.callback_query:
+        await update.callback_query.answer(text)
+    elif update.effective_message:
+        await update.effective_message.reply_text(text)
+
+async def rate_limit_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Dijalankan sebelum semua handler (group -1); ApplicationHandlerStop = update dibuang
+    user = update.effective_user
+    if user is None:
+        return
+    # Dimuat sebelum handler: tr(), check_ban_status dsb. membaca user_cache secara sinkron
+    await user_cache.load(user.id)
+    if user.id == OWNER_ID:
+        return
+    banned_until = rate_limiter.banned.get(user.id)
+    if banned_until:
+        if banned_until > time.time():
+            raise ApplicationHandlerStop
+        del rate_limiter.banned[user.id]
+    verdict = rate_limiter.check(user.id, update_cost(update))
+    if verdict == RL_ALLOW:
+        return
+    if verdict == RL_BAN:
+        banned_until = await ban_temporarily(user.id, RATE_LIMIT_BAN_SECONDS)
+        logger.warning("User %s auto-banned for flooding until %s", user.id, banned_until)
+        await rate_limit_notice(update, tr(user.id, "flood_banned", until=datetime.fromtimestamp(banned_until).strftime("%Y-%m-%d %H:%M")))
+    elif verdict == RL_NOTICE:
+        await rate_limit_notice(update, tr(user.id, "flood_slow_down"))
+    raise ApplicationHandlerStop
+
+# ========== Outbound (Bot API) ==========
+# Urutan prioritas: relay chat duluan, broadcast paling belakang
+PRIO_RELAY, PRIO_NOTIFY, PRIO_OWNER, PRIO_BROADCAST = range(4)
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class TokenBucket:
+    # Reservasi token: token boleh minus, hasilnya = berapa detik harus menunggu
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def reserve(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class OutboxItem:
+    __slots__ = ("priority", "enqueued_at", "method", "chat_id", "args", "kwargs", "future", "attempts")
+
+    def __init__(self, priority, method, chat_id, args, kwargs, future):
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.method = method
+        self.chat_id = chat_id
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+# True di task pengiriman Outbox: request-nya sudah lewat bucket global, jangan dihitung dua kali
+outbox_delivering = contextvars.ContextVar("outbox_delivering", default=False)
+
+def _consume_exception(future):
+    # Hindari warning "exception was never retrieved" untuk pengiriman fire-and-forget
+    if not future.cancelled():
+        future.exception()
+
+class Outbox:
+    # Semua send_*/delete_message ke Bot API lewat sini. Per chat FIFO: hanya item terdepan satu chat
+    # yang aktif (menunggu bucket chat, di antrian prioritas, terkirim atau menunggu retry); sisanya
+    # menunggu di lane chat itu. Antar chat tetap paralel & berurutan prioritas.
+    def __init__(self):
+        self.bot = None
+        self.queue = None
+        self.task = None
+        self.slots = None
+        self.lanes = {}             # chat_id -> deque item berikutnya; key ada = chat punya item aktif
+        self.pending = 0            # item diterima, belum selesai (termasuk inflight)
+        self.inflight = 0
+        self.seq = itertools.count()
+        self.global_bucket = TokenBucket(OUTBOX_GLOBAL_RATE, OUTBOX_GLOBAL_RATE)
+        self.chat_buckets = OrderedDict()
+        self.paused_until = 0.0
+        self.pending_owner = None
+        self.delays = deque(maxlen=2000)
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+
+    def start(self, bot):
+        self.bot = bot
+        self.queue = asyncio.PriorityQueue()
+        self.slots = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def drain(self, timeout):
+        # Tunggu antrian kosong & semua request selesai; kembalikan jumlah kiriman yang tertinggal
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return self.pending
+
+    def send(self, priority, method, chat_id, *args, **kwargs):
+        # Kembalikan Future; handler boleh await (butuh hasil) atau abaikan (fire-and-forget)
+        text = args[0] if args else kwargs.get("text")
+        pending = self.pending_owner
+        if (pending is not None and method == "send_message" and chat_id == OWNER_ID
+                and not kwargs and len(args) == 1 and not pending.kwargs
+                and len(pending.args[0]) + len(text) < OUTBOX_OWNER_COALESCE_CHARS):
+            pending.args = (pending.args[0] + "\n\n" + text,)
+            self.coalesced += 1
+            return pending.future
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        item = OutboxItem(priority, method, chat_id, args, kwargs, future)
+        if method == "send_message" and chat_id == OWNER_ID and not kwargs and len(args) == 1:
+            self.pending_owner = item
+        self.pending += 1
+        lane = self.lanes.get(chat_id)
+        if lane is not None:
+            lane.append(item)
+        else:
+            self.lanes[chat_id] = deque()
+            self.schedule(item)
+        return future
+
+    def schedule(self, item):
+        # Jeda bucket chat ditunggu di sini (timer), bukan sambil memegang slot pengiriman
+        delay = self.chat_bucket(item.chat_id).reserve()
+        if delay:
+            asyncio.get_running_loop().call_later(delay, self.enqueue, item)
+        else:
+            self.enqueue(item)
+
+    def enqueue(self, item):
+        self.queue.put_nowait((item.priority, next(self.seq), item))
+
+    def chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST)
+            if len(self.chat_buckets) > OUTBOX_MAX_CHATS:
+                self.chat_buckets.popitem(last=False)
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def pause(self, error):
+        # Flood control berlaku untuk seluruh bot: dispatcher & balasan langsung ikut tertahan
+        wait = error.retry_after.total_seconds() if isinstance(error.retry_after, timedelta) else error.retry_after
+        self.paused_until = max(self.paused_until, time.monotonic() + wait)
+        return wait
+
+    async def admit(self):
+        pause = self.paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        delay = self.global_bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def run(self):
+        while True:
+            _, _, item = await self.queue.get()
+            if item is self.pending_owner:
+                self.pending_owner = None
+            await self.admit()
+            await self.slots.acquire()
+            self.inflight += 1
+            asyncio.create_task(self.deliver(item))
+
+    async def deliver(self, item):
+        outbox_delivering.set(True)
+        result = error = wait = None
+        if not item.attempts:
+            self.delays.append(time.monotonic() - item.enqueued_at)
+        try:
+            result = await getattr(self.bot, item.method)(item.chat_id, *item.args, **item.kwargs)
+        except RetryAfter as e:
+            wait = self.pause(e)
+            error = e
+        except BadRequest as e:
+            error = e
+        except (TimedOut, NetworkError) as e:
+            wait = 2 ** item.attempts
+            error = e
+        except Exception as e:
+            error = e
+        finally:
+            self.inflight -= 1
+            self.slots.release()
+        if wait is not None and item.attempts < OUTBOX_MAX_RETRIES:
+            # Slot dilepas selama menunggu; lane chat tetap tertahan sampai item ini selesai
+            item.attempts += 1
+            self.retried += 1
+            asyncio.get_running_loop().call_later(wait, self.enqueue, item)
+            return
+        self.finish(item, result, error)
 
-# ========== Menu Keyboard ==========
-MAIN_MENU = ReplyKeyboardMarkup([
-    [KeyboardButton("Find a partner"), KeyboardButton("Search Pro")],
-    [KeyboardButton("My Profile"), KeyboardButton("Upgrade to Pro")],
-    [KeyboardButton("Play Quiz"), KeyboardButton("Join Group")],
-], resize_keyboard=True)
+    def finish(self, item, result, error):
+        if error is None:
+            self.sent += 1
+            if not item.future.done():
+                item.future.set_result(result)
+        else:
+            self.failed += 1
+            logger.warning("Outbox %s to %s failed: %s", item.method, item.chat_id, error)
+            if not item.future.done():
+                item.future.set_exception(error)
+        self.pending -= 1
+        lane = self.lanes[item.chat_id]
+        if lane:
+            self.schedule(lane.popleft())
+        else:
+            del self.lanes[item.chat_id]
+
+    def stats(self):
+        delays = list(self.delays)
+        return {
+            "queued": self.pending - self.inflight,
+            "chats": len(self.lanes),
+            "inflight": self.inflight,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "coalesced": self.coalesced,
+            "delay_p50": percentile(delays, 0.5),
+            "delay_p95": percentile(delays, 0.95),
+            "delay_max": max(delays) if delays else 0.0,
+        }
+
+outbox = Outbox()
+
+# ========== Owner Alert Digest ==========
+class AlertDigest:
+    # Buffer per tipe: subject (user_id) -> [jumlah, label, detail terakhir]
+    def __init__(self):
+        self.events = {}
+        self.total = 0
+        self.started_at = time.time()
+
+    def add(self, kind, subject, label, detail=""):
+        bucket = self.events.setdefault(kind, {})
+        entry = bucket.get(subject)
+        if entry:
+            entry[0] += 1
+            entry[2] = detail
+        else:
+            bucket[subject] = [1, label, detail]
+        self.total += 1
+        if self.total >= ALERT_DIGEST_MAX_EVENTS:
+            self.flush()
+
+    def render(self):
+        minutes = max(1, int((time.time() - self.started_at) / 60))
+        lines = [f"📋 Ringkasan alert ({minutes} menit terakhir)"]
+        for kind, bucket in self.events.items():
+            count = sum(entry[0] for entry in bucket.values())
+            lines.append(f"\n{ALERT_TITLES.get(kind, kind)}: {count}x dari {len(bucket)} user")
+            top = sorted(bucket.values(), key=lambda entry: entry[0], reverse=True)
+            for n, label, detail in top[:ALERT_DIGEST_TOP]:
+                lines.append(f"• {label} ×{n}" + (f": {detail[:80]}" if detail else ""))
+            if len(top) > ALERT_DIGEST_TOP:
+                lines.append(f"• +{len(top) - ALERT_DIGEST_TOP} user lainnya")
+        return "\n".join(lines)[:4000]
+
+    def flush(self):
+        if self.total:
+            outbox.send(PRIO_OWNER, "send_message", OWNER_ID, self.render())
+        self.events = {}
+        self.total = 0
+        self.started_at = time.time()
+
+owner_alerts = AlertDigest()
+
+async def alert_digest_job(context: ContextTypes.DEFAULT_TYPE):
+    owner_alerts.flush()
+
+# ========== Bahasa (i18n) ==========
+DEFAULT_LANG = "Indonesian"
+
+# Label tombol per bahasa; key dipakai untuk routing & kelas biaya anti-flood
+BUTTONS = {
+    "Indonesian": {
+        "find": "Cari Partner", "search_pro": "Cari Pro", "profile": "Profil Saya", "upgrade": "Upgrade ke Pro",
+        "quiz": "Main Quiz", "join_group": "Gabung Grup", "next": "Lanjut", "stop": "Berhenti",
+        "feedback": "Feedback", "poll": "Polling", "secret": "Mode Rahasia", "leave_group": "Keluar Grup",
+    },
+    "English": {
+        "find": "Find a partner", "search_pro": "Search Pro", "profile": "My Profile", "upgrade": "Upgrade to Pro",
+        "quiz": "Play Quiz", "join_group": "Join Group", "next": "Next", "stop": "Stop",
+        "feedback": "Feedback", "poll": "Poll", "secret": "Secret Mode", "leave_group": "Leave Group",
+    },
+}
+
+MESSAGES = {
+    "Indonesian": {
+        "welcome_incomplete": "👋 Selamat datang di Anonymous Chat!\nProfilmu belum lengkap.",
+        "btn_complete_profile": "Lengkapi Profil",
+        "btn_skip_profile": "Lanjutkan & Cari Acak",
+        "welcome": (
+            "👋 Selamat datang!\n\nPerintah utama:\n"
+            "/profile - Atur profilmu\n"
+            "/upgrade - Upgrade ke Pro\n"
+            "/stop - Akhiri chat\n"
+            "/next - Cari partner baru\n"
+            "/report - Laporkan partner\n"
+            "/playquiz - Main quiz\n"
+            "/joingroup - Join group\n"
+            "/feedback - Feedback chat\n"
+            "/poll - Polling anonim\n"
+            "/help - Bantuan\n"
+        ),
+        "help": (
+            "📖 Bot Anonymous Chat:\n"
+            "• '{find}' - Cari partner acak\n"
+            "• '{search_pro}' - Cari partner Pro (gender/hobi)\n"
+            "• '{profile}' - Atur profilmu\n"
+            "• '{upgrade}' - Beli langganan Pro\n"
+            "• '{quiz}' - Main quiz dan dapat Pro/poin\n"
+            "• '{join_group}' - Grup anonim\n"
+            "• /report - Laporkan partner\n"
+            "• /ban, /unban, /grant_pro, /broadcast, /adminstats (Owner)\n"
+            "• /stop, /next - Akhiri/Cari chat baru\n"
+            "• /feedback - Feedback chat\n"
+            "• /poll - Polling chat/group\n"
+            "• /secretmode - Aktifkan mode pesan rahasia"
+        ),
+        "banned_until": "🚫 Kamu di-ban hingga {until}",
+        "owner_only": "❌ Hanya owner yang bisa menggunakan perintah ini.",
+        "flood_banned": "🚫 Terlalu banyak pesan. Kamu di-ban hingga {until}",
+        "flood_slow_down": "⏳ Pelan-pelan! Tunggu sebentar sebelum mengirim lagi.",
+        "ask_gender": "📝 Gender? (Pilih salah satu)",
+        "invalid_gender": "Gender tidak valid. Ulangi.",
+        "ask_age": "Usia kamu?",
+        "invalid_age": "Usia harus angka {min_age}-{max_age}. Ulangi.",
+        "ask_bio": "Bio singkat kamu?",
+        "ask_photo": "Kirim foto profil kamu.",
+        "ask_lang": "Pilih bahasa botmu.",
+        "invalid_lang": "Bahasa tidak valid. Ulangi.",
+        "ask_hobbies": "Pilih hobi kamu (bisa lebih dari satu, pisahkan dengan koma).\nContoh: Music, Coding",
+        "profile_updated": "✅ Profil kamu telah diperbarui!",
+        "profile_cancelled": "Profil batal diatur.",
+        "pro_only": "🚫 Fitur ini hanya untuk Pro. Silakan /upgrade dulu.",
+        "profile_incomplete": "Profil belum lengkap. /profile dulu.",
+        "btn_search_gender": "Gender",
+        "btn_search_hobby": "Hobi",
+        "btn_search_gender_hobby": "Gender & Hobi",
+        "search_type": "Pilih tipe pencarian partner:",
+        "ask_partner_gender": "Gender partner yang kamu cari?",
+        "ask_partner_hobby": "Hobi partner yang kamu cari?",
+        "ask_age_min": "Umur minimum partner?",
+        "ask_age_max": "Umur maksimum partner?",
+        "age_not_number": "Umur harus angka.",
+        "partner_found": "✅ Partner ditemukan! Mulai ngobrol.",
+        "partner_card": "👤 Partnermu\n{gender} · {age} tahun\nHobi: {hobbies}\n{bio}",
+        "queued_with_criteria": "🔎 Partner sesuai kriteria belum ada. Kamu masuk antrian, kami kabari begitu ada yang cocok. ({stop} untuk batal)",
+        "search_timeout": "😔 Belum ada partner yang cocok. Coba lagi nanti.",
+        "still_in_chat": "Kamu masih dalam chat. /stop atau /next dulu.",
+        "still_searching": "🔎 Masih mencari partner... ({stop} untuk batal)",
+        "searching": "🔎 Mencari partner... Kamu akan dikabari begitu ada yang cocok. ({stop} untuk batal)",
+        "next_searching": "Partner diakhiri. Mencari partner baru...",
+        "partner_left": "Partner mengakhiri chat. Kamu kembali ke menu.",
+        "chat_ended": "Chat diakhiri.",
+        "search_cancelled": "Pencarian dibatalkan.",
+        "not_in_chat": "Kamu tidak sedang dalam chat.",
+        "not_chatting": "Kamu tidak sedang chat siapapun.",
+        "not_connected": "Kamu belum terhubung dengan siapapun. Cari partner dulu.",
+        "quiz_question": "Quiz #{quiz_id} : {question}\nJawab dengan /answer <jawaban>",
+        "quiz_none": "Tidak ada quiz aktif yang kamu ikuti.",
+        "quiz_inactive": "Quiz tidak aktif.",
+        "quiz_already_won": "Kamu sudah menang di quiz ini.",
+        "quiz_limit": "Limit pemenang sudah habis.",
+        "btn_quiz_pro": "Tukar Pro 1 hari",
+        "btn_quiz_point": "Ambil 1 poin",
+        "quiz_correct": "Selamat! Pilih hadiahmu:",
+        "quiz_wrong": "Jawaban salah.",
+        "quiz_winners": "🎉 Pemenang Quiz #{quiz_id} Hari Ini:\n{winners}",
+        "reward_pro_day": "✅ Pro bertambah 1 hari! Aktif sampai {until}.",
+        "pro_expired": "⏳ Masa Pro kamu sudah berakhir. Tukar poin dengan /tukarpro7 atau /upgrade untuk memperpanjang.",
+        "reward_point": "✅ Kamu dapat 1 poin! Bisa ditukar Pro nanti.",
+        "points_balance": "Poinmu: {points}\nTukar 7 poin untuk Pro 7 hari? /tukarpro7",
+        "reward_pro_week": "✅ Pro bertambah 7 hari! Aktif sampai {until}.",
+        "points_insufficient": "Poinmu belum cukup.",
+        "reward_already_claimed": "Hadiah quiz ini sudah kamu ambil.",
+        "btn_block": "Block User",
+        "report_choose": "Pilih alasan report atau block:",
+        "report_sent": "✅ Laporan terkirim ke Owner. Terima kasih.",
+        "user_blocked": "✅ User diblok. Kamu tidak akan match dengan user ini lagi.",
+        "group_joined": "✅ Bergabung ke grup #{gid}. Mulai ngobrol!",
+        "group_created": "✅ Grup #{gid} dibuat. Tunggu member lain...",
+        "group_left": "Kamu keluar dari grup #{gid}.",
+        "not_in_group": "Kamu tidak sedang di grup.",
+        "profanity": "⚠️ Kata kasar terdeteksi! Jangan diulang.",
+        "nsfw": "🚫 Gambar tidak aman (NSFW).",
+        "media_blocked": "🚫 Media ini diblokir.",
+        "spam_blocked": "🚫 Pesan ini terdeteksi sebagai spam dan tidak dikirim.",
+        "spam_links": "⏳ Terlalu banyak link/mention. Tunggu sebentar sebelum mengirim lagi.",
+        "feedback_ask": "Beri rating untuk partnermu!",
+        "feedback_thanks": "Terima kasih atas feedbackmu!",
+        "poll_ask": "Kirim pertanyaan polling (opsi pisahkan dengan koma):\nContoh: Apakah kamu suka fitur baru?,Ya,Tidak\n/cancel untuk batal",
+        "poll_bad_format": "Format salah. Minimal 2 opsi, maksimal 10, contoh: Pertanyaan?,Ya,Tidak",
+        "poll_no_audience": "Polling hanya bisa dibuat saat chat dengan partner atau di grup.",
+        "poll_sent": "📊 Polling dikirim ke {count} peserta. Hasil diumumkan dalam {minutes} menit.",
+        "poll_cancelled": "Polling batal dibuat.",
+        "poll_results": "📊 Hasil polling: {question}\n{results}\nTotal suara: {total}",
+        "secret_on": "Mode rahasia aktif. Pesanmu akan dihapus otomatis setelah dibaca.",
+    },
+    "English": {
+        "welcome_incomplete": "👋 Welcome to Anonymous Chat!\nYour profile is incomplete.",
+        "btn_complete_profile": "Complete Profile",
+        "btn_skip_profile": "Continue & Random Search",
+        "welcome": (
+            "👋 Welcome!\n\nMain commands:\n"
+            "/profile - Set up your profile\n"
+            "/upgrade - Upgrade to Pro\n"
+            "/stop - End the chat\n"
+            "/next - Find a new partner\n"
+            "/report - Report your partner\n"
+            "/playquiz - Play a quiz\n"
+            "/joingroup - Join a group\n"
+            "/feedback - Rate the chat\n"
+            "/poll - Anonymous poll\n"
+            "/help - Help\n"
+        ),
+        "help": (
+            "📖 Anonymous Chat Bot:\n"
+            "• '{find}' - Find a random partner\n"
+            "• '{search_pro}' - Pro partner search (gender/hobby)\n"
+            "• '{profile}' - Set up your profile\n"
+            "• '{upgrade}' - Buy a Pro subscription\n"
+            "• '{quiz}' - Play quizzes to win Pro/points\n"
+            "• '{join_group}' - Anonymous group\n"
+            "• /report - Report your partner\n"
+            "• /ban, /unban, /grant_pro, /broadcast, /adminstats (Owner)\n"
+            "• /stop, /next - End/Find a new chat\n"
+            "• /feedback - Rate the chat\n"
+            "• /poll - Chat/group poll\n"
+            "• /secretmode - Enable secret messages"
+        ),
+        "banned_until": "🚫 You are banned until {until}",
+        "owner_only": "❌ Only the owner can use this command.",
+        "flood_banned": "🚫 Too many messages. You are banned until {until}",
+        "flood_slow_down": "⏳ Slow down! Wait a moment before sending again.",
+        "ask_gender": "📝 Gender? (Pick one)",
+        "invalid_gender": "Invalid gender. Try again.",
+        "ask_age": "How old are you?",
+        "invalid_age": "Age must be a number from {min_age} to {max_age}. Try again.",
+        "ask_bio": "A short bio?",
+        "ask_photo": "Send your profile photo.",
+        "ask_lang": "Choose your bot language.",
+        "invalid_lang": "Invalid language. Try again.",
+        "ask_hobbies": "Choose your hobbies (one or more, separated by commas).\nExample: Music, Coding",
+        "profile_updated": "✅ Your profile has been updated!",
+        "profile_cancelled": "Profile setup cancelled.",
+        "pro_only": "🚫 This feature is for Pro users only. Please /upgrade first.",
+        "profile_incomplete": "Your profile is incomplete. Use /profile first.",
+        "btn_search_gender": "Gender",
+        "btn_search_hobby": "Hobby",
+        "btn_search_gender_hobby": "Gender & Hobby",
+        "search_type": "Choose how to search for a partner:",
+        "ask_partner_gender": "Which gender are you looking for?",
+        "ask_partner_hobby": "Which hobby are you looking for?",
+        "ask_age_min": "Partner's minimum age?",
+        "ask_age_max": "Partner's maximum age?",
+        "age_not_number": "Age must be a number.",
+        "partner_found": "✅ Partner found! Start chatting.",
+        "partner_card": "👤 Your partner\n{gender} · {age} years old\nHobbies: {hobbies}\n{bio}",
+        "queued_with_criteria": "🔎 No partner matches yet. You're in the queue and we'll let you know as soon as someone matches. ({stop} to cancel)",
+        "search_timeout": "😔 No matching partner yet. Try again later.",
+        "still_in_chat": "You are still in a chat. Use /stop or /next first.",
+        "still_searching": "🔎 Still searching for a partner... ({stop} to cancel)",
+        "searching": "🔎 Searching for a partner... We'll let you know as soon as someone matches. ({stop} to cancel)",
+        "next_searching": "Chat ended. Looking for a new partner...",
+        "partner_left": "Your partner ended the chat. Back to the menu.",
+        "chat_ended": "Chat ended.",
+        "search_cancelled": "Search cancelled.",
+        "not_in_chat": "You are not in a chat.",
+        "not_chatting": "You are not chatting with anyone.",
+        "not_connected": "You are not connected to anyone. Find a partner first.",
+        "quiz_question": "Quiz #{quiz_id}: {question}\nAnswer with /answer <your answer>",
+        "quiz_none": "You are not in an active quiz.",
+        "quiz_inactive": "This quiz is no longer active.",
+        "quiz_already_won": "You already won this quiz.",
+        "quiz_limit": "The winner limit has been reached.",
+        "btn_quiz_pro": "Redeem 1-day Pro",
+        "btn_quiz_point": "Take 1 point",
+        "quiz_correct": "Congratulations! Choose your prize:",
+        "quiz_wrong": "Wrong answer.",
+        "quiz_winners": "🎉 Today's Quiz #{quiz_id} winners:\n{winners}",
+        "reward_pro_day": "✅ Pro extended by 1 day! Active until {until}.",
+        "pro_expired": "⏳ Your Pro has expired. Redeem points with /tukarpro7 or /upgrade to renew.",
+        "reward_point": "✅ You got 1 point! You can redeem points for Pro later.",
+        "points_balance": "Your points: {points}\nRedeem 7 points for 7 days of Pro? /tukarpro7",
+        "reward_pro_week": "✅ Pro extended by 7 days! Active until {until}.",
+        "points_insufficient": "You don't have enough points.",
+        "reward_already_claimed": "You already claimed the reward for this quiz.",
+        "btn_block": "Block User",
+        "report_choose": "Choose a report reason or block:",
+        "report_sent": "✅ Report sent to the owner. Thank you.",
+        "user_blocked": "✅ User blocked. You won't be matched with this user again.",
+        "group_joined": "✅ Joined group #{gid}. Start chatting!",
+        "group_created": "✅ Group #{gid} created. Waiting for other members...",
+        "group_left": "You left group #{gid}.",
+        "not_in_group": "You are not in a group.",
+        "profanity": "⚠️ Profanity detected! Don't do it again.",
+        "nsfw": "🚫 Unsafe image (NSFW).",
+        "media_blocked": "🚫 This media is blocked.",
+        "spam_blocked": "🚫 This message looks like spam and was not sent.",
+        "spam_links": "⏳ Too many links/mentions. Wait a moment before sending again.",
+        "feedback_ask": "Rate your partner!",
+        "feedback_thanks": "Thanks for your feedback!",
+        "poll_ask": "Send the poll question (separate options with commas):\nExample: Do you like the new feature?,Yes,No\n/cancel to abort",
+        "poll_bad_format": "Wrong format. Use 2 to 10 options, e.g.: Question?,Yes,No",
+        "poll_no_audience": "Polls can only be created while chatting with a partner or in a group.",
+        "poll_sent": "📊 Poll sent to {count} participants. Results in {minutes} minutes.",
+        "poll_cancelled": "Poll cancelled.",
+        "poll_results": "📊 Poll results: {question}\n{results}\nTotal votes: {total}",
+        "secret_on": "Secret mode on. Your messages will be deleted automatically after being read.",
+    },
+}
+
+class _KeepMissing(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+def compile_templates(messages, buttons):
+    # Sekali saat load: label tombol disisipkan, lalu template disimpan sebagai str.format terikat.
+    # Key yang belum diterjemahkan jatuh ke DEFAULT_LANG.
+    base = messages[DEFAULT_LANG]
+    compiled = {}
+    for lang in LANGS:
+        catalog = dict(base, **messages.get(lang, {}))
+        labels = _KeepMissing(buttons[lang])
+        compiled[lang] = {key: text.format_map(labels).format for key, text in catalog.items()}
+    return compiled
+
+def build_keyboards(buttons):
+    keyboards = {}
+    for lang in LANGS:
+        b = buttons[lang]
+        keyboards[lang] = {
+            "main": ReplyKeyboardMarkup([
+                [KeyboardButton(b["find"]), KeyboardButton(b["search_pro"])],
+                [KeyboardButton(b["profile"]), KeyboardButton(b["upgrade"])],
+                [KeyboardButton(b["quiz"]), KeyboardButton(b["join_group"])],
+            ], resize_keyboard=True),
+            "chat": ReplyKeyboardMarkup([
+                [KeyboardButton(b["next"]), KeyboardButton(b["stop"]), KeyboardButton(b["feedback"]), KeyboardButton(b["poll"])],
+                [KeyboardButton(b["secret"])],
+            ], resize_keyboard=True),
+            "group": ReplyKeyboardMarkup([
+                [KeyboardButton(b["leave_group"]), KeyboardButton(b["poll"])],
+            ], resize_keyboard=True),
+        }
+    return keyboards
+
+TEMPLATES = compile_templates(MESSAGES, BUTTONS)
+KEYBOARDS = build_keyboards(BUTTONS)
+# Label tombol (semua bahasa) -> key tombol
+BUTTON_KEYS = {label: key for labels in BUTTONS.values() for key, label in labels.items()}
+
+def button_labels(key):
+    return [BUTTONS[lang][key] for lang in LANGS]
+
+def tr(user_id, key, **kwargs):
+    return TEMPLATES[user_cache.get(user_id).language][key](**kwargs)
+
+def menu(user_id, name):
+    return KEYBOARDS[user_cache.get(user_id).language][name]
+
+# ========== Profile Card ==========
+class ProfileCard:
+    __slots__ = ("photo_id", "thumbnail_checked", "fields", "captions")
+
+    def __init__(self, profile):
+        self.photo_id = profile.get("photo_id")
+        self.thumbnail_checked = False
+        bio = (profile.get("bio") or "").strip()
+        self.fields = {
+            "gender": profile.get("gender") or "?",
+            "age": profile.get("age") or "?",
+            "hobbies": ", ".join(profile.get("hobbies") or []) or "-",
+            "bio": bio[:PROFILE_CARD_BIO_CHARS] + ("…" if len(bio) > PROFILE_CARD_BIO_CHARS else ""),
+        }
+        self.captions = {}
+
+    def caption(self, lang):
+        text = self.captions.get(lang)
+        if text is None:
+            text = self.captions[lang] = TEMPLATES[lang]["partner_card"](**self.fields).rstrip()
+        return text
+
+class ProfileCardCache:
+    # Snapshot profil untuk kartu partner; dibuang saat profil disimpan ulang
+    def __init__(self, max_cards):
+        self.max_cards = max_cards
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, user_id):
+        card = self.entries.get(user_id)
+        if card is not None:
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return card
+        self.misses += 1
+        card = self.entries[user_id] = ProfileCard(await get_profile(user_id))
+        if len(self.entries) > self.max_cards:
+            self.entries.popitem(last=False)
+        return card
+
+    def invalidate(self, user_id):
+        self.entries.pop(user_id, None)
+
+    async def send(self, chat_id, user_id):
+        # Kartu profil user_id (tanpa username) ke chat_id, dalam bahasa penerima
+        card = await self.get(user_id)
+        caption = card.caption(user_cache.get(chat_id).language)
+        if not card.photo_id:
+            return outbox.send(PRIO_NOTIFY, "send_message", chat_id, caption)
+        future = outbox.send(PRIO_NOTIFY, "send_photo", chat_id, card.photo_id, caption=caption)
+        if not card.thumbnail_checked:
+            card.thumbnail_checked = True
+            future.add_done_callback(lambda done: self.remember_thumbnail(card, done))
+        return future
+
+    def remember_thumbnail(self, card, future):
+        # Pakai ukuran kecil dari hasil send_photo pertama untuk kiriman berikutnya
+        if future.cancelled() or future.exception() is not None or not future.result().photo:
+            return
+        sizes = [size for size in future.result().photo if size.width <= PROFILE_CARD_THUMB_WIDTH]
+        if sizes:
+            card.photo_id = max(sizes, key=lambda size: size.width).file_id
 
-CHAT_MENU = ReplyKeyboardMarkup([
-    [KeyboardButton("Next"), KeyboardButton("Stop"), KeyboardButton("Feedback"), KeyboardButton("Poll")],
-    [KeyboardButton("Secret Mode")],
-], resize_keyboard=True)
+profile_cards = ProfileCardCache(PROFILE_CARD_CACHE_SIZE)
 
-GROUP_MENU = ReplyKeyboardMarkup([
-    [KeyboardButton("Leave Group"), KeyboardButton("Poll")],
-], resize_keyboard=True)
+async def announce_match(user_id, partner_id):
+    for uid, other in ((user_id, partner_id), (partner_id, user_id)):
+        outbox.send(PRIO_NOTIFY, "send_message", uid, tr(uid, "partner_found"), reply_markup=menu(uid, "chat"))
+        await profile_cards.send(uid, other)
 
 # ========== State ==========
 PROFILE_GENDER, PROFILE_AGE, PROFILE_BIO, PROFILE_PHOTO, PROFILE_LANG, PROFILE_HOBBY = range(6)
 SEARCH_TYPE, SEARCH_GENDER, SEARCH_HOBBY, SEARCH_AGE_MIN, SEARCH_AGE_MAX = range(6, 11)
 QUIZ_ANSWER = 11
+POLL_TEXT = 12
 
 # ========== Command Handler ==========
 @check_ban_status
 @auto_update_profile
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if not profile_complete(user_id):
+    if not await profile_complete(user_id):
         keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("Lengkapi Profil", callback_data="complete_profile")],
-            [InlineKeyboardButton("Lanjutkan & Cari Acak", callback_data="skip_profile")]
+            [InlineKeyboardButton(tr(user_id, "btn_complete_profile"), callback_data="complete_profile")],
+            [InlineKeyboardButton(tr(user_id, "btn_skip_profile"), callback_data="skip_profile")]
         ])
-        await update.message.reply_text(
-            "👋 Selamat datang di Anonymous Chat!\nProfilmu belum lengkap.",
-            reply_markup=keyboard
-        )
+        await update.message.reply_text(tr(user_id, "welcome_incomplete"), reply_markup=keyboard)
         return
-    await update.message.reply_text(
-        f"👋 Selamat datang!\n\nPerintah utama:\n"
-        "/profile - Atur profilmu\n"
-        "/upgrade - Upgrade ke Pro\n"
-        "/stop - Akhiri chat\n"
-        "/next - Cari partner baru\n"
-        "/report - Laporkan partner\n"
-        "/playquiz - Main quiz\n"
-        "/joingroup - Join group\n"
-        "/feedback - Feedback chat\n"
-        "/poll - Polling anonim\n"
-        "/help - Bantuan\n",
-        reply_markup=MAIN_MENU
-    )
+    await update.message.reply_text(tr(user_id, "welcome"), reply_markup=menu(user_id, "main"))
 
 @check_ban_status
 @auto_update_profile
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "📖 Bot Anonymous Chat:\n"
-        "• 'Find a partner' - Cari partner acak\n"
-        "• 'Search Pro' - Cari partner Pro (gender/hobi)\n"
-        "• 'My Profile' - Atur profilmu\n"
-        "• 'Upgrade to Pro' - Beli langganan Pro\n"
-        "• 'Play Quiz' - Main quiz dan dapat Pro/poin\n"
-        "• 'Join Group' - Grup anonim\n"
-        "• /report - Laporkan partner\n"
-        "• /ban, /unban, /grant_pro, /broadcast, /adminstats (Owner)\n"
-        "• /stop, /next - Akhiri/Cari chat baru\n"
-        "• /feedback - Feedback chat\n"
-        "• /poll - Polling chat/group\n"
-        "• /secretmode - Aktifkan mode pesan rahasia",
-        reply_markup=MAIN_MENU
-    )
+    user_id = update.effective_user.id
+    await update.message.reply_text(tr(user_id, "help"), reply_markup=menu(user_id, "main"))
 
 # ========== Profile Conversation ==========
 @check_ban_status
 @auto_update_profile
 async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
-        "📝 Gender? (Pilih salah satu)",
+        tr(update.effective_user.id, "ask_gender"),
         reply_markup=ReplyKeyboardMarkup([GENDERS], one_time_keyboard=True, resize_keyboard=True)
     )
     return PROFILE_GENDER
@@ -345,60 +2742,63 @@ async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def profile_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
     gender = update.message.text
     if gender not in GENDERS:
-        await update.message.reply_text("Gender tidak valid. Ulangi.")
+        await update.message.reply_text(tr(update.effective_user.id, "invalid_gender"))
         return PROFILE_GENDER
     context.user_data['gender'] = gender
-    await update.message.reply_text("Usia kamu?")
+    await update.message.reply_text(tr(update.effective_user.id, "ask_age"))
     return PROFILE_AGE
 
 async def profile_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         age = int(update.message.text)
     except:
-        await update.message.reply_text("Usia harus angka. Ulangi.")
+        age = None
+    if age is None or not MATCH_MIN_AGE <= age <= MATCH_MAX_AGE:
+        await update.message.reply_text(tr(update.effective_user.id, "invalid_age", min_age=MATCH_MIN_AGE, max_age=MATCH_MAX_AGE))
         return PROFILE_AGE
     context.user_data['age'] = age
-    await update.message.reply_text("Bio singkat kamu?")
+    await update.message.reply_text(tr(update.effective_user.id, "ask_bio"))
     return PROFILE_BIO
 
 async def profile_bio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     bio = update.message.text
     context.user_data['bio'] = bio
-    await update.message.reply_text("Kirim foto profil kamu.")
+    await update.message.reply_text(tr(update.effective_user.id, "ask_photo"))
     return PROFILE_PHOTO
 
 async def profile_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     photo = update.message.photo[-1]
     photo_id = photo.file_id
     context.user_data['photo_id'] = photo_id
-    await update.message.reply_text("Pilih bahasa botmu.",
+    await update.message.reply_text(tr(update.effective_user.id, "ask_lang"),
         reply_markup=ReplyKeyboardMarkup([LANGS], one_time_keyboard=True, resize_keyboard=True))
     return PROFILE_LANG
 
 async def profile_lang(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lang = update.message.text
     if lang not in LANGS:
-        await update.message.reply_text("Bahasa tidak valid. Ulangi.")
+        await update.message.reply_text(tr(update.effective_user.id, "invalid_lang"))
         return PROFILE_LANG
     context.user_data['language'] = lang
-    await update.message.reply_text("Pilih hobi kamu (bisa lebih dari satu, pisahkan dengan koma).\nContoh: Music, Coding",
-        reply_markup=ReplyKeyboardMarkup([HOBBIES], one_time_keyboard=True, resize_keyboard=True))
+    await update.message.reply_text(tr(update.effective_user.id, "ask_hobbies"),
+        reply_markup=config.current.derived("hobby_keyboard"))
     return PROFILE_HOBBY
 
 async def profile_hobby(update: Update, context: ContextTypes.DEFAULT_TYPE):
     hobbies = update.message.text
-    hobby_list = [h.strip() for h in hobbies.split(",") if h.strip() in HOBBIES]
+    hobby_list = [h.strip() for h in hobbies.split(",") if h.strip() in config.current["hobbies"]]
     user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("UPDATE user_profiles SET gender=?, age=?, bio=?, photo_id=?, language=?, hobbies=? WHERE user_id=?",
-                  (context.user_data['gender'], context.user_data['age'], context.user_data['bio'], context.user_data['photo_id'], context.user_data['language'], ",".join(hobby_list), user_id))
-        conn.commit()
-    await update.message.reply_text("✅ Profil kamu telah diperbarui!", reply_markup=MAIN_MENU)
+    await storage.save_profile(user_id, context.user_data['gender'], context.user_data['age'], context.user_data['bio'],
+                               context.user_data['photo_id'], context.user_data['language'], hobby_list)
+    await refresh_match_pool(user_id)
+    user_cache.get(user_id).language = context.user_data['language']
+    profile_cards.invalidate(user_id)
+    await update.message.reply_text(tr(user_id, "profile_updated"), reply_markup=menu(user_id, "main"))
     return ConversationHandler.END
 
 async def profile_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Profil batal diatur.", reply_markup=MAIN_MENU)
+    user_id = update.effective_user.id
+    await update.message.reply_text(tr(user_id, "profile_cancelled"), reply_markup=menu(user_id, "main"))
     return ConversationHandler.END
 
 # ========== Search Pro Conversation ==========
@@ -406,35 +2806,36 @@ async def profile_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @auto_update_profile
 async def search_pro_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if not is_pro(user_id):
-        await update.message.reply_text("🚫 Fitur ini hanya untuk Pro. Silakan /upgrade dulu.", reply_markup=MAIN_MENU)
+    if not await is_pro(user_id):
+        await update.message.reply_text(tr(user_id, "pro_only"), reply_markup=menu(user_id, "main"))
         return
-    if not profile_complete(user_id):
-        await update.message.reply_text("Profil belum lengkap. /profile dulu.", reply_markup=MAIN_MENU)
+    if not await profile_complete(user_id):
+        await update.message.reply_text(tr(user_id, "profile_incomplete"), reply_markup=menu(user_id, "main"))
         return
     keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Gender", callback_data="search_gender"),
-         InlineKeyboardButton("Hobi", callback_data="search_hobby"),
-         InlineKeyboardButton("Gender & Hobi", callback_data="search_gender_hobby")]
+        [InlineKeyboardButton(tr(user_id, "btn_search_gender"), callback_data="search_gender"),
+         InlineKeyboardButton(tr(user_id, "btn_search_hobby"), callback_data="search_hobby"),
+         InlineKeyboardButton(tr(user_id, "btn_search_gender_hobby"), callback_data="search_gender_hobby")]
     ])
-    await update.message.reply_text("Pilih tipe pencarian partner:", reply_markup=keyboard)
+    await update.message.reply_text(tr(user_id, "search_type"), reply_markup=keyboard)
     return SEARCH_TYPE
 
 async def search_type_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    user_id = query.from_user.id
     if query.data == "search_gender":
         await query.answer()
-        await query.edit_message_text("Gender partner yang kamu cari?", reply_markup=ReplyKeyboardMarkup([GENDERS], one_time_keyboard=True, resize_keyboard=True))
+        await query.edit_message_text(tr(user_id, "ask_partner_gender"), reply_markup=ReplyKeyboardMarkup([GENDERS], one_time_keyboard=True, resize_keyboard=True))
         context.user_data['search_mode'] = "gender"
         return SEARCH_GENDER
     elif query.data == "search_hobby":
         await query.answer()
-        await query.edit_message_text("Hobi partner yang kamu cari?", reply_markup=ReplyKeyboardMarkup([HOBBIES], one_time_keyboard=True, resize_keyboard=True))
+        await query.edit_message_text(tr(user_id, "ask_partner_hobby"), reply_markup=config.current.derived("hobby_keyboard"))
         context.user_data['search_mode'] = "hobby"
         return SEARCH_HOBBY
     elif query.data == "search_gender_hobby":
         await query.answer()
-        await query.edit_message_text("Gender partner yang kamu cari?", reply_markup=ReplyKeyboardMarkup([GENDERS], one_time_keyboard=True, resize_keyboard=True))
+        await query.edit_message_text(tr(user_id, "ask_partner_gender"), reply_markup=ReplyKeyboardMarkup([GENDERS], one_time_keyboard=True, resize_keyboard=True))
         context.user_data['search_mode'] = "gender_hobby"
         return SEARCH_GENDER
 
@@ -442,37 +2843,37 @@ async def search_gender_step(update: Update, context: ContextTypes.DEFAULT_TYPE)
     gender_pref = update.message.text
     context.user_data['gender_pref'] = gender_pref
     if context.user_data.get('search_mode') == "gender_hobby":
-        await update.message.reply_text("Hobi partner yang kamu cari?", reply_markup=ReplyKeyboardMarkup([HOBBIES], one_time_keyboard=True, resize_keyboard=True))
+        await update.message.reply_text(tr(update.effective_user.id, "ask_partner_hobby"), reply_markup=config.current.derived("hobby_keyboard"))
         return SEARCH_HOBBY
     else:
-        await update.message.reply_text("Umur minimum partner?")
+        await update.message.reply_text(tr(update.effective_user.id, "ask_age_min"))
         return SEARCH_AGE_MIN
 
 async def search_hobby_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
     hobby_pref = update.message.text
     context.user_data['hobby_pref'] = hobby_pref
     if context.user_data.get('search_mode') == "hobby":
-        await update.message.reply_text("Umur minimum partner?")
+        await update.message.reply_text(tr(update.effective_user.id, "ask_age_min"))
         return SEARCH_AGE_MIN
     else:
-        await update.message.reply_text("Umur minimum partner?")
+        await update.message.reply_text(tr(update.effective_user.id, "ask_age_min"))
         return SEARCH_AGE_MIN
 
 async def search_age_min_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         age_min = int(update.message.text)
     except:
-        await update.message.reply_text("Umur harus angka.")
+        await update.message.reply_text(tr(update.effective_user.id, "age_not_number"))
         return SEARCH_AGE_MIN
     context.user_data['age_min'] = age_min
-    await update.message.reply_text("Umur maksimum partner?")
+    await update.message.reply_text(tr(update.effective_user.id, "ask_age_max"))
     return SEARCH_AGE_MAX
 
 async def search_age_max_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         age_max = int(update.message.text)
     except:
-        await update.message.reply_text("Umur harus angka.")
+        await update.message.reply_text(tr(update.effective_user.id, "age_not_number"))
         return SEARCH_AGE_MAX
     context.user_data['age_max'] = age_max
     user_id = update.effective_user.id
@@ -480,13 +2881,12 @@ async def search_age_max_step(update: Update, context: ContextTypes.DEFAULT_TYPE
     hobby_pref = context.user_data.get('hobby_pref')
     age_min = context.user_data['age_min']
     age_max = context.user_data['age_max']
-    partner_id = find_partner(user_id, gender_pref, hobby_pref, age_min, age_max)
+    partner_id = await find_partner(user_id, gender_pref, hobby_pref, age_min, age_max)
     if partner_id:
-        add_session(user_id, partner_id)
-        await update.message.reply_text("✅ Partner ditemukan! Mulai ngobrol.", reply_markup=CHAT_MENU)
-        await context.bot.send_message(partner_id, "✅ Partner ditemukan! Mulai ngobrol.", reply_markup=CHAT_MENU)
-    else:
-        await update.message.reply_text("😔 Partner sesuai kriteria belum ditemukan.", reply_markup=MAIN_MENU)
+        await add_session(user_id, partner_id)
+        await announce_match(user_id, partner_id)
+    elif not await waiting_room.enqueue(user_id, gender_pref, hobby_pref, age_min, age_max, is_pro=True):
+        await update.message.reply_text(tr(user_id, "queued_with_criteria"), reply_markup=menu(user_id, "main"))
     return ConversationHandler.END
 
 # ========== Quiz/Permainan ==========
@@ -497,140 +2897,139 @@ QUIZ_QUESTIONS = [
 ]
 current_quiz = {}
 
+async def new_quiz_id():
+    # ID unik untuk /playquiz & ronde harian. Key ledger hadiah (quiz:{id}:{user}) permanen, jadi ID
+    # yang sudah punya pemenang tidak boleh dipakai lagi. Bila ID 4 digit mulai habis, rentang melebar
+    high = 9999
+    while True:
+        for _ in range(100):
+            quiz_id = random.randint(1000, high)
+            if quiz_id not in current_quiz and not await storage.quiz_id_used(quiz_id):
+                return quiz_id
+        high = high * 10 + 9
+
 async def play_quiz_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Pilih quiz random
-    quiz_id = random.randint(1000, 9999)
+    quiz_id = await new_quiz_id()
     q_data = random.choice(QUIZ_QUESTIONS)
     current_quiz[quiz_id] = {"question": q_data["q"], "answer": q_data["a"].lower(), "winners": []}
     context.user_data['quiz_id'] = quiz_id
-    await update.message.reply_text(f"Quiz #{quiz_id} : {q_data['q']}\nJawab dengan /answer <jawaban>")
+    context.user_data['quiz_at'] = int(time.time())
+    await update.message.reply_text(tr(update.effective_user.id, "quiz_question", quiz_id=quiz_id, question=q_data['q']))
     context.bot_data['quiz_id'] = quiz_id
 
 async def answer_quiz_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if 'quiz_id' not in context.user_data:
-        await update.message.reply_text("Tidak ada quiz aktif yang kamu ikuti.")
+    quiz_id = context.user_data.get('quiz_id')
+    # Quiz terbaru yang diterima user berlaku: /playquiz pribadi atau ronde harian (quiz_round_job)
+    quiz_round = load_state("quiz_round")
+    if quiz_round is not None and context.user_data.get('quiz_at', 0) < quiz_round["opened_at"]:
+        quiz_id = quiz_round["quiz_id"]
+        if quiz_id not in current_quiz:
+            # Ronde dibuka worker lain atau sebelum restart: pemenang diambil dari storage
+            winners = [uid for uid, _ in await storage.quiz_winners(quiz_id)]
+            current_quiz[quiz_id] = {"question": quiz_round["question"], "answer": quiz_round["answer"], "winners": winners}
+    if quiz_id is None:
+        await update.message.reply_text(tr(user_id, "quiz_none"))
         return
-    quiz_id = context.user_data['quiz_id']
     answer = ' '.join(update.message.text.split()[1:]).lower()
     quiz = current_quiz.get(quiz_id)
     if not quiz:
-        await update.message.reply_text("Quiz tidak aktif.")
+        await update.message.reply_text(tr(user_id, "quiz_inactive"))
         return
     if user_id in quiz["winners"]:
-        await update.message.reply_text("Kamu sudah menang di quiz ini.")
+        await update.message.reply_text(tr(user_id, "quiz_already_won"))
         return
-    if len(quiz["winners"]) >= QUIZ_LIMIT_WINNERS:
-        await update.message.reply_text("Limit pemenang sudah habis.")
+    if len(quiz["winners"]) >= config.current["quiz_limit_winners"]:
+        await update.message.reply_text(tr(user_id, "quiz_limit"))
         return
     if answer == quiz["answer"]:
         quiz["winners"].append(user_id)
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("INSERT INTO quiz_winners (quiz_id, user_id, prize) VALUES (?,?,?)", (quiz_id, user_id, "pending"))
-            conn.commit()
+        await storage.add_quiz_winner(quiz_id, user_id)
         keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("Tukar Pro 1 hari", callback_data=f"quizpro_{quiz_id}"),
-             InlineKeyboardButton("Ambil 1 poin", callback_data=f"quizpoin_{quiz_id}")]
+            [InlineKeyboardButton(tr(user_id, "btn_quiz_pro"), callback_data=f"quizpro_{quiz_id}"),
+             InlineKeyboardButton(tr(user_id, "btn_quiz_point"), callback_data=f"quizpoin_{quiz_id}")]
         ])
-        await update.message.reply_text("Selamat! Pilih hadiahmu:", reply_markup=keyboard)
-        # Broadcast pemenang dengan username sensor
-        winners_masked = [mask_username(update.effective_user.username)]
-        await context.bot.send_message(OWNER_ID, f"🎉 Pemenang Quiz #{quiz_id}: {winners_masked}")
+        await update.message.reply_text(tr(user_id, "quiz_correct"), reply_markup=keyboard)
+        # Pemenang masuk digest owner dengan username sensor
+        owner_alerts.add("quiz_win", user_id, mask_username(update.effective_user.username), f"Quiz #{quiz_id}")
     else:
-        await update.message.reply_text("Jawaban salah.")
+        await update.message.reply_text(tr(user_id, "quiz_wrong"))
 
 async def quiz_reward_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
     quiz_id = int(query.data.split("_")[1])
+    # callback_data bisa dipalsukan: hadiah hanya untuk baris pemenang 'pending' milik user ini,
+    # diklaim di transaksi yang sama dengan ledger. Kedua tombol berbagi key: satu pemenang, satu hadiah
+    key = f"quiz:{quiz_id}:{user_id}"
     if query.data.startswith("quizpro_"):
-        expires_at = int(time.time()) + 86400
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("UPDATE user_profiles SET pro_expires_at=? WHERE user_id=?", (expires_at, user_id))
-            c.execute("UPDATE quiz_winners SET prize=? WHERE quiz_id=? AND user_id=?", ("pro", quiz_id, user_id))
-            conn.commit()
-        await query.answer()
-        await query.edit_message_text("✅ Pro aktif 1 hari!")
-    elif query.data.startswith("quizpoin_"):
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("UPDATE user_profiles SET points=points+1 WHERE user_id=?", (user_id,))
-            c.execute("UPDATE quiz_winners SET prize=? WHERE quiz_id=? AND user_id=?", ("poin", quiz_id, user_id))
-            conn.commit()
-        await query.answer()
-        await query.edit_message_text("✅ Kamu dapat 1 poin! Bisa ditukar Pro nanti.")
+        result, balance = await ledger_apply(user_id, key, 0, "quiz_pro", pro_seconds=QUIZ_PRO_SECONDS, quiz_claim=(quiz_id, "pro"))
+        text = "reward_pro_day"
+    else:
+        result, balance = await ledger_apply(user_id, key, 1, "quiz_point", quiz_claim=(quiz_id, "poin"))
+        text = "reward_point"
+    await query.answer()
+    if result != LEDGER_OK:
+        await query.edit_message_text(tr(user_id, "reward_already_claimed"))
+        return
+    await query.edit_message_text(tr(user_id, text, until=datetime.fromtimestamp(balance[1] or 0).strftime("%Y-%m-%d %H:%M")))
 
 # ========== Poin Tukar Pro ==========
 async def redeem_points_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT points FROM user_profiles WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        points = row[0] if row else 0
-    await update.message.reply_text(f"Poinmu: {points}\nTukar 7 poin untuk Pro 7 hari? /tukarpro7")
+    points = (await storage.get_profile(user_id)).get("points") or 0
+    await update.message.reply_text(tr(user_id, "points_balance", points=points))
 async def tukarpro7_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT points FROM user_profiles WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        points = row[0] if row else 0
-        if points >= 7:
-            expires_at = int(time.time()) + 7*86400
-            c.execute("UPDATE user_profiles SET pro_expires_at=?, points=points-7 WHERE user_id=?", (expires_at, user_id))
-            conn.commit()
-            await update.message.reply_text("✅ Pro aktif 7 hari!")
-        else:
-            await update.message.reply_text("Poinmu belum cukup.")
+    # Key per pesan: update yang terkirim ulang tidak menukar dua kali
+    key = f"tukarpro7:{user_id}:{update.message.message_id}"
+    result, balance = await ledger_apply(user_id, key, -REDEEM_POINTS, "tukarpro7", pro_seconds=REDEEM_PRO_SECONDS)
+    if result == LEDGER_OK:
+        await update.message.reply_text(tr(user_id, "reward_pro_week", until=datetime.fromtimestamp(balance[1]).strftime("%Y-%m-%d %H:%M")))
+    elif result == LEDGER_INSUFFICIENT:
+        await update.message.reply_text(tr(user_id, "points_insufficient"))
 
 # ========== Block User ==========
 async def report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT partner_id FROM sessions WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        if not row:
-            await update.message.reply_text("Kamu tidak sedang chat siapapun.")
-            return
-        partner_id = row[0]
+    partner_id = await partner_of(user_id)
+    if not partner_id:
+        await update.message.reply_text(tr(user_id, "not_chatting"))
+        return
     keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton(reason, callback_data=f"report_{reason}") for reason in REPORT_REASONS],
-        [InlineKeyboardButton("Block User", callback_data=f"block_{partner_id}")]
+        config.current.derived("report_buttons"),
+        [InlineKeyboardButton(tr(user_id, "btn_block"), callback_data=f"block_{partner_id}")]
     ])
-    await update.message.reply_text("Pilih alasan report atau block:", reply_markup=keyboard)
+    await update.message.reply_text(tr(user_id, "report_choose"), reply_markup=keyboard)
 
 async def report_reason_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
     if query.data.startswith("report_"):
         reason = query.data.replace("report_", "")
+        reported_id = await partner_of(user_id)
+        if not reported_id:
+            await query.answer()
+            await query.edit_message_text(tr(user_id, "not_chatting"))
+            return
         with db() as conn:
             c = conn.cursor()
-            c.execute("SELECT partner_id FROM sessions WHERE user_id=?", (user_id,))
-            row = c.fetchone()
-            if not row:
-                await query.answer()
-                await query.edit_message_text("Kamu tidak sedang chat siapapun.")
-                return
-            reported_id = row[0]
             c.execute("INSERT INTO reports (reporter_id, reported_id, reason, timestamp) VALUES (?,?,?,?)",
                       (user_id, reported_id, reason, int(time.time())))
             conn.commit()
+            event_log.append("report", reported_id, actor_id=user_id, reason=reason)
+        row = await storage.user_row(reported_id)
+        reported_name = row[1] if row else None
         await query.answer()
-        await query.edit_message_text("✅ Laporan terkirim ke Owner. Terima kasih.")
-        await context.bot.send_message(OWNER_ID, f"🚩 Report: {mask_username(query.from_user.username)} melaporkan {mask_username('')} Alasan: {reason}")
+        await query.edit_message_text(tr(user_id, "report_sent"))
+        owner_alerts.add("report", reported_id, mask_username(reported_name),
+                         f"{reason} (oleh {mask_username(query.from_user.username)})")
     elif query.data.startswith("block_"):
         blocked_id = int(query.data.split("_")[1])
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("INSERT OR IGNORE INTO block_list (user_id, blocked_id) VALUES (?,?)", (user_id, blocked_id))
-            conn.commit()
+        block_index.block(user_id, blocked_id)
         await query.answer()
-        await query.edit_message_text("✅ User diblok. Kamu tidak akan match dengan user ini lagi.")
+        await query.edit_message_text(tr(user_id, "user_blocked"))
 
 # ========== Group Chat ==========
 async def join_group_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -647,13 +3046,13 @@ async def join_group_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 members.append(str(user_id))
             c.execute("UPDATE groups SET members=? WHERE group_id=?", (",".join(members), gid))
             conn.commit()
-            await update.message.reply_text(f"✅ Bergabung ke grup #{gid}. Mulai ngobrol!", reply_markup=GROUP_MENU)
+            await update.message.reply_text(tr(user_id, "group_joined", gid=gid), reply_markup=menu(user_id, "group"))
         else:
             # Buat group baru
             c.execute("INSERT INTO groups (members, started_at) VALUES (?,?)", (str(user_id), int(time.time())))
             gid = c.lastrowid
             conn.commit()
-            await update.message.reply_text(f"✅ Grup #{gid} dibuat. Tunggu member lain...", reply_markup=GROUP_MENU)
+            await update.message.reply_text(tr(user_id, "group_created", gid=gid), reply_markup=menu(user_id, "group"))
 
 async def leave_group_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -666,13 +3065,14 @@ async def leave_group_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             members = [mid for mid in members_str.split(",") if mid != str(user_id)]
             c.execute("UPDATE groups SET members=? WHERE group_id=?", (",".join(members), gid))
             conn.commit()
-            await update.message.reply_text(f"Kamu keluar dari grup #{gid}.", reply_markup=MAIN_MENU)
+            await update.message.reply_text(tr(user_id, "group_left", gid=gid), reply_markup=menu(user_id, "main"))
         else:
-            await update.message.reply_text("Kamu tidak sedang di grup.")
+            await update.message.reply_text(tr(user_id, "not_in_group"))
 
 # ========== Moderasi Gambar ==========
 def is_nsfw(file_url):
     # Pakai ModerateContent API
+    import requests
     resp = requests.get(NSFW_API_URL, params={"key": NSFW_API_KEY, "url": file_url})
     if resp.ok:
         js = resp.json()
@@ -680,1022 +3080,516 @@ def is_nsfw(file_url):
         return rating and rating != "everyone"
     return False
 
+DCT32 = None
+
+def perceptual_hash(image):
+    # pHash 64-bit: DCT grayscale 32x32, ambil 8x8 frekuensi terendah, bit = di atas median
+    global DCT32
+    import numpy
+    if DCT32 is None:
+        k = numpy.arange(32)
+        DCT32 = numpy.cos(numpy.pi * (2 * k[None, :] + 1) * k[:, None] / 64)
+    pixels = numpy.asarray(image.convert("L").resize((32, 32)), dtype=numpy.float64)
+    low = (DCT32 @ pixels @ DCT32.T)[:8, :8].flatten()
+    bits = low > numpy.median(low[1:])
+    return int.from_bytes(numpy.packbits(bits).tobytes(), "big")
+
+nsfw_session = None                 # sesi ONNX Runtime, satu per proses worker
+
+def nsfw_worker_init(model_path):
+    global nsfw_session
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = 1
+    nsfw_session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+def nsfw_prepare(data):
+    # Di proses worker: decode sekali untuk pHash & input model (uint8 agar IPC kecil)
+    import io
+    import numpy
+    from PIL import Image
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    pixels = numpy.asarray(image.resize((NSFW_INPUT_SIZE, NSFW_INPUT_SIZE)), dtype=numpy.uint8)
+    return perceptual_hash(image), pixels
+
+def nsfw_infer(batch):
+    import numpy
+    inputs = numpy.stack(batch).astype(numpy.float32) / 255
+    scores = nsfw_session.run(None, {nsfw_session.get_inputs()[0].name: inputs})[0]
+    return scores[:, list(NSFW_UNSAFE_CLASSES)].sum(axis=1).tolist()
+
+class HammingIndex:
+    # Multi-index hashing: hash 64-bit dipecah jadi max_distance+1 potongan. Dua hash yang berbeda
+    # <= max_distance bit pasti sama persis di minimal satu potongan, jadi cukup cek isi bucket-nya.
+    def __init__(self, max_distance):
+        self.max_distance = max_distance
+        parts = max_distance + 1
+        bounds = [64 * i // parts for i in range(parts + 1)]
+        self.slices = [(low, (1 << (high - low)) - 1) for low, high in zip(bounds, bounds[1:])]
+        self.tables = [{} for _ in self.slices]
+        self.values = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, phash, value):
+        if phash not in self.values:
+            for table, (shift, mask) in zip(self.tables, self.slices):
+                table.setdefault(phash >> shift & mask, set()).add(phash)
+        self.values[phash] = value
+
+    def remove(self, phash):
+        if self.values.pop(phash, None) is None:
+            return
+        for table, (shift, mask) in zip(self.tables, self.slices):
+            key = phash >> shift & mask
+            table[key].discard(phash)
+            if not table[key]:
+                del table[key]
+
+    def find(self, phash):
+        # Hash terdekat dalam jarak max_distance: (hash, value) atau None
+        if phash in self.values:
+            return phash, self.values[phash]
+        best = None
+        for table, (shift, mask) in zip(self.tables, self.slices):
+            for other in table.get(phash >> shift & mask, ()):
+                distance = (phash ^ other).bit_count()
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, other)
+        return (best[1], self.values[best[1]]) if best else None
+
+class VerdictCache:
+    # Hasil klasifikasi per pHash (LRU); gambar yang hampir sama memakai hasil yang sudah ada
+    def __init__(self, max_entries, max_distance):
+        self.max_entries = max_entries
+        self.index = HammingIndex(max_distance)
+        self.order = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, phash):
+        found = self.index.find(phash)
+        if found is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.order.move_to_end(found[0])
+        return found[1]
+
+    def put(self, phash, verdict):
+        self.index.add(phash, verdict)
+        self.order[phash] = None
+        self.order.move_to_end(phash)
+        if len(self.order) > self.max_entries:
+            oldest, _ = self.order.popitem(last=False)
+            self.index.remove(oldest)
+
+class ApiModerator:
+    # ModerateContent: satu request per foto, dijalankan di thread agar event loop tidak tertahan
+    async def check(self, file):
+        return bool(await asyncio.to_thread(is_nsfw, file.file_path))
+
+    def stop(self):
+        pass
+
+class LocalModerator:
+    # Klasifikasi di CPU: decode & pHash di process pool, inferensi per batch di pool yang sama
+    def __init__(self, model_path=None):
+        self.model_path = model_path or NSFW_MODEL_PATH
+        self.executor = None
+        self.pending = []           # (pixels, future) menunggu batch berikutnya
+        self.flusher = None
+        self.verdicts = VerdictCache(NSFW_VERDICT_CACHE_SIZE, NSFW_PHASH_DISTANCE)
+        self.batches = 0
+        self.inferred = 0
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(NSFW_WORKERS, initializer=nsfw_worker_init, initargs=(self.model_path,))
+        logger.info("Local NSFW classifier started (%d workers, model %s).", NSFW_WORKERS, self.model_path)
+
+    async def check(self, file):
+        return await self.check_bytes(bytes(await file.download_as_bytearray()))
+
+    async def check_bytes(self, data):
+        if self.executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            phash, pixels = await loop.run_in_executor(self.executor, nsfw_prepare, data)
+        except BrokenExecutor:
+            # Worker mati (model gagal dimuat, OOM): pool dibuat ulang untuk foto berikutnya
+            self.stop()
+            raise
+        verdict = self.verdicts.get(phash)
+        if verdict is not None:
+            return verdict
+        future = loop.create_future()
+        self.pending.append((pixels, future))
+        if len(self.pending) >= NSFW_BATCH_SIZE:
+            self.flush()
+        elif self.flusher is None:
+            self.flusher = loop.call_later(NSFW_BATCH_WAIT, self.flush)
+        verdict = await future >= NSFW_THRESHOLD
+        self.verdicts.put(phash, verdict)
+        return verdict
+
+    def flush(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        self.batches += 1
+        self.inferred += len(batch)
+        scores = asyncio.get_running_loop().run_in_executor(self.executor, nsfw_infer, [pixels for pixels, _ in batch])
+        scores.add_done_callback(lambda done: self.resolve(batch, done))
+
+    def resolve(self, batch, done):
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(done.result()[i])
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+IMAGE_MODERATORS = {"api": ApiModerator, "local": LocalModerator}
+moderator = IMAGE_MODERATORS[NSFW_BACKEND]()
+
+# ========== Media Blocklist ==========
+def difference_hash(image):
+    # dHash 64-bit: grayscale 9x8, bit = piksel lebih terang dari tetangga kanannya
+    pixels = list(image.convert("L").resize((9, 8)).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = value << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def media_fingerprint(kind, data):
+    # pHash untuk foto, dHash untuk thumbnail stiker (kecil & sering transparan)
+    import io
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    if kind == "photo":
+        return perceptual_hash(image)
+    if image.mode in ("RGBA", "LA", "P"):
+        image = Image.alpha_composite(Image.new("RGBA", image.size, "white"), image.convert("RGBA"))
+    return difference_hash(image)
+
+def signed64(value):
+    # INTEGER SQLite bertanda 64-bit; hash disimpan dalam bentuk two's complement
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+class MediaBlocklist:
+    # Fingerprint media yang sudah pasti buruk; dicek sebelum classifier / API moderasi
+    def __init__(self, max_distance):
+        self.indexes = {kind: HammingIndex(max_distance) for kind in MEDIA_BLOCK_KINDS}
+        self.hits = 0
+
+    def __len__(self):
+        return sum(len(index) for index in self.indexes.values())
+
+    def load(self):
+        with db() as conn:
+            for kind, phash in conn.execute("SELECT kind, phash FROM media_blocklist"):
+                self.indexes[kind].add(phash & (1 << 64) - 1, True)
+        logger.info("Media blocklist loaded: %d fingerprints.", len(self))
+
+    def add(self, kind, phash, reason, added_by=None):
+        if self.indexes[kind].find(phash) is not None:
+            return False
+        with db() as conn:
+            conn.execute("INSERT OR IGNORE INTO media_blocklist (kind, phash, reason, added_by, created_at) VALUES (?,?,?,?,?)",
+                         (kind, signed64(phash), reason, added_by, int(time.time())))
+            conn.commit()
+        self.indexes[kind].add(phash, True)
+        return True
+
+    def blocked(self, kind, phash):
+        if self.indexes[kind].find(phash) is None:
+            return False
+        self.hits += 1
+        return True
+
+media_blocklist = MediaBlocklist(MEDIA_BLOCK_DISTANCE)
+
+async def fingerprint_media(bot, kind, file_id):
+    # Ukuran terkecil sudah cukup: hash dihitung dari gambar 32x32 / 9x8
+    file = await bot.get_file(file_id)
+    data = bytes(await file.download_as_bytearray())
+    return await asyncio.to_thread(media_fingerprint, kind, data)
+
+def media_target(message):
+    # (kind, file_id) yang di-fingerprint dari sebuah pesan, atau None
+    if message.photo:
+        return "photo", message.photo[0].file_id
+    if message.sticker and message.sticker.thumbnail:
+        return "sticker", message.sticker.thumbnail.file_id
+    return None
+
+# ========== Deteksi Spam ==========
+SPAM_TOKEN = re.compile(r"\w+")
+SPAM_DIGITS = re.compile(r"\d+")
+MINHASH_EMPTY = (1 << 64) - 1
+
+def minhash(text):
+    # One-permutation MinHash atas kata & pasangan kata (angka disamakan): satu hash per fitur,
+    # nilai minimum per bin. Teks pendek bisa menyisakan bin kosong (MINHASH_EMPTY).
+    tokens = SPAM_TOKEN.findall(SPAM_DIGITS.sub("0", text.lower()))
+    if len(tokens) < SPAM_MIN_TOKENS:
+        return None
+    mins = [MINHASH_EMPTY] * SPAM_MINHASH_BINS
+    for feature in itertools.chain(tokens, map(" ".join, zip(tokens, tokens[1:]))):
+        value = hash(feature) & MINHASH_EMPTY
+        i = value % SPAM_MINHASH_BINS
+        if value < mins[i]:
+            mins[i] = value
+    return tuple(mins)
+
+def minhash_similarity(a, b):
+    # Perkiraan Jaccard: porsi bin terisi yang minimumnya sama
+    filled = same = 0
+    for x, y in zip(a, b):
+        if x != MINHASH_EMPTY or y != MINHASH_EMPTY:
+            filled += 1
+            same += x == y
+    return same / filled if filled else 0.0
+
+class SpamDetector:
+    # Signature MinHash pesan terbaru lintas user, diindeks per band (LSH, SPAM_BAND_ROWS bin per band):
+    # teks yang mirip hampir pasti berbagi satu band, teks lain hampir tidak pernah.
+    def __init__(self, window, max_recent):
+        self.window = window
+        self.max_recent = max_recent
+        self.recent = deque()       # (ts, signature, sender) urut waktu
+        self.senders = {}           # signature -> {sender: ts terakhir}
+        self.bands = {}             # (band, minimum...) -> {signature: None}, urut waktu masuk
+        self.reported = OrderedDict()  # sender -> ts laporan otomatis terakhir
+        self.checked = 0
+        self.flagged = 0
+
+    def band_keys(self, signature):
+        keys = []
+        for start in range(0, SPAM_MINHASH_BINS, SPAM_BAND_ROWS):
+            rows = signature[start:start + SPAM_BAND_ROWS]
+            if MINHASH_EMPTY not in rows:
+                keys.append((start,) + rows)
+        return keys
+
+    def expire(self, now):
+        while self.recent and (self.recent[0][0] < now - self.window or len(self.recent) >= self.max_recent):
+            ts, signature, sender = self.recent.popleft()
+            senders = self.senders.get(signature)
+            if senders is None or senders.get(sender) != ts:
+                continue
+            del senders[sender]
+            if senders:
+                continue
+            del self.senders[signature]
+            for key in self.band_keys(signature):
+                bucket = self.bands[key]
+                del bucket[signature]
+                if not bucket:
+                    del self.bands[key]
+
+    def check(self, sender, text, now=None):
+        # Jumlah pengirim berbeda (termasuk sender) yang mengirim teks mirip dalam window
+        signature = minhash(text)
+        if signature is None:
+            return 1
+        if now is None:
+            now = time.monotonic()
+        self.checked += 1
+        self.expire(now)
+        keys = self.band_keys(signature)
+        seen = {sender}
+        compared = set()
+        for key in keys:
+            # Bucket kata umum bisa besar: cukup periksa kandidat terbaru
+            for other in itertools.islice(reversed(self.bands.get(key, {})), SPAM_MAX_CANDIDATES):
+                if other in compared:
+                    continue
+                compared.add(other)
+                if other == signature or minhash_similarity(signature, other) >= SPAM_MIN_SIMILARITY:
+                    seen.update(itertools.islice(self.senders[other], SPAM_MIN_SENDERS))
+            if len(seen) >= SPAM_MIN_SENDERS:
+                break
+        senders = self.senders.get(signature)
+        if senders is None:
+            senders = self.senders[signature] = {}
+            for key in keys:
+                self.bands.setdefault(key, {})[signature] = None
+        senders[sender] = now
+        self.recent.append((now, signature, sender))
+        if len(seen) >= SPAM_MIN_SENDERS:
+            self.flagged += 1
+        return len(seen)
+
+    def should_report(self, sender, now=None):
+        # Satu laporan otomatis per pengirim per window
+        if now is None:
+            now = time.monotonic()
+        last = self.reported.get(sender)
+        if last is not None and now - last < self.window:
+            return False
+        self.reported[sender] = now
+        self.reported.move_to_end(sender)
+        if len(self.reported) > RATE_LIMIT_MAX_USERS:
+            self.reported.popitem(last=False)
+        return True
+
+spam_detector = SpamDetector(SPAM_WINDOW, SPAM_MAX_RECENT)
+link_limiter = RateLimiter(SPAM_LINK_BURST, SPAM_LINK_REFILL, RATE_LIMIT_MAX_USERS)
+
+def report_spam(user_id, username, text):
+    # Laporan otomatis masuk tabel reports seperti laporan user; reporter_id NULL = sistem
+    if not spam_detector.should_report(user_id):
+        return
+    with db() as conn:
+        conn.execute("INSERT INTO reports (reporter_id, reported_id, reason, timestamp) VALUES (NULL,?,?,?)",
+                     (user_id, "Spam", int(time.time())))
+        conn.commit()
+    event_log.append("report", user_id, reason="Spam", auto=True)
+    owner_alerts.add("spam", user_id, mask_username(username), text)
+
+async def spam_guard(update: Update):
+    # True = teks ditahan, tidak diteruskan ke partner
+    message = update.message
+    user = update.effective_user
+    links = sum(1 for entity in message.entities if entity.type in SPAM_LINK_ENTITIES)
+    if links:
+        verdict = link_limiter.check(user.id, links)
+        if verdict == RL_NOTICE:
+            await message.reply_text(tr(user.id, "spam_links"))
+        elif verdict == RL_BAN:
+            report_spam(user.id, user.username, message.text)
+        if verdict != RL_ALLOW:
+            return True
+    if spam_detector.check(user.id, message.text) < SPAM_MIN_SENDERS:
+        return False
+    await message.reply_text(tr(user.id, "spam_blocked"))
+    report_spam(user.id, user.username, message.text)
+    return True
+
 # ========== Forward Message (Media, Moderasi, Rahasia) ==========
 async def forward_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT partner_id, secret_mode FROM sessions WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        if not row:
-            await update.message.reply_text("Kamu belum terhubung dengan siapapun. Cari partner dulu.", reply_markup=MAIN_MENU)
-            return
-        partner_id, secret_mode = row
+    session = await storage.get_session(user_id)
+    if not session:
+        await update.message.reply_text(tr(user_id, "not_connected"), reply_markup=menu(user_id, "main"))
+        return
+    partner_id, _, secret_mode = session
     # Moderasi kata kasar
     if hasattr(update.message, "text") and update.message.text:
-        if any(word.lower() in update.message.text.lower() for word in MODERATION_WORDS):
-            await update.message.reply_text("⚠️ Kata kasar terdeteksi! Jangan diulang.")
-            await context.bot.send_message(OWNER_ID, f"⚠️ Kata kasar oleh {mask_username(update.effective_user.username)}: {update.message.text}")
+        text = update.message.text.lower()
+        if any(word in text for word in config.current.derived("profanity")):
+            await update.message.reply_text(tr(user_id, "profanity"))
+            owner_alerts.add("profanity", user_id, mask_username(update.effective_user.username), update.message.text)
             return
-    # Moderasi gambar
-    if update.message.photo:
-        file_id = update.message.photo[-1].file_id
-        file_url = await context.bot.get_file(file_id)
-        if is_nsfw(file_url.file_path):
-            await update.message.reply_text("🚫 Gambar tidak aman (NSFW).")
-            await context.bot.send_message(OWNER_ID, f"NSFW image by {mask_username(update.effective_user.username)}")
-            return
-        await context.bot.send_photo(partner_id, file_id, caption=update.message.caption)
-        if secret_mode:
-            await context.bot.delete_message(partner_id, update.message.message_id)
-    elif update.message.video:
-        await context.bot.send_video(partner_id, update.message.video.file_id, caption=update.message.caption)
-        if secret_mode:
-            await context.bot.delete_message(partner_id, update.message.message_id)
-    elif update.message.voice:
-        await context.bot.send_voice(partner_id, update.message.voice.file_id)
-        if secret_mode:
-            await context.bot.delete_message(partner_id, update.message.message_id)
-    elif update.message.sticker:
-        await context.bot.send_sticker(partner_id, update.message.sticker.file_id)
-    elif update.message.text:
-        await context.bot.send_message(partner_id, update.message.text)
-        if secret_mode:
-            await context.bot.delete_message(partner_id, update.message.message_id)
-
-# ========== Next & Stop ==========
-@check_ban_status
-@auto_update_profile
-async def next_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    partner_id = end_session(user_id)
-    if partner_id:
-        await update.message.reply_text("Partner diakhiri. Mencari partner baru...", reply_markup=MAIN_MENU)
-        await context.bot.send_message(partner_id, "Partner mengakhiri chat. Kamu kembali ke menu.", reply_markup=MAIN_MENU)
-        await start(update, context)
-    else:
-        await update.message.reply_text("Kamu tidak sedang dalam chat.")
-
-@check_ban_status
-@auto_update_profile
-async def stop_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    partner_id = end_session(user_id)
-    if partner_id:
-        await update.message.reply_text("Chat diakhiri.", reply_markup=MAIN_MENU)
-        await context.bot.send_message(partner_id, "Partner mengakhiri chat. Kamu kembali ke menu.", reply_markup=MAIN_MENU)
-    else:
-        await update.message.reply_text("Kamu tidak sedang dalam chat.")
-
-# ========== Feedback ==========
-async def feedback_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT partner_id FROM sessions WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        if not row:
-            await update.message.reply_text("Kamu tidak sedang chat siapapun.")
-            return
-        partner_id = row[0]
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("⭐️⭐️⭐️⭐️⭐️", callback_data=f"fb_5"),
-         InlineKeyboardButton("⭐️⭐️⭐️⭐️", callback_data=f"fb_4"),
-         InlineKeyboardButton("⭐️⭐️⭐️", callback_data=f"fb_3"),
-         InlineKeyboardButton("⭐️⭐️", callback_data=f"fb_2"),
-         InlineKeyboardButton("⭐️", callback_data=f"fb_1")]
-    ])
-    await update.message.reply_text("Beri rating untuk partnermu!", reply_markup=keyboard)
-
-async def feedback_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    user_id = query.from_user.id
-    rating = int(query.data.split("_")[1])
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT partner_id FROM sessions WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        partner_id = row[0] if row else None
-        c.execute("INSERT INTO feedback (user_id, partner_id, rating, comment, timestamp) VALUES (?,?,?,?,?)",
-                  (user_id, partner_id, rating, "", int(time.time())))
-        conn.commit()
-    await query.answer()
-    await query.edit_message_text("Terima kasih atas feedbackmu!")
-
-# ========== Poll ==========
-async def poll_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Kirim pertanyaan polling (opsi pisahkan dengan koma):\nContoh: Apakah kamu suka fitur baru?,Ya,Tidak")
-async def poll_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    parts = update.message.text.split(",")
-    if len(parts) < 2:
-        await update.message.reply_text("Format salah.")
-        return
-    question = parts[0]
-    options = parts[1:]
-    poll_msg = await update.message.reply_poll(question, options, is_anonymous=True)
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("INSERT INTO polls (question, options, responses, created_at) VALUES (?,?,?,?)",
-                  (question, ",".join(options), "", int(time.time())))
-        conn.commit()
-
-# ========== Secret Mode ==========
-async def secret_mode_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("UPDATE sessions SET secret_mode=1 WHERE user_id=?", (user_id,))
-        conn.commit()
-    await update.message.reply_text("Mode rahasia aktif. Pesanmu akan dihapus otomatis setelah dibaca.")
-
-# ========== Leaderboard & Broadcast ==========
-async def daily_leaderboard_job(context: ContextTypes.DEFAULT_TYPE):
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM user_profiles")
-        user_count = c.fetchone()[0]
-        c.execute("SELECT COUNT(*) FROM sessions")
-        chat_count = c.fetchone()[0]
-        c.execute("SELECT COUNT(*) FROM reports WHERE timestamp > ?", (int(time.time())-86400,))
-        report_count = c.fetchone()[0]
-        c.execute("SELECT user_id, points FROM user_profiles ORDER BY points DESC LIMIT 5")
-        top_users = c.fetchall()
-    leaderboard = "\n".join([f"{i+1}. {mask_username('')} - {p} poin" for i, (uid, p) in enumerate(top_users)])
-    await context.bot.send_message(OWNER_ID,
-        f"📊 Leaderboard Harian\nUser: {user_count}\nChat: {chat_count}\nReport 24h: {report_count}\nTop Poin:\n{leaderboard}")
-
-def broadcast_quiz_winners(context: ContextTypes.DEFAULT_TYPE, quiz_id):
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT user_id, prize FROM quiz_winners WHERE quiz_id=?", (quiz_id,))
-        winners = c.fetchall()
-    winners_masked = [f"{mask_username('')} - {prize}" for uid, prize in winners]
-    msg = f"🎉 Pemenang Quiz #{quiz_id} Hari Ini:\n" + "\n".join(winners_masked)
-    # Broadcast ke semua user
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT user_id FROM user_profiles")
-        user_ids = [row[0] for row in c.fetchall()]
-    for uid in user_ids:
-        try:
-            context.bot.send_message(uid, msg)
-        except Exception:
-            continue
-
-# ========== Handler Registrasi ==========
-def main():
-    init_db()
-    application = Application.builder().token(BOT_TOKEN).build()
-
-    # Command
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_cmd))
-    application.add_handler(CommandHandler("profile", profile_cmd))
-    application.add_handler(CommandHandler("upgrade", help_cmd)) # implementasi payment bisa tambah
-    application.add_handler(CommandHandler("find", start))
-    application.add_handler(CommandHandler("searchpro", search_pro_cmd))
-    application.add_handler(CommandHandler("playquiz", play_quiz_cmd))
-    application.add_handler(CommandHandler("answer", answer_quiz_cmd))
-    application.add_handler(CommandHandler("tukarpro7", tukarpro7_cmd))
-    application.add_handler(CommandHandler("redeem", redeem_points_cmd))
-    application.add_handler(CommandHandler("joingroup", join_group_cmd))
-    application.add_handler(CommandHandler("leavegroup", leave_group_cmd))
-    application.add_handler(CommandHandler("next", next_cmd))
-    application.add_handler(CommandHandler("stop", stop_cmd))
-    application.add_handler(CommandHandler("report", report_cmd))
-    application.add_handler(CommandHandler("feedback", feedback_cmd))
-    application.add_handler(CommandHandler("poll", poll_cmd))
-    application.add_handler(CommandHandler("secretmode", secret_mode_cmd))
-    
-    # Profile Conversation
-    profile_conv = ConversationHandler(
-        entry_points=[CommandHandler("profile", profile_cmd)],
-        states={
-            PROFILE_GENDER: [MessageHandler(filters.TEXT, profile_gender)],
-            PROFILE_AGE: [MessageHandler(filters.TEXT, profile_age)],
-            PROFILE_BIO: [MessageHandler(filters.TEXT, profile_bio)],
-            PROFILE_PHOTO: [MessageHandler(filters.PHOTO, profile_photo)],
-            PROFILE_LANG: [MessageHandler(filters.TEXT, profile_lang)],
-            PROFILE_HOBBY: [MessageHandler(filters.TEXT, profile_hobby)],
-        },
-        fallbacks=[CommandHandler("cancel", profile_cancel)]
-    )
-    application.add_handler(profile_conv)
-
-    # Search Pro Conversation
-    search_conv = ConversationHandler(
-        entry_points=[CommandHandler("searchpro", search_pro_cmd)],
-        states={
-            SEARCH_TYPE: [CallbackQueryHandler(search_type_callback)],
-            SEARCH_GENDER: [MessageHandler(filters.TEXT, search_gender_step)],
-            SEARCH_HOBBY: [MessageHandler(filters.TEXT, search_hobby_step)],
-            SEARCH_AGE_MIN: [MessageHandler(filters.TEXT, search_age_min_step)],
-            SEARCH_AGE_MAX: [MessageHandler(filters.TEXT, search_age_max_step)],
-        },
-        fallbacks=[]
-    )
-    application.add_handler(search_conv)
-
-    # Quiz reward
-    application.add_handler(CallbackQueryHandler(quiz_reward_callback, pattern=r"^quiz(pro|poin)_"))
-
-    # Report & block
-    application.add_handler(CallbackQueryHandler(report_reason_callback, pattern=r"^(report_|block_)"))
-
-    # Feedback
-    application.add_handler(CallbackQueryHandler(feedback_callback, pattern=r"^fb_"))
-
-    # Polling
-    application.add_handler(MessageHandler(filters.Regex("^Poll$"), poll_cmd))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, poll_message))
-
-    # Forward message (media, teks, voice dsb)
-    application.add_handler(MessageHandler(
-        filters.ALL & ~filters.COMMAND, forward_message
-    ))
-
-    # Group chat
-    application.add_handler(MessageHandler(filters.Regex("^Join Group$"), join_group_cmd))
-    application.add_handler(MessageHandler(filters.Regex("^Leave Group$"), leave_group_cmd))
-
-    # Secret mode
-    application.add_handler(MessageHandler(filters.Regex("^Secret Mode$"), secret_mode_cmd))
-
-    # Feedback
-    application.add_handler(MessageHandler(filters.Regex("^Feedback$"), feedback_cmd))
-
-    # Next/Stop
-    application.add_handler(MessageHandler(filters.Regex("^Next$"), next_cmd))
-    application.add_handler(MessageHandler(filters.Regex("^Stop$"), stop_cmd))
-
-    # Leaderboard daily job
-    job_queue = application.job_queue
-    job_queue.run_daily(daily_leaderboard_job, time=datetime.now().replace(hour=23, minute=59, second=0))
-
-    logger.info("Bot started.")
-    application.run_polling()
-
-if __name__ == "__main__":
-    main()#!/usr/bin/env python3
-"""
-Telegram Anonymous Chat Bot
-Fitur: Hobi, Pro Search, Media, Leaderboard, Quiz Poin/Pro, Block, Group, Moderasi Gambar, Feedback, Poll, Mode Rahasia, Multi-Language, Broadcast Pemenang Sensor
-"""
-
-import logging
-import sqlite3
-import random
-import time
-from datetime import datetime, timedelta
-import requests
-
-from telegram import (
-    Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton,
-    KeyboardButton, ReplyKeyboardRemove, InputMediaPhoto, LabeledPrice, Poll
-)
-from telegram.ext import (
-    Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ConversationHandler, filters, ContextTypes, PreCheckoutQueryHandler, JobQueue
-)
-
-# ========== Konfigurasi ==========
-BOT_TOKEN = "YOUR_BOT_TOKEN"
-OWNER_ID = 123456789
-DB_PATH = "bot_database.db"
-LANGS = ["English", "Indonesian"]
-GENDERS = ["Male", "Female", "Other"]
-HOBBIES = ["Music", "Sports", "Gaming", "Travel", "Reading", "Cooking", "Drawing", "Coding", "Photography", "Other"]
-PRO_WEEK_PRICE = 1000
-PRO_MONTH_PRICE = 3500
-MODERATION_WORDS = ["anjing", "babi", "kontol", "bangsat", "memek", "ngentot"]
-REPORT_REASONS = ["Spam", "SARA", "Pornografi", "Kata Kasar", "Penipuan", "Lainnya"]
-QUIZ_LIMIT_WINNERS = 5
-NSFW_API_KEY = "YOUR_MODERATECONTENT_API_KEY"
-NSFW_API_URL = "https://api.moderatecontent.com/moderate/"
-
-# ========== Logging ==========
-logging.basicConfig(
-    format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO
-)
-logger = logging.getLogger(__name__)
-
-# ========== Database Layer ==========
-def db():
-    return sqlite3.connect(DB_PATH)
-
-def init_db():
-    with db() as conn:
-        c = conn.cursor()
-        # Profil user
-        c.execute('''CREATE TABLE IF NOT EXISTS user_profiles (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            gender TEXT,
-            age INTEGER,
-            bio TEXT,
-            photo_id TEXT,
-            language TEXT,
-            pro_expires_at INTEGER,
-            is_banned INTEGER DEFAULT 0,
-            banned_until INTEGER DEFAULT 0,
-            hobbies TEXT,
-            points INTEGER DEFAULT 0
-        )''')
-        # Laporan
-        c.execute('''CREATE TABLE IF NOT EXISTS reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            reporter_id INTEGER,
-            reported_id INTEGER,
-            reason TEXT,
-            timestamp INTEGER
-        )''')
-        # Block list
-        c.execute('''CREATE TABLE IF NOT EXISTS block_list (
-            user_id INTEGER,
-            blocked_id INTEGER,
-            PRIMARY KEY(user_id, blocked_id)
-        )''')
-        # Antrian chat
-        c.execute('''CREATE TABLE IF NOT EXISTS chat_queue (
-            user_id INTEGER PRIMARY KEY,
-            gender_pref TEXT,
-            hobby_pref TEXT,
-            age_min INTEGER,
-            age_max INTEGER,
-            is_pro INTEGER DEFAULT 0
-        )''')
-        # Chat session
-        c.execute('''CREATE TABLE IF NOT EXISTS sessions (
-            user_id INTEGER PRIMARY KEY,
-            partner_id INTEGER,
-            started_at INTEGER,
-            secret_mode INTEGER DEFAULT 0
-        )''')
-        # Group chat
-        c.execute('''CREATE TABLE IF NOT EXISTS groups (
-            group_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            members TEXT,
-            started_at INTEGER
-        )''')
-        # Quiz winners
-        c.execute('''CREATE TABLE IF NOT EXISTS quiz_winners (
-            quiz_id INTEGER,
-            user_id INTEGER,
-            prize TEXT
-        )''')
-        # Feedback
-        c.execute('''CREATE TABLE IF NOT EXISTS feedback (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            partner_id INTEGER,
-            rating INTEGER,
-            comment TEXT,
-            timestamp INTEGER
-        )''')
-        # Polls
-        c.execute('''CREATE TABLE IF NOT EXISTS polls (
-            poll_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            question TEXT,
-            options TEXT,
-            responses TEXT,
-            created_at INTEGER
-        )''')
-    logger.info("Database initialized.")
-
-# ========== Decorator ==========
-def check_ban_status(func):
-    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-        user_id = update.effective_user.id
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("SELECT is_banned, banned_until FROM user_profiles WHERE user_id=?", (user_id,))
-            row = c.fetchone()
-            if row and row[0]:
-                banned_until = row[1]
-                if banned_until > int(time.time()):
-                    await update.message.reply_text("🚫 Kamu di-ban hingga " + datetime.fromtimestamp(banned_until).strftime("%Y-%m-%d %H:%M"))
-                    return
-                else:
-                    c.execute("UPDATE user_profiles SET is_banned=0, banned_until=0 WHERE user_id=?", (user_id,))
-                    conn.commit()
-            return await func(update, context, *args, **kwargs)
-    return wrapper
-
-def owner_only(func):
-    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-        if update.effective_user.id != OWNER_ID:
-            await update.message.reply_text("❌ Hanya owner yang bisa menggunakan perintah ini.")
-            return
-        return await func(update, context, *args, **kwargs)
-    return wrapper
-
-def auto_update_profile(func):
-    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-        user = update.effective_user
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("SELECT user_id FROM user_profiles WHERE user_id=?", (user.id,))
-            if not c.fetchone():
-                c.execute("INSERT INTO user_profiles (user_id, username) VALUES (?,?)", (user.id, user.username))
-            else:
-                c.execute("UPDATE user_profiles SET username=? WHERE user_id=?", (user.username, user.id))
-            conn.commit()
-        return await func(update, context, *args, **kwargs)
-    return wrapper
-
-# ========== Helper ==========
-def is_pro(user_id):
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT pro_expires_at FROM user_profiles WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        return bool(row and row[0] and row[0] > int(time.time()))
-
-def get_profile(user_id):
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("""SELECT gender, age, bio, photo_id, hobbies, points FROM user_profiles WHERE user_id=?""", (user_id,))
-        row = c.fetchone()
-        if row:
-            data = dict(zip(["gender", "age", "bio", "photo_id", "hobbies", "points"], row))
-            data["hobbies"] = data["hobbies"].split(",") if data["hobbies"] else []
-            return data
-        return {}
-
-def profile_complete(user_id):
-    profile = get_profile(user_id)
-    return all([profile.get("gender"), profile.get("age"), profile.get("bio"), profile.get("photo_id")])
-
-def is_in_chat(user_id):
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT partner_id FROM sessions WHERE user_id=?", (user_id,))
-        return c.fetchone() is not None
-
-def is_blocked(user_id, target_id):
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT 1 FROM block_list WHERE user_id=? AND blocked_id=?", (user_id, target_id))
-        return c.fetchone() is not None
-
-def mask_username(username):
-    if not username:
-        return "User" + "".join(random.choices("0123456789", k=4))
-    if len(username) <= 4:
-        return username[0] + "**" + username[-1]
-    return username[:2] + "*"*(len(username)-3) + username[-1]
-
-def add_session(user_id, partner_id, secret_mode=False):
-    now = int(time.time())
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("INSERT OR REPLACE INTO sessions (user_id, partner_id, started_at, secret_mode) VALUES (?,?,?,?)", (user_id, partner_id, now, int(secret_mode)))
-        c.execute("INSERT OR REPLACE INTO sessions (user_id, partner_id, started_at, secret_mode) VALUES (?,?,?,?)", (partner_id, user_id, now, int(secret_mode)))
-        conn.commit()
-
-def end_session(user_id):
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT partner_id FROM sessions WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        if row:
-            partner_id = row[0]
-            c.execute("DELETE FROM sessions WHERE user_id=?", (user_id,))
-            c.execute("DELETE FROM sessions WHERE user_id=?", (partner_id,))
-            conn.commit()
-            return partner_id
-    return None
-
-def find_partner(user_id, gender_pref=None, hobby_pref=None, age_min=None, age_max=None):
-    # Cari pasangan yang belum terhubung dan tidak diblok
-    with db() as conn:
-        c = conn.cursor()
-        block_ids = [row[0] for row in c.execute("SELECT blocked_id FROM block_list WHERE user_id=?", (user_id,))]
-        query = "SELECT u.user_id, u.hobbies FROM user_profiles u LEFT JOIN sessions s ON u.user_id=s.user_id WHERE u.user_id!=? AND s.user_id IS NULL AND u.is_banned=0"
-        params = [user_id]
-        if gender_pref:
-            query += " AND u.gender=?"
-            params.append(gender_pref)
-        if age_min and age_max:
-            query += " AND u.age BETWEEN ? AND ?"
-            params += [age_min, age_max]
-        c.execute(query, tuple(params))
-        partners = c.fetchall()
-        # Prioritas: gender + hobi
-        if hobby_pref:
-            for pid, hobbies_str in partners:
-                if pid in block_ids: continue
-                hobbies = hobbies_str.split(",") if hobbies_str else []
-                if hobby_pref in hobbies:
-                    return pid
-            # Fallback: gender saja
-            for pid, hobbies_str in partners:
-                if pid in block_ids: continue
-                return pid
-            return None
-        else:
-            for pid, hobbies_str in partners:
-                if pid in block_ids: continue
-                return pid
-            return None
-
-# ========== Menu Keyboard ==========
-MAIN_MENU = ReplyKeyboardMarkup([
-    [KeyboardButton("Find a partner"), KeyboardButton("Search Pro")],
-    [KeyboardButton("My Profile"), KeyboardButton("Upgrade to Pro")],
-    [KeyboardButton("Play Quiz"), KeyboardButton("Join Group")],
-], resize_keyboard=True)
-
-CHAT_MENU = ReplyKeyboardMarkup([
-    [KeyboardButton("Next"), KeyboardButton("Stop"), KeyboardButton("Feedback"), KeyboardButton("Poll")],
-    [KeyboardButton("Secret Mode")],
-], resize_keyboard=True)
-
-GROUP_MENU = ReplyKeyboardMarkup([
-    [KeyboardButton("Leave Group"), KeyboardButton("Poll")],
-], resize_keyboard=True)
-
-# ========== State ==========
-PROFILE_GENDER, PROFILE_AGE, PROFILE_BIO, PROFILE_PHOTO, PROFILE_LANG, PROFILE_HOBBY = range(6)
-SEARCH_TYPE, SEARCH_GENDER, SEARCH_HOBBY, SEARCH_AGE_MIN, SEARCH_AGE_MAX = range(6, 11)
-QUIZ_ANSWER = 11
-
-# ========== Command Handler ==========
-@check_ban_status
-@auto_update_profile
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    if not profile_complete(user_id):
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("Lengkapi Profil", callback_data="complete_profile")],
-            [InlineKeyboardButton("Lanjutkan & Cari Acak", callback_data="skip_profile")]
-        ])
-        await update.message.reply_text(
-            "👋 Selamat datang di Anonymous Chat!\nProfilmu belum lengkap.",
-            reply_markup=keyboard
-        )
-        return
-    await update.message.reply_text(
-        f"👋 Selamat datang!\n\nPerintah utama:\n"
-        "/profile - Atur profilmu\n"
-        "/upgrade - Upgrade ke Pro\n"
-        "/stop - Akhiri chat\n"
-        "/next - Cari partner baru\n"
-        "/report - Laporkan partner\n"
-        "/playquiz - Main quiz\n"
-        "/joingroup - Join group\n"
-        "/feedback - Feedback chat\n"
-        "/poll - Polling anonim\n"
-        "/help - Bantuan\n",
-        reply_markup=MAIN_MENU
-    )
-
-@check_ban_status
-@auto_update_profile
-async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "📖 Bot Anonymous Chat:\n"
-        "• 'Find a partner' - Cari partner acak\n"
-        "• 'Search Pro' - Cari partner Pro (gender/hobi)\n"
-        "• 'My Profile' - Atur profilmu\n"
-        "• 'Upgrade to Pro' - Beli langganan Pro\n"
-        "• 'Play Quiz' - Main quiz dan dapat Pro/poin\n"
-        "• 'Join Group' - Grup anonim\n"
-        "• /report - Laporkan partner\n"
-        "• /ban, /unban, /grant_pro, /broadcast, /adminstats (Owner)\n"
-        "• /stop, /next - Akhiri/Cari chat baru\n"
-        "• /feedback - Feedback chat\n"
-        "• /poll - Polling chat/group\n"
-        "• /secretmode - Aktifkan mode pesan rahasia",
-        reply_markup=MAIN_MENU
-    )
-
-# ========== Profile Conversation ==========
-@check_ban_status
-@auto_update_profile
-async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "📝 Gender? (Pilih salah satu)",
-        reply_markup=ReplyKeyboardMarkup([GENDERS], one_time_keyboard=True, resize_keyboard=True)
-    )
-    return PROFILE_GENDER
-
-async def profile_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    gender = update.message.text
-    if gender not in GENDERS:
-        await update.message.reply_text("Gender tidak valid. Ulangi.")
-        return PROFILE_GENDER
-    context.user_data['gender'] = gender
-    await update.message.reply_text("Usia kamu?")
-    return PROFILE_AGE
-
-async def profile_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        age = int(update.message.text)
-    except:
-        await update.message.reply_text("Usia harus angka. Ulangi.")
-        return PROFILE_AGE
-    context.user_data['age'] = age
-    await update.message.reply_text("Bio singkat kamu?")
-    return PROFILE_BIO
-
-async def profile_bio(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    bio = update.message.text
-    context.user_data['bio'] = bio
-    await update.message.reply_text("Kirim foto profil kamu.")
-    return PROFILE_PHOTO
-
-async def profile_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    photo = update.message.photo[-1]
-    photo_id = photo.file_id
-    context.user_data['photo_id'] = photo_id
-    await update.message.reply_text("Pilih bahasa botmu.",
-        reply_markup=ReplyKeyboardMarkup([LANGS], one_time_keyboard=True, resize_keyboard=True))
-    return PROFILE_LANG
-
-async def profile_lang(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = update.message.text
-    if lang not in LANGS:
-        await update.message.reply_text("Bahasa tidak valid. Ulangi.")
-        return PROFILE_LANG
-    context.user_data['language'] = lang
-    await update.message.reply_text("Pilih hobi kamu (bisa lebih dari satu, pisahkan dengan koma).\nContoh: Music, Coding",
-        reply_markup=ReplyKeyboardMarkup([HOBBIES], one_time_keyboard=True, resize_keyboard=True))
-    return PROFILE_HOBBY
-
-async def profile_hobby(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    hobbies = update.message.text
-    hobby_list = [h.strip() for h in hobbies.split(",") if h.strip() in HOBBIES]
-    user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("UPDATE user_profiles SET gender=?, age=?, bio=?, photo_id=?, language=?, hobbies=? WHERE user_id=?",
-                  (context.user_data['gender'], context.user_data['age'], context.user_data['bio'], context.user_data['photo_id'], context.user_data['language'], ",".join(hobby_list), user_id))
-        conn.commit()
-    await update.message.reply_text("✅ Profil kamu telah diperbarui!", reply_markup=MAIN_MENU)
-    return ConversationHandler.END
-
-async def profile_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Profil batal diatur.", reply_markup=MAIN_MENU)
-    return ConversationHandler.END
-
-# ========== Search Pro Conversation ==========
-@check_ban_status
-@auto_update_profile
-async def search_pro_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    if not is_pro(user_id):
-        await update.message.reply_text("🚫 Fitur ini hanya untuk Pro. Silakan /upgrade dulu.", reply_markup=MAIN_MENU)
-        return
-    if not profile_complete(user_id):
-        await update.message.reply_text("Profil belum lengkap. /profile dulu.", reply_markup=MAIN_MENU)
-        return
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Gender", callback_data="search_gender"),
-         InlineKeyboardButton("Hobi", callback_data="search_hobby"),
-         InlineKeyboardButton("Gender & Hobi", callback_data="search_gender_hobby")]
-    ])
-    await update.message.reply_text("Pilih tipe pencarian partner:", reply_markup=keyboard)
-    return SEARCH_TYPE
-
-async def search_type_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    if query.data == "search_gender":
-        await query.answer()
-        await query.edit_message_text("Gender partner yang kamu cari?", reply_markup=ReplyKeyboardMarkup([GENDERS], one_time_keyboard=True, resize_keyboard=True))
-        context.user_data['search_mode'] = "gender"
-        return SEARCH_GENDER
-    elif query.data == "search_hobby":
-        await query.answer()
-        await query.edit_message_text("Hobi partner yang kamu cari?", reply_markup=ReplyKeyboardMarkup([HOBBIES], one_time_keyboard=True, resize_keyboard=True))
-        context.user_data['search_mode'] = "hobby"
-        return SEARCH_HOBBY
-    elif query.data == "search_gender_hobby":
-        await query.answer()
-        await query.edit_message_text("Gender partner yang kamu cari?", reply_markup=ReplyKeyboardMarkup([GENDERS], one_time_keyboard=True, resize_keyboard=True))
-        context.user_data['search_mode'] = "gender_hobby"
-        return SEARCH_GENDER
-
-async def search_gender_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    gender_pref = update.message.text
-    context.user_data['gender_pref'] = gender_pref
-    if context.user_data.get('search_mode') == "gender_hobby":
-        await update.message.reply_text("Hobi partner yang kamu cari?", reply_markup=ReplyKeyboardMarkup([HOBBIES], one_time_keyboard=True, resize_keyboard=True))
-        return SEARCH_HOBBY
-    else:
-        await update.message.reply_text("Umur minimum partner?")
-        return SEARCH_AGE_MIN
-
-async def search_hobby_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    hobby_pref = update.message.text
-    context.user_data['hobby_pref'] = hobby_pref
-    if context.user_data.get('search_mode') == "hobby":
-        await update.message.reply_text("Umur minimum partner?")
-        return SEARCH_AGE_MIN
-    else:
-        await update.message.reply_text("Umur minimum partner?")
-        return SEARCH_AGE_MIN
-
-async def search_age_min_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        age_min = int(update.message.text)
-    except:
-        await update.message.reply_text("Umur harus angka.")
-        return SEARCH_AGE_MIN
-    context.user_data['age_min'] = age_min
-    await update.message.reply_text("Umur maksimum partner?")
-    return SEARCH_AGE_MAX
-
-async def search_age_max_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        age_max = int(update.message.text)
-    except:
-        await update.message.reply_text("Umur harus angka.")
-        return SEARCH_AGE_MAX
-    context.user_data['age_max'] = age_max
-    user_id = update.effective_user.id
-    gender_pref = context.user_data.get('gender_pref')
-    hobby_pref = context.user_data.get('hobby_pref')
-    age_min = context.user_data['age_min']
-    age_max = context.user_data['age_max']
-    partner_id = find_partner(user_id, gender_pref, hobby_pref, age_min, age_max)
-    if partner_id:
-        add_session(user_id, partner_id)
-        await update.message.reply_text("✅ Partner ditemukan! Mulai ngobrol.", reply_markup=CHAT_MENU)
-        await context.bot.send_message(partner_id, "✅ Partner ditemukan! Mulai ngobrol.", reply_markup=CHAT_MENU)
-    else:
-        await update.message.reply_text("😔 Partner sesuai kriteria belum ditemukan.", reply_markup=MAIN_MENU)
-    return ConversationHandler.END
-
-# ========== Quiz/Permainan ==========
-QUIZ_QUESTIONS = [
-    {"q": "Apa ibu kota Indonesia?", "a": "Jakarta"},
-    {"q": "2 + 5 = ?", "a": "7"},
-    {"q": "Siapa pencipta lagu Indonesia Raya?", "a": "WR Supratman"},
-]
-current_quiz = {}
-
-async def play_quiz_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # Pilih quiz random
-    quiz_id = random.randint(1000, 9999)
-    q_data = random.choice(QUIZ_QUESTIONS)
-    current_quiz[quiz_id] = {"question": q_data["q"], "answer": q_data["a"].lower(), "winners": []}
-    context.user_data['quiz_id'] = quiz_id
-    await update.message.reply_text(f"Quiz #{quiz_id} : {q_data['q']}\nJawab dengan /answer <jawaban>")
-    context.bot_data['quiz_id'] = quiz_id
-
-async def answer_quiz_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    if 'quiz_id' not in context.user_data:
-        await update.message.reply_text("Tidak ada quiz aktif yang kamu ikuti.")
-        return
-    quiz_id = context.user_data['quiz_id']
-    answer = ' '.join(update.message.text.split()[1:]).lower()
-    quiz = current_quiz.get(quiz_id)
-    if not quiz:
-        await update.message.reply_text("Quiz tidak aktif.")
-        return
-    if user_id in quiz["winners"]:
-        await update.message.reply_text("Kamu sudah menang di quiz ini.")
-        return
-    if len(quiz["winners"]) >= QUIZ_LIMIT_WINNERS:
-        await update.message.reply_text("Limit pemenang sudah habis.")
-        return
-    if answer == quiz["answer"]:
-        quiz["winners"].append(user_id)
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("INSERT INTO quiz_winners (quiz_id, user_id, prize) VALUES (?,?,?)", (quiz_id, user_id, "pending"))
-            conn.commit()
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("Tukar Pro 1 hari", callback_data=f"quizpro_{quiz_id}"),
-             InlineKeyboardButton("Ambil 1 poin", callback_data=f"quizpoin_{quiz_id}")]
-        ])
-        await update.message.reply_text("Selamat! Pilih hadiahmu:", reply_markup=keyboard)
-        # Broadcast pemenang dengan username sensor
-        winners_masked = [mask_username(update.effective_user.username)]
-        await context.bot.send_message(OWNER_ID, f"🎉 Pemenang Quiz #{quiz_id}: {winners_masked}")
-    else:
-        await update.message.reply_text("Jawaban salah.")
-
-async def quiz_reward_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    user_id = query.from_user.id
-    quiz_id = int(query.data.split("_")[1])
-    if query.data.startswith("quizpro_"):
-        expires_at = int(time.time()) + 86400
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("UPDATE user_profiles SET pro_expires_at=? WHERE user_id=?", (expires_at, user_id))
-            c.execute("UPDATE quiz_winners SET prize=? WHERE quiz_id=? AND user_id=?", ("pro", quiz_id, user_id))
-            conn.commit()
-        await query.answer()
-        await query.edit_message_text("✅ Pro aktif 1 hari!")
-    elif query.data.startswith("quizpoin_"):
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("UPDATE user_profiles SET points=points+1 WHERE user_id=?", (user_id,))
-            c.execute("UPDATE quiz_winners SET prize=? WHERE quiz_id=? AND user_id=?", ("poin", quiz_id, user_id))
-            conn.commit()
-        await query.answer()
-        await query.edit_message_text("✅ Kamu dapat 1 poin! Bisa ditukar Pro nanti.")
-
-# ========== Poin Tukar Pro ==========
-async def redeem_points_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT points FROM user_profiles WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        points = row[0] if row else 0
-    await update.message.reply_text(f"Poinmu: {points}\nTukar 7 poin untuk Pro 7 hari? /tukarpro7")
-async def tukarpro7_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT points FROM user_profiles WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        points = row[0] if row else 0
-        if points >= 7:
-            expires_at = int(time.time()) + 7*86400
-            c.execute("UPDATE user_profiles SET pro_expires_at=?, points=points-7 WHERE user_id=?", (expires_at, user_id))
-            conn.commit()
-            await update.message.reply_text("✅ Pro aktif 7 hari!")
-        else:
-            await update.message.reply_text("Poinmu belum cukup.")
-
-# ========== Block User ==========
-async def report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT partner_id FROM sessions WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        if not row:
-            await update.message.reply_text("Kamu tidak sedang chat siapapun.")
-            return
-        partner_id = row[0]
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton(reason, callback_data=f"report_{reason}") for reason in REPORT_REASONS],
-        [InlineKeyboardButton("Block User", callback_data=f"block_{partner_id}")]
-    ])
-    await update.message.reply_text("Pilih alasan report atau block:", reply_markup=keyboard)
-
-async def report_reason_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    user_id = query.from_user.id
-    if query.data.startswith("report_"):
-        reason = query.data.replace("report_", "")
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("SELECT partner_id FROM sessions WHERE user_id=?", (user_id,))
-            row = c.fetchone()
-            if not row:
-                await query.answer()
-                await query.edit_message_text("Kamu tidak sedang chat siapapun.")
-                return
-            reported_id = row[0]
-            c.execute("INSERT INTO reports (reporter_id, reported_id, reason, timestamp) VALUES (?,?,?,?)",
-                      (user_id, reported_id, reason, int(time.time())))
-            conn.commit()
-        await query.answer()
-        await query.edit_message_text("✅ Laporan terkirim ke Owner. Terima kasih.")
-        await context.bot.send_message(OWNER_ID, f"🚩 Report: {mask_username(query.from_user.username)} melaporkan {mask_username('')} Alasan: {reason}")
-    elif query.data.startswith("block_"):
-        blocked_id = int(query.data.split("_")[1])
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("INSERT OR IGNORE INTO block_list (user_id, blocked_id) VALUES (?,?)", (user_id, blocked_id))
-            conn.commit()
-        await query.answer()
-        await query.edit_message_text("✅ User diblok. Kamu tidak akan match dengan user ini lagi.")
-
-# ========== Group Chat ==========
-async def join_group_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        # Cari group belum penuh
-        c.execute("SELECT group_id, members FROM groups WHERE LENGTH(members) < 30")
-        row = c.fetchone()
-        if row:
-            gid, members_str = row
-            members = members_str.split(",") if members_str else []
-            if str(user_id) not in members:
-                members.append(str(user_id))
-            c.execute("UPDATE groups SET members=? WHERE group_id=?", (",".join(members), gid))
-            conn.commit()
-            await update.message.reply_text(f"✅ Bergabung ke grup #{gid}. Mulai ngobrol!", reply_markup=GROUP_MENU)
-        else:
-            # Buat group baru
-            c.execute("INSERT INTO groups (members, started_at) VALUES (?,?)", (str(user_id), int(time.time())))
-            gid = c.lastrowid
-            conn.commit()
-            await update.message.reply_text(f"✅ Grup #{gid} dibuat. Tunggu member lain...", reply_markup=GROUP_MENU)
-
-async def leave_group_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT group_id, members FROM groups WHERE members LIKE ?", (f"%{user_id}%",))
-        row = c.fetchone()
-        if row:
-            gid, members_str = row
-            members = [mid for mid in members_str.split(",") if mid != str(user_id)]
-            c.execute("UPDATE groups SET members=? WHERE group_id=?", (",".join(members), gid))
-            conn.commit()
-            await update.message.reply_text(f"Kamu keluar dari grup #{gid}.", reply_markup=MAIN_MENU)
-        else:
-            await update.message.reply_text("Kamu tidak sedang di grup.")
-
-# ========== Moderasi Gambar ==========
-def is_nsfw(file_url):
-    # Pakai ModerateContent API
-    resp = requests.get(NSFW_API_URL, params={"key": NSFW_API_KEY, "url": file_url})
-    if resp.ok:
-        js = resp.json()
-        rating = js.get("rating_label")
-        return rating and rating != "everyone"
-    return False
-
-# ========== Forward Message (Media, Moderasi, Rahasia) ==========
-async def forward_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT partner_id, secret_mode FROM sessions WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        if not row:
-            await update.message.reply_text("Kamu belum terhubung dengan siapapun. Cari partner dulu.", reply_markup=MAIN_MENU)
+        if await spam_guard(update):
             return
-        partner_id, secret_mode = row
-    # Moderasi kata kasar
-    if hasattr(update.message, "text") and update.message.text:
-        if any(word.lower() in update.message.text.lower() for word in MODERATION_WORDS):
-            await update.message.reply_text("⚠️ Kata kasar terdeteksi! Jangan diulang.")
-            await context.bot.send_message(OWNER_ID, f"⚠️ Kata kasar oleh {mask_username(update.effective_user.username)}: {update.message.text}")
+    # Media yang sudah dikenal buruk ditolak tanpa moderasi ulang (hanya bila blocklist berisi)
+    target = media_target(update.message)
+    fingerprint = None
+    if target and len(media_blocklist.indexes[target[0]]):
+        try:
+            fingerprint = await fingerprint_media(context.bot, *target)
+        except Exception as e:
+            logger.warning("Media fingerprint failed: %s", e)
+        if fingerprint is not None and media_blocklist.blocked(target[0], fingerprint):
+            await update.message.reply_text(tr(user_id, "media_blocked"))
+            owner_alerts.add("media_block", user_id, mask_username(update.effective_user.username))
             return
     # Moderasi gambar
     if update.message.photo:
         file_id = update.message.photo[-1].file_id
-        file_url = await context.bot.get_file(file_id)
-        if is_nsfw(file_url.file_path):
-            await update.message.reply_text("🚫 Gambar tidak aman (NSFW).")
-            await context.bot.send_message(OWNER_ID, f"NSFW image by {mask_username(update.effective_user.username)}")
+        try:
+            flagged = await moderator.check(await context.bot.get_file(file_id))
+        except Exception as e:
+            # Moderasi gagal tidak boleh memutus relay (sama seperti API yang tidak merespons)
+            logger.warning("Image moderation failed: %s", e)
+            flagged = False
+        if flagged:
+            await update.message.reply_text(tr(user_id, "nsfw"))
+            owner_alerts.add("nsfw", user_id, mask_username(update.effective_user.username))
+            # Kiriman ulang foto yang sama (juga dari akun baru) langsung ditolak
+            try:
+                media_blocklist.add("photo", fingerprint if fingerprint is not None else await fingerprint_media(context.bot, *target), "nsfw")
+            except Exception as e:
+                logger.warning("Media fingerprint failed: %s", e)
             return
-        await context.bot.send_photo(partner_id, file_id, caption=update.message.caption)
+        outbox.send(PRIO_RELAY, "send_photo", partner_id, file_id, caption=update.message.caption)
         if secret_mode:
-            await context.bot.delete_message(partner_id, update.message.message_id)
+            outbox.send(PRIO_RELAY, "delete_message", partner_id, update.message.message_id)
     elif update.message.video:
-        await context.bot.send_video(partner_id, update.message.video.file_id, caption=update.message.caption)
+        outbox.send(PRIO_RELAY, "send_video", partner_id, update.message.video.file_id, caption=update.message.caption)
         if secret_mode:
-            await context.bot.delete_message(partner_id, update.message.message_id)
+            outbox.send(PRIO_RELAY, "delete_message", partner_id, update.message.message_id)
     elif update.message.voice:
-        await context.bot.send_voice(partner_id, update.message.voice.file_id)
+        outbox.send(PRIO_RELAY, "send_voice", partner_id, update.message.voice.file_id)
         if secret_mode:
-            await context.bot.delete_message(partner_id, update.message.message_id)
+            outbox.send(PRIO_RELAY, "delete_message", partner_id, update.message.message_id)
     elif update.message.sticker:
-        await context.bot.send_sticker(partner_id, update.message.sticker.file_id)
+        outbox.send(PRIO_RELAY, "send_sticker", partner_id, update.message.sticker.file_id)
     elif update.message.text:
-        await context.bot.send_message(partner_id, update.message.text)
+        outbox.send(PRIO_RELAY, "send_message", partner_id, update.message.text)
         if secret_mode:
-            await context.bot.delete_message(partner_id, update.message.message_id)
+            outbox.send(PRIO_RELAY, "delete_message", partner_id, update.message.message_id)
+
+# ========== Find, Next & Stop ==========
+@check_ban_status
+@auto_update_profile
+async def find_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if await is_in_chat(user_id):
+        await update.message.reply_text(tr(user_id, "still_in_chat"))
+        return
+    if user_id in waiting_room:
+        await update.message.reply_text(tr(user_id, "still_searching"))
+        return
+    if not await waiting_room.enqueue(user_id):
+        await update.message.reply_text(tr(user_id, "searching"), reply_markup=menu(user_id, "main"))
 
-# ========== Next & Stop ==========
 @check_ban_status
 @auto_update_profile
 async def next_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    partner_id = end_session(user_id)
+    partner_id = await end_session(user_id)
     if partner_id:
-        await update.message.reply_text("Partner diakhiri. Mencari partner baru...", reply_markup=MAIN_MENU)
-        await context.bot.send_message(partner_id, "Partner mengakhiri chat. Kamu kembali ke menu.", reply_markup=MAIN_MENU)
-        await start(update, context)
+        await update.message.reply_text(tr(user_id, "next_searching"), reply_markup=menu(user_id, "main"))
+        outbox.send(PRIO_NOTIFY, "send_message", partner_id, tr(partner_id, "partner_left"), reply_markup=menu(partner_id, "main"))
+        await waiting_room.enqueue(user_id)
     else:
-        await update.message.reply_text("Kamu tidak sedang dalam chat.")
+        await update.message.reply_text(tr(user_id, "not_in_chat"))
 
 @check_ban_status
 @auto_update_profile
 async def stop_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    partner_id = end_session(user_id)
+    partner_id = await end_session(user_id)
     if partner_id:
-        await update.message.reply_text("Chat diakhiri.", reply_markup=MAIN_MENU)
-        await context.bot.send_message(partner_id, "Partner mengakhiri chat. Kamu kembali ke menu.", reply_markup=MAIN_MENU)
+        await update.message.reply_text(tr(user_id, "chat_ended"), reply_markup=menu(user_id, "main"))
+        outbox.send(PRIO_NOTIFY, "send_message", partner_id, tr(partner_id, "partner_left"), reply_markup=menu(partner_id, "main"))
+    elif waiting_room.discard(user_id):
+        await update.message.reply_text(tr(user_id, "search_cancelled"), reply_markup=menu(user_id, "main"))
     else:
-        await update.message.reply_text("Kamu tidak sedang dalam chat.")
+        await update.message.reply_text(tr(user_id, "not_in_chat"))
 
 # ========== Feedback ==========
 async def feedback_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT partner_id FROM sessions WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        if not row:
-            await update.message.reply_text("Kamu tidak sedang chat siapapun.")
-            return
-        partner_id = row[0]
+    partner_id = await partner_of(user_id)
+    if not partner_id:
+        await update.message.reply_text(tr(user_id, "not_chatting"))
+        return
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("⭐️⭐️⭐️⭐️⭐️", callback_data=f"fb_5"),
          InlineKeyboardButton("⭐️⭐️⭐️⭐️", callback_data=f"fb_4"),
@@ -1703,111 +3597,1374 @@ async def feedback_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
          InlineKeyboardButton("⭐️⭐️", callback_data=f"fb_2"),
          InlineKeyboardButton("⭐️", callback_data=f"fb_1")]
     ])
-    await update.message.reply_text("Beri rating untuk partnermu!", reply_markup=keyboard)
+    await update.message.reply_text(tr(user_id, "feedback_ask"), reply_markup=keyboard)
 
 async def feedback_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
     rating = int(query.data.split("_")[1])
+    partner_id = await partner_of(user_id)
     with db() as conn:
         c = conn.cursor()
-        c.execute("SELECT partner_id FROM sessions WHERE user_id=?", (user_id,))
-        row = c.fetchone()
-        partner_id = row[0] if row else None
         c.execute("INSERT INTO feedback (user_id, partner_id, rating, comment, timestamp) VALUES (?,?,?,?,?)",
                   (user_id, partner_id, rating, "", int(time.time())))
         conn.commit()
     await query.answer()
-    await query.edit_message_text("Terima kasih atas feedbackmu!")
+    await query.edit_message_text(tr(user_id, "feedback_thanks"))
 
 # ========== Poll ==========
+class ActivePoll:
+    __slots__ = ("poll_id", "question", "options", "counts", "votes", "participants", "messages", "closes_at")
+
+    def __init__(self, poll_id, question, options, participants, closes_at):
+        self.poll_id = poll_id
+        self.question = question
+        self.options = options
+        self.counts = [0] * len(options)
+        self.votes = {}             # user_id -> option_id
+        self.participants = set(participants)
+        self.messages = []          # (poll id Telegram, chat_id, message_id)
+        self.closes_at = closes_at
+
+    def vote(self, user_id, option_id):
+        # Ganti pilihan / tarik suara: kurangi suara lama dulu
+        previous = self.votes.pop(user_id, None)
+        if previous is not None:
+            self.counts[previous] -= 1
+        if option_id is not None:
+            self.votes[user_id] = option_id
+            self.counts[option_id] += 1
+
+    def results(self):
+        total = sum(self.counts)
+        lines = [f"• {option}: {count} ({count * 100 // total if total else 0}%)" for option, count in zip(self.options, self.counts)]
+        return "\n".join(lines), total
+
+class PollRegistry:
+    # Polling aktif di memori: tally selalu terkini, DB hanya menerima suara per batch
+    def __init__(self):
+        self.polls = {}
+        self.tg_polls = {}          # poll id Telegram -> poll_id
+        self.pending = {}           # (poll_id, user_id) -> option_id, None = suara ditarik
+
+    def open(self, poll):
+        self.polls[poll.poll_id] = poll
+
+    def add_message(self, poll, tg_poll_id, chat_id, message_id):
+        poll.messages.append((tg_poll_id, chat_id, message_id))
+        self.tg_polls[tg_poll_id] = poll.poll_id
+
+    def record(self, tg_poll_id, user_id, option_ids):
+        poll = self.polls.get(self.tg_polls.get(tg_poll_id))
+        if poll is None or user_id not in poll.participants:
+            return False
+        option_id = option_ids[0] if option_ids else None
+        poll.vote(user_id, option_id)
+        self.pending[(poll.poll_id, user_id)] = option_id
+        if len(self.pending) >= POLL_FLUSH_BATCH:
+            self.flush()
+        return True
+
+    def flush(self):
+        if not self.pending:
+            return
+        now = int(time.time())
+        votes = [(poll_id, user_id, option_id, now) for (poll_id, user_id), option_id in self.pending.items() if option_id is not None]
+        retracted = [key for key, option_id in self.pending.items() if option_id is None]
+        self.pending = {}
+        with db() as conn:
+            c = conn.cursor()
+            c.executemany("INSERT OR REPLACE INTO poll_votes (poll_id, user_id, option_id, voted_at) VALUES (?,?,?,?)", votes)
+            c.executemany("DELETE FROM poll_votes WHERE poll_id=? AND user_id=?", retracted)
+            conn.commit()
+
+    def close(self, poll_id):
+        self.flush()
+        poll = self.polls.pop(poll_id, None)
+        if poll is None:
+            return None
+        for tg_poll_id, _, _ in poll.messages:
+            self.tg_polls.pop(tg_poll_id, None)
+        with db() as conn:
+            c = conn.cursor()
+            c.execute("UPDATE polls SET closed=1, responses=? WHERE poll_id=?", (",".join(map(str, poll.counts)), poll_id))
+            conn.commit()
+        return poll
+
+poll_registry = PollRegistry()
+
+def load_polls(job_queue):
+    # Polling yang masih terbuka saat restart: bangun ulang tally & jadwalkan penutupan
+    now = int(time.time())
+    with db() as conn:
+        c = conn.cursor()
+        rows = c.execute("SELECT poll_id, question, options, closes_at FROM polls WHERE closed=0 AND closes_at IS NOT NULL").fetchall()
+        for poll_id, question, options, closes_at in rows:
+            messages = c.execute("SELECT tg_poll_id, chat_id, message_id FROM poll_messages WHERE poll_id=?", (poll_id,)).fetchall()
+            poll = ActivePoll(poll_id, question, options.split(","), [chat_id for _, chat_id, _ in messages], closes_at)
+            poll_registry.open(poll)
+            for message in messages:
+                poll_registry.add_message(poll, *message)
+            for user_id, option_id in c.execute("SELECT user_id, option_id FROM poll_votes WHERE poll_id=?", (poll_id,)).fetchall():
+                poll.vote(user_id, option_id)
+            job_queue.run_once(poll_close_job, max(0, closes_at - now), data=poll_id)
+    logger.info("Polls loaded: %d open.", len(rows))
+
+async def poll_audience(user_id):
+    # Peserta: diri sendiri + partner chat, atau seluruh member grup
+    partner_id = await partner_of(user_id)
+    if partner_id:
+        return [user_id, partner_id]
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT members FROM groups WHERE members LIKE ?", (f"%{user_id}%",))
+        for (members_str,) in c.fetchall():
+            members = [int(mid) for mid in members_str.split(",") if mid]
+            if user_id in members:
+                return members
+    return []
+
 async def poll_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Kirim pertanyaan polling (opsi pisahkan dengan koma):\nContoh: Apakah kamu suka fitur baru?,Ya,Tidak")
+    user_id = update.effective_user.id
+    if not await poll_audience(user_id):
+        await update.message.reply_text(tr(user_id, "poll_no_audience"))
+        return ConversationHandler.END
+    await update.message.reply_text(tr(user_id, "poll_ask"))
+    return POLL_TEXT
+
 async def poll_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    parts = update.message.text.split(",")
-    if len(parts) < 2:
-        await update.message.reply_text("Format salah.")
-        return
-    question = parts[0]
-    options = parts[1:]
-    poll_msg = await update.message.reply_poll(question, options, is_anonymous=True)
+    user_id = update.effective_user.id
+    parts = [part.strip() for part in update.message.text.split(",")]
+    question, options = parts[0], [option for option in parts[1:] if option]
+    if not question or not 2 <= len(options) <= POLL_MAX_OPTIONS:
+        await update.message.reply_text(tr(user_id, "poll_bad_format"))
+        return POLL_TEXT
+    audience = await poll_audience(user_id)
+    if not audience:
+        await update.message.reply_text(tr(user_id, "poll_no_audience"))
+        return ConversationHandler.END
+    closes_at = int(time.time()) + POLL_DURATION
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO polls (question, options, responses, created_at, creator_id, closes_at) VALUES (?,?,?,?,?,?)",
+                  (question, ",".join(options), "", int(time.time()), user_id, closes_at))
+        poll_id = c.lastrowid
+        conn.commit()
+    poll = ActivePoll(poll_id, question, options, audience, closes_at)
+    poll_registry.open(poll)
+    # Poll non-anonim per peserta supaya setiap jawaban masuk lewat PollAnswer
+    sent = await asyncio.gather(*[outbox.send(PRIO_NOTIFY, "send_poll", uid, question, options, is_anonymous=False)
+                                  for uid in audience], return_exceptions=True)
+    for uid, message in zip(audience, sent):
+        if not isinstance(message, Exception):
+            poll_registry.add_message(poll, message.poll.id, uid, message.message_id)
     with db() as conn:
         c = conn.cursor()
-        c.execute("INSERT INTO polls (question, options, responses, created_at) VALUES (?,?,?,?)",
-                  (question, ",".join(options), "", int(time.time())))
+        c.executemany("INSERT INTO poll_messages (tg_poll_id, poll_id, chat_id, message_id) VALUES (?,?,?,?)",
+                      [(tg_poll_id, poll_id, chat_id, message_id) for tg_poll_id, chat_id, message_id in poll.messages])
         conn.commit()
+    context.job_queue.run_once(poll_close_job, POLL_DURATION, data=poll_id)
+    await update.message.reply_text(tr(user_id, "poll_sent", count=len(poll.messages), minutes=POLL_DURATION // 60))
+    return ConversationHandler.END
+
+async def poll_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(tr(update.effective_user.id, "poll_cancelled"))
+    return ConversationHandler.END
+
+async def poll_answer_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    answer = update.poll_answer
+    if answer.user:
+        poll_registry.record(answer.poll_id, answer.user.id, answer.option_ids)
+
+async def poll_flush_job(context: ContextTypes.DEFAULT_TYPE):
+    poll_registry.flush()
+
+async def poll_close_job(context: ContextTypes.DEFAULT_TYPE):
+    poll = poll_registry.close(context.job.data)
+    if poll is None:
+        return
+    results, total = poll.results()
+    for _, chat_id, message_id in poll.messages:
+        outbox.send(PRIO_NOTIFY, "stop_poll", chat_id, message_id)
+        outbox.send(PRIO_NOTIFY, "send_message", chat_id, tr(chat_id, "poll_results", question=poll.question, results=results, total=total))
+
 
 # ========== Secret Mode ==========
 async def secret_mode_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("UPDATE sessions SET secret_mode=1 WHERE user_id=?", (user_id,))
-        conn.commit()
-    await update.message.reply_text("Mode rahasia aktif. Pesanmu akan dihapus otomatis setelah dibaca.")
+    await storage.set_secret_mode(user_id)
+    await update.message.reply_text(tr(user_id, "secret_on"))
 
 # ========== Leaderboard & Broadcast ==========
-async def daily_leaderboard_job(context: ContextTypes.DEFAULT_TYPE):
+async def daily_leaderboard_job(since, now):
     with db() as conn:
         c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM user_profiles")
-        user_count = c.fetchone()[0]
-        c.execute("SELECT COUNT(*) FROM sessions")
-        chat_count = c.fetchone()[0]
         c.execute("SELECT COUNT(*) FROM reports WHERE timestamp > ?", (int(time.time())-86400,))
         report_count = c.fetchone()[0]
-        c.execute("SELECT user_id, points FROM user_profiles ORDER BY points DESC LIMIT 5")
-        top_users = c.fetchall()
+    user_count = await storage.count_users()
+    top_users = await storage.top_points(5)
+    chat_count = await storage.count_sessions()
     leaderboard = "\n".join([f"{i+1}. {mask_username('')} - {p} poin" for i, (uid, p) in enumerate(top_users)])
-    await context.bot.send_message(OWNER_ID,
+    outbox.send(PRIO_OWNER, "send_message", OWNER_ID,
         f"📊 Leaderboard Harian\nUser: {user_count}\nChat: {chat_count}\nReport 24h: {report_count}\nTop Poin:\n{leaderboard}")
 
-def broadcast_quiz_winners(context: ContextTypes.DEFAULT_TYPE, quiz_id):
-    with db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT user_id, prize FROM quiz_winners WHERE quiz_id=?", (quiz_id,))
-        winners = c.fetchall()
-    winners_masked = [f"{mask_username('')} - {prize}" for uid, prize in winners]
-    msg = f"🎉 Pemenang Quiz #{quiz_id} Hari Ini:\n" + "\n".join(winners_masked)
+async def broadcast_quiz_winners(quiz_id):
+    winners = await storage.quiz_winners(quiz_id)
+    winners_masked = "\n".join(f"{mask_username('')} - {prize}" for uid, prize in winners)
+    # Satu teks per bahasa, bukan per user
+    messages = {lang: TEMPLATES[lang]["quiz_winners"](quiz_id=quiz_id, winners=winners_masked) for lang in LANGS}
     # Broadcast ke semua user
+    for uid, lang in await storage.user_languages():
+        outbox.send(PRIO_BROADCAST, "send_message", uid, messages.get(lang, messages[DEFAULT_LANG]))
+
+async def quiz_round_job(since, now):
+    # Ronde harian untuk semua user: umumkan pemenang ronde sebelumnya, lalu buka ronde baru.
+    # Ronde disimpan di runtime_state supaya /answer di worker mana pun & setelah restart tetap sah.
+    previous = load_state("quiz_round")
+    if previous is not None:
+        current_quiz.pop(previous["quiz_id"], None)
+        await broadcast_quiz_winners(previous["quiz_id"])
+    # ID bekas ronde lama akan ikut menarik pemenang lamanya di broadcast_quiz_winners
+    quiz_id = await new_quiz_id()
+    users = await storage.user_languages()
+    q_data = random.choice(QUIZ_QUESTIONS)
+    save_states({"quiz_round": {"quiz_id": quiz_id, "question": q_data["q"], "answer": q_data["a"].lower(), "opened_at": now}})
+    messages = {lang: TEMPLATES[lang]["quiz_question"](quiz_id=quiz_id, question=q_data["q"]) for lang in LANGS}
+    for uid, lang in users:
+        outbox.send(PRIO_BROADCAST, "send_message", uid, messages.get(lang, messages[DEFAULT_LANG]))
+    logger.info("Quiz round #%d opened for %d users.", quiz_id, len(users))
+
+# ========== Admin Stats ==========
+@owner_only
+async def adminstats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    stats = outbox.stats()
+    wait = waiting_room.stats()
+    await update.message.reply_text(
+        f"📤 Outbox\nAntri: {stats['queued']}\nTerkirim: {stats['sent']}\nGagal: {stats['failed']}\n"
+        f"Retry: {stats['retried']}\nDigabung: {stats['coalesced']}\n"
+        f"Delay p50/p95/max: {stats['delay_p50']:.2f}/{stats['delay_p95']:.2f}/{stats['delay_max']:.2f}s\n\n"
+        f"🔎 Ruang tunggu\nMenunggu: {wait['waiting']}\nCocok: {wait['matched']}\nTimeout: {wait['timeouts']}\n"
+        f"Tunggu p50/p90/p99: {wait['wait_p50']:.0f}/{wait['wait_p90']:.0f}/{wait['wait_p99']:.0f}s"
+    )
+
+@owner_only
+async def profile_start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if profiler.start():
+        await update.message.reply_text(f"🔬 Profiling aktif. Update > {PROFILE_SLOW_UPDATE_MS} ms dicatat. /profile_stop untuk selesai.")
+    else:
+        await update.message.reply_text("Profiling sudah aktif.")
+
+@owner_only
+async def profile_stop_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(await profiler.stop() or "Profiling belum aktif.")
+
+@owner_only
+async def block_report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not block_detector.running:
+        await update.message.reply_text("Detektor blocking tidak aktif (BLOCK_DETECT).")
+        return
+    await update.message.reply_text(block_detector.report())
+    if context.args and context.args[0] == "reset":
+        block_detector.reset()
+
+@owner_only
+async def backup_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("💾 Backup berjalan...")
+    try:
+        path, size, seconds = await run_backup()
+    except Exception as e:
+        logger.exception("Backup failed.")
+        await update.message.reply_text(f"💾 Backup gagal: {e}")
+        return
+    shipping = f"\nWAL: {wal_shipper.segments} segmen terkirim" if wal_shipper.running else ""
+    await update.message.reply_text(f"💾 {path} ({size / 1e6:.1f} MB, {seconds:.1f}s), terverifikasi.{shipping}")
+
+@owner_only
+async def block_media_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    reply = update.message.reply_to_message
+    target = media_target(reply) if reply else None
+    if target is None:
+        await update.message.reply_text("Balas sebuah foto atau stiker dengan /blockmedia.")
+        return
+    fingerprint = await fingerprint_media(context.bot, *target)
+    added = media_blocklist.add(target[0], fingerprint, "owner", update.effective_user.id)
+    await update.message.reply_text(f"🧷 {target[0]} {fingerprint:016x} " + ("masuk blocklist." if added else "sudah ada di blocklist."))
+
+def format_job_time(ts, timezone):
+    return datetime.fromtimestamp(ts, ZoneInfo(timezone)).strftime("%Y-%m-%d %H:%M") if ts else "-"
+
+@owner_only
+async def jobs_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args or []
+    if len(args) >= 2 and args[0] in ("run", "pause", "resume", "schedule"):
+        action, name = args[0], args[1]
+        if name not in scheduler.jobs:
+            await update.message.reply_text(f"Job tidak dikenal: {name}. Job: " + ", ".join(scheduler.jobs))
+            return
+        if action == "run":
+            scheduler.update(name, next_run_at=int(time.time()))
+        elif action in ("pause", "resume"):
+            scheduler.update(name, enabled=int(action == "resume"))
+        else:
+            schedule, timezone = " ".join(args[2:4]), args[4] if len(args) > 4 else SCHEDULER_TIMEZONE
+            try:
+                next_run_at = next_occurrence(schedule, timezone, int(time.time()))
+            except ValueError as e:
+                await update.message.reply_text(f"❌ {name}: {e}")
+                return
+            scheduler.update(name, schedule=schedule, timezone=timezone, next_run_at=next_run_at)
+        await update.message.reply_text(f"✅ {name}: {action}.")
+        return
+    lines = [f"⏰ Job terjadwal (worker {scheduler.worker})"]
+    for name, schedule, timezone, enabled, next_run_at, last_run_at, last_status, runs, failures, lease_owner in scheduler.rows():
+        state = f"berjalan di {lease_owner}" if lease_owner else f"berikutnya {format_job_time(next_run_at, timezone)}" if enabled else "dijeda"
+        lines.append(f"{name}: {schedule} {timezone}\n  {state} · terakhir {last_status or '-'} ({format_job_time(last_run_at, timezone)}) · {runs} run, {failures} gagal")
+    lines.append("\n/jobs run|pause|resume <nama>\n/jobs schedule <nama> daily HH:MM|every <detik> [zona]")
+    await update.message.reply_text("\n".join(lines))
+
+def format_config_value(value):
+    return ", ".join(value) if isinstance(value, list) else str(value)
+
+@owner_only
+async def config_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    cfg = config.current
+    lines = [f"{'*' if cfg[key] != default else ' '} {key} = {format_config_value(cfg[key])}" for key, default in CONFIG_DEFAULTS.items()]
+    await update.message.reply_text(f"⚙️ Config v{cfg.version} (* = diubah dari default)\n" + "\n".join(lines) +
+                                    "\n\n/setconfig <key> <nilai> (list dipisah koma, - = kembali ke default)")
+
+@owner_only
+async def set_config_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    key, _, text = update.message.text.partition(" ")[2].strip().partition(" ")
+    text = text.strip()
+    if key not in CONFIG_DEFAULTS or not text:
+        await update.message.reply_text("Format: /setconfig <key> <nilai>\nKey: " + ", ".join(CONFIG_DEFAULTS))
+        return
+    user_id = update.effective_user.id
+    try:
+        if text == "-":
+            config.reset(key, user_id)
+            await update.message.reply_text(f"✅ {key} kembali ke default (config v{config.current.version}).")
+            return
+        value = config.set(key, text, user_id)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {key}: {e}")
+        return
+    await update.message.reply_text(f"✅ {key} = {format_config_value(value)} (config v{config.current.version}).")
+
+# ========== Routing ==========
+# Perintah & tombol menu -> handler, di-resolve route_text dengan satu lookup dict.
+# /profile, /searchpro, /poll (dan tombolnya) adalah entry point ConversationHandler.
+COMMAND_ROUTES = {
+    "/start": start, "/help": help_cmd, "/upgrade": help_cmd, "/find": find_cmd,
+    "/playquiz": play_quiz_cmd, "/answer": answer_quiz_cmd, "/tukarpro7": tukarpro7_cmd, "/redeem": redeem_points_cmd,
+    "/joingroup": join_group_cmd, "/leavegroup": leave_group_cmd, "/next": next_cmd, "/stop": stop_cmd,
+    "/report": report_cmd, "/feedback": feedback_cmd, "/secretmode": secret_mode_cmd, "/adminstats": adminstats_cmd,
+    "/profile_start": profile_start_cmd, "/profile_stop": profile_stop_cmd, "/blockmedia": block_media_cmd,
+    "/config": config_cmd, "/setconfig": set_config_cmd, "/blockreport": block_report_cmd,
+    "/backup": backup_cmd, "/jobs": jobs_cmd,
+}
+BUTTON_ROUTES = {
+    "find": find_cmd, "upgrade": help_cmd, "quiz": play_quiz_cmd, "join_group": join_group_cmd,
+    "leave_group": leave_group_cmd, "next": next_cmd, "stop": stop_cmd, "feedback": feedback_cmd,
+    "secret": secret_mode_cmd,
+}
+CONVERSATION_COMMANDS = {"/profile": "profile", "/searchpro": "search_pro", "/poll": "poll"}
+
+def build_routes():
+    # Dibungkus traced_callback supaya trace profiling menyebut handler tujuan, bukan hanya route_text
+    routes = {command: traced_callback(handler) for command, handler in COMMAND_ROUTES.items()}
+    for key, handler in BUTTON_ROUTES.items():
+        traced = traced_callback(handler)
+        for label in button_labels(key):
+            routes[label] = traced
+    return routes
+
+TEXT_ROUTES = build_routes()
+
+def check_routes():
+    # Self-check saat boot: setiap tombol di setiap bahasa harus punya tepat satu tujuan
+    problems = []
+    conversation_keys = set(CONVERSATION_COMMANDS.values())
+    for lang, labels in BUTTONS.items():
+        for key, label in labels.items():
+            if BUTTON_KEYS.get(label) != key:
+                problems.append(f"{lang} label {label!r} ({key}) bentrok dengan tombol {BUTTON_KEYS.get(label)}")
+            elif key in conversation_keys:
+                if label in TEXT_ROUTES:
+                    problems.append(f"{lang} label {label!r} ({key}) menutupi entry point conversation")
+            elif getattr(TEXT_ROUTES.get(label), "__wrapped__", None) is not BUTTON_ROUTES.get(key):
+                problems.append(f"{lang} label {label!r} ({key}) tidak punya handler")
+    for command in CONVERSATION_COMMANDS:
+        if command in TEXT_ROUTES:
+            problems.append(f"{command} menutupi entry point conversation")
+    if problems:
+        raise RuntimeError("Routing tidak konsisten:\n" + "\n".join(problems))
+    logger.info("Routes checked: %d commands, %d button labels.", len(COMMAND_ROUTES), len(TEXT_ROUTES) - len(COMMAND_ROUTES))
+
+def resolve_route(text):
+    # -> (handler, args); handler None = teks biasa (relay) atau perintah tak dikenal
+    if text[0] == "/":
+        command, _, rest = text.partition(" ")
+        return TEXT_ROUTES.get(command.split("@", 1)[0]), rest.split()
+    return TEXT_ROUTES.get(text), []
+
+async def route_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    handler, args = resolve_route(text)
+    if handler is not None:
+        context.args = args
+        return await handler(update, context)
+    if text[0] != "/":
+        return await forward_message(update, context)
+
+# ========== Audit CLI ==========
+# python bot.py events [--since ...] [--until ...] [--kind ...] [--user ID] [--limit N]
+# python bot.py replay [--at ...] [--apply]
+def parse_time(value):
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp())
+
+def replay_events(conn, until=None):
+    # Bangun ulang state turunan (ban, pro, poin) per user dari event, urut sesuai id
+    state = {}
+    rows = conn.execute("SELECT kind, subject_id, data FROM events WHERE ts <= ? AND kind IN ('ban', 'unban', 'pro_grant', 'points') ORDER BY id",
+                        (until if until is not None else int(time.time()),))
+    for kind, subject_id, data in rows:
+        data = json.loads(data) if data else {}
+        user = state.setdefault(subject_id, {"banned_until": 0, "pro_expires_at": 0, "points": 0})
+        if kind == "ban":
+            user["banned_until"] = data["until"]
+        elif kind == "unban":
+            user["banned_until"] = 0
+        elif kind == "pro_grant":
+            user["pro_expires_at"] = data["until"]
+        elif kind == "points":
+            user["points"] += data["delta"]
+    return state
+
+def events_cli(args):
+    query = "SELECT ts, kind, actor_id, subject_id, data FROM events WHERE 1=1"
+    params = []
+    if args.since:
+        query += " AND ts >= ?"
+        params.append(parse_time(args.since))
+    if args.until:
+        query += " AND ts <= ?"
+        params.append(parse_time(args.until))
+    if args.kind:
+        query += " AND kind = ?"
+        params.append(args.kind)
+    if args.user:
+        query += " AND (subject_id = ? OR actor_id = ?)"
+        params += [args.user, args.user]
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(args.limit)
+    with db() as conn:
+        rows = conn.execute(query, params).fetchall()
+    for ts, kind, actor_id, subject_id, data in reversed(rows):
+        actor = f" by={actor_id}" if actor_id is not None else ""
+        print(f"{datetime.fromtimestamp(ts):%Y-%m-%d %H:%M:%S}  {kind:<13} user={subject_id}{actor}  {data or ''}")
+
+def replay_cli(args):
+    # Event di SQLite lokal, saldo di storage (bisa PostgreSQL)
+    with db() as conn:
+        state = replay_events(conn, parse_time(args.at))
+    asyncio.run(replay_compare(state, args))
+
+async def replay_compare(state, args):
+    await storage.open()
+    try:
+        balances = await storage.balances(list(state))
+        changed = 0
+        for user_id, user in sorted(state.items()):
+            row = balances.get(user_id)
+            if row is None:
+                continue
+            current = {key: value or 0 for key, value in zip(["banned_until", "pro_expires_at", "points"], row)}
+            if current == user:
+                continue
+            changed += 1
+            print(f"user {user_id}: db={current} events={user}")
+            if args.apply:
+                banned = int(user["banned_until"] > time.time())
+                await storage.set_balances(user_id, user["banned_until"] * banned, user["pro_expires_at"], user["points"])
+    finally:
+        await storage.close()
+    print(f"{len(state)} users in event log, {changed} differ from user_profiles" + (" (applied)" if args.apply and changed else ""))
+
+def backup_cli(args):
+    path, size, seconds = take_backup()
+    print(f"{path}: {size / 1e6:.1f} MB in {seconds:.1f}s, verified")
+
+def restore_cli(args):
+    snapshot = args.snapshot or list_backups()[-1]
+    if os.path.abspath(args.target) == os.path.abspath(DB_PATH):
+        raise SystemExit("Restore ke file baru, lalu ganti DB_PATH setelah bot berhenti.")
+    epochs = restore_backup(snapshot, args.target, until=parse_time(args.until), replay_wal=not args.no_wal)
+    print(f"{snapshot} -> {args.target}: integrity ok, {epochs} WAL epochs replayed")
+
+def run_cli(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog="bot.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+    events = commands.add_parser("events", help="tampilkan audit log")
+    events.add_argument("--since", help="ISO datetime atau unix time")
+    events.add_argument("--until", help="ISO datetime atau unix time")
+    events.add_argument("--kind")
+    events.add_argument("--user", type=int)
+    events.add_argument("--limit", type=int, default=100)
+    events.set_defaults(func=events_cli)
+    replay = commands.add_parser("replay", help="bangun ulang ban/pro/poin dari audit log")
+    replay.add_argument("--at", help="state per waktu ini (default: sekarang)")
+    replay.add_argument("--apply", action="store_true", help="tulis hasil replay ke user_profiles")
+    replay.set_defaults(func=replay_cli)
+    backup = commands.add_parser("backup", help="snapshot online ke BACKUP_DIR")
+    backup.set_defaults(func=backup_cli)
+    restore = commands.add_parser("restore", help="pulihkan snapshot (+ segmen WAL) ke file baru")
+    restore.add_argument("snapshot", nargs="?", help="file .db.gz (default: terbaru)")
+    restore.add_argument("target", help="file database tujuan (bukan database yang sedang dipakai)")
+    restore.add_argument("--until", help="putar ulang WAL sampai waktu ini (ISO datetime atau unix time)")
+    restore.add_argument("--no-wal", action="store_true", help="hanya snapshot, tanpa segmen WAL")
+    restore.set_defaults(func=restore_cli)
+    args = parser.parse_args(argv)
+    init_db()
+    args.func(args)
+
+# ========== Lifecycle ==========
+# Deploy: proses baru boot (import, init_db, build) selagi proses lama masih melayani, lalu menunggu
+# lock instance. SIGTERM ke proses lama: polling berhenti, update yang sudah diterima diproses,
+# buffer write-behind & kiriman keluar dikosongkan, state runtime disimpan, lock dilepas.
+# Session & antrian chat sudah di SQLite; update yang masuk di sela restart ditahan Telegram.
+def load_state(key, default=None):
+    with db() as conn:
+        row = conn.execute("SELECT value FROM runtime_state WHERE key=?", (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+def load_states(prefix):
+    # prefix tidak boleh berisi karakter GLOB (* ? [)
+    with db() as conn:
+        rows = conn.execute("SELECT key, value FROM runtime_state WHERE key GLOB ?", (prefix + "*",)).fetchall()
+    return {key[len(prefix):]: json.loads(value) for key, value in rows}
+
+def save_states(items):
+    # value None = hapus key
+    now = int(time.time())
     with db() as conn:
         c = conn.cursor()
-        c.execute("SELECT user_id FROM user_profiles")
-        user_ids = [row[0] for row in c.fetchall()]
-    for uid in user_ids:
+        c.executemany("INSERT OR REPLACE INTO runtime_state (key, value, updated_at) VALUES (?,?,?)",
+                      [(key, json.dumps(value), now) for key, value in items.items() if value is not None])
+        c.executemany("DELETE FROM runtime_state WHERE key=?", [(key,) for key, value in items.items() if value is None])
+        conn.commit()
+
+class RuntimePersistence(BasePersistence):
+    # user_data, bot_data & posisi ConversationHandler di runtime_state: user yang sedang
+    # mengisi /profile atau /searchpro melanjutkan dari langkah yang sama setelah restart
+    def __init__(self):
+        super().__init__(PersistenceInput(bot_data=True, chat_data=False, user_data=True, callback_data=False),
+                         update_interval=LIFECYCLE_PERSIST_INTERVAL)
+
+    async def get_user_data(self):
+        return {int(user_id): data for user_id, data in load_states("user_data:").items()}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return load_state("bot_data", {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {tuple(json.loads(key)): state for key, state in load_states(f"conversation:{name}:").items()}
+
+    async def update_conversation(self, name, key, new_state):
+        save_states({f"conversation:{name}:{json.dumps(list(key))}": new_state})
+
+    async def update_user_data(self, user_id, data):
+        save_states({f"user_data:{user_id}": data or None})
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        save_states({"bot_data": data})
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def drop_user_data(self, user_id):
+        save_states({f"user_data:{user_id}": None})
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        # Setiap update langsung ditulis, tidak ada buffer
+        pass
+
+# File lock instance ini; dipegang sampai proses keluar, OS melepasnya walau proses crash
+instance_lock = None
+
+def acquire_instance_lock(path, timeout=None):
+    # Tunggu proses lama selesai shutdown; fd harus tetap hidup selama proses berjalan.
+    # Proses lama yang macet tidak menahan deploy selamanya: TimeoutError setelah timeout detik
+    timeout = LIFECYCLE_LOCK_TIMEOUT if timeout is None else timeout
+    lock = open(path, "w")
+    started = time.monotonic()
+    next_log = started
+    while True:
         try:
-            context.bot.send_message(uid, msg)
-        except Exception:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            waited = time.monotonic() - started
+            if waited >= timeout:
+                lock.close()
+                raise TimeoutError(f"{path} still locked after {timeout}s; is another instance running?")
+            if time.monotonic() >= next_log:
+                logger.info("Waiting for the previous instance to release %s (%.0fs/%ds)...", path, waited, timeout)
+                next_log += LIFECYCLE_LOCK_LOG_INTERVAL
+            time.sleep(0.2)
+    if time.monotonic() - started > 0.2:
+        logger.info("Instance lock acquired after %.1fs.", time.monotonic() - started)
+    return lock
+
+def restore_runtime_state():
+    for quiz_id, quiz in load_state("current_quiz", {}).items():
+        current_quiz[int(quiz_id)] = quiz
+    logger.info("Runtime state restored: %d active quizzes.", len(current_quiz))
+
+async def drain_for_shutdown():
+    # Dipanggil setelah Application.stop (ingest berhenti, update antrian & persistence sudah
+    # diproses) dan sebelum koneksi Bot API ditutup, jadi kiriman terakhir masih bisa keluar
+    started = time.monotonic()
+    health.phase = "draining"
+    await scheduler.stop(LIFECYCLE_DRAIN_SECONDS)
+    owner_alerts.flush()
+    poll_registry.flush()
+    if event_log.flushing is not None:
+        await event_log.flushing
+    event_log.flush()
+    save_states({"current_quiz": current_quiz or None})
+    unsent = await outbox.drain(LIFECYCLE_DRAIN_SECONDS)
+    if unsent:
+        logger.warning("Shutdown drain deadline hit: %d outbound messages dropped.", unsent)
+    logger.info("Drained for shutdown in %.2fs.", time.monotonic() - started)
+
+# ========== Health ==========
+# Server HTTP (stdlib) di thread sendiri, tetap menjawab walau event loop macet. Thread hanya
+# membaca nilai yang ditulis loop: detak probe, fase lifecycle, snapshot /stats.
+def hit_rate(cache):
+    total = cache.hits + cache.misses
+    return round(cache.hits / total, 3) if total else None
+
+def health_job(job):
+    # next_run_time baru ada setelah JobQueue start
+    next_run = getattr(job.job, "next_run_time", None)
+    return {"name": job.name, "next": next_run.isoformat() if next_run else None}
+
+class HealthMonitor:
+    def __init__(self):
+        self.phase = "starting"     # starting -> running -> draining
+        self.beat = time.monotonic()
+        self.lag = 0.0
+        self.snapshot = {}
+        self.storage_ok_at = None   # monotonic ping storage sukses terakhir
+        self.storage_error = "not checked yet"
+        self.task = None
+        self.ping_task = None
+        self.server = None
+
+    def start(self, application):
+        self.beat = time.monotonic()
+        self.task = asyncio.create_task(self.probe(application))
+        self.ping_task = asyncio.create_task(self.ping_storage())
+        if HEALTH_PORT:
+            self.server = make_health_server(self)
+            threading.Thread(target=self.server.serve_forever, name="health", daemon=True).start()
+            logger.info("Health endpoints on http://%s:%d.", HEALTH_HOST, self.server.server_port)
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self.ping_task:
+            self.ping_task.cancel()
+            self.ping_task = None
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    async def probe(self, application):
+        next_stats = 0.0
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(HEALTH_PROBE_INTERVAL)
+            now = time.monotonic()
+            self.lag = now - started - HEALTH_PROBE_INTERVAL
+            self.beat = now
+            if now >= next_stats:
+                next_stats = now + HEALTH_STATS_INTERVAL
+                try:
+                    self.snapshot = await self.collect(application)
+                except Exception:
+                    logger.exception("Health stats collection failed.")
+
+    async def ping_storage(self):
+        # Storage (bisa PostgreSQL) hanya bisa disentuh dari event loop; readiness membaca hasilnya.
+        # Task sendiri supaya ping yang lambat tidak menunda detak probe lag
+        while True:
+            try:
+                await asyncio.wait_for(storage.count_sessions(), HEALTH_DB_TIMEOUT)
+                self.storage_ok_at = time.monotonic()
+                self.storage_error = None
+            except Exception as e:
+                self.storage_error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            await asyncio.sleep(HEALTH_STORAGE_INTERVAL)
+
+    async def collect(self, application):
+        verdicts = getattr(moderator, "verdicts", None)
+        return {
+            "collected_at": int(time.time()),
+            "phase": self.phase,
+            "loop_lag": round(self.lag, 4),
+            "chatting_users": await storage.count_sessions(),
+            "waiting": len(waiting_room.entries),
+            "match_pool": len(match_pool),
+            "outbox": outbox.stats(),
+            "cache_hit_rate": {
+                "user": hit_rate(user_cache),
+                "profile_card": hit_rate(profile_cards),
+                "nsfw_verdict": hit_rate(verdicts) if verdicts is not None else None,
+            },
+            "spam": {"checked": spam_detector.checked, "flagged": spam_detector.flagged},
+            "media_blocklist_hits": media_blocklist.hits,
+            "config_version": config.current.version,
+            "blocking": block_detector.summary() if block_detector.running else None,
+            "jobs": [health_job(job) for job in application.job_queue.jobs()],
+            "scheduled_jobs": scheduler.summary(),
+        }
+
+    def liveness(self):
+        # Loop yang macet berhenti berdetak: lama sejak detak terakhir ikut dihitung sebagai lag
+        lag = max(self.lag, time.monotonic() - self.beat - HEALTH_PROBE_INTERVAL)
+        return lag < HEALTH_MAX_LAG, {"loop_lag": round(lag, 4)}
+
+    def readiness(self):
+        live, detail = self.liveness()
+        queued = outbox.pending - outbox.inflight
+        detail.update(phase=self.phase, outbox_queued=queued)
+        try:
+            # Koneksi sendiri di thread ini; db() bisa memakai TracedConnection milik profiler
+            conn = sqlite3.connect(DB_PATH, timeout=HEALTH_DB_TIMEOUT)
+            try:
+                conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            finally:
+                conn.close()
+            detail["db"] = "ok"
+        except sqlite3.Error as e:
+            detail["db"] = str(e)
+        ok_at = self.storage_ok_at
+        storage_fresh = ok_at is not None and time.monotonic() - ok_at < HEALTH_STORAGE_MAX_AGE
+        detail["storage"] = "ok" if storage_fresh and self.storage_error is None else (self.storage_error or "stale")
+        detail["storage_checked_ago"] = round(time.monotonic() - ok_at, 1) if ok_at is not None else None
+        return (live and self.phase == "running" and detail["db"] == "ok" and detail["storage"] == "ok"
+                and queued < HEALTH_MAX_OUTBOX), detail
+
+health = HealthMonitor()
+
+def make_health_server(monitor):
+    # http.server baru di-import di sini, sama seperti dependensi jarang pakai lainnya
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/livez":
+                ok, body = monitor.liveness()
+            elif self.path == "/readyz":
+                ok, body = monitor.readiness()
+            elif self.path == "/stats":
+                ok, body = True, monitor.snapshot
+            else:
+                self.send_error(404)
+                return
+            payload = json.dumps(body).encode()
+            self.send_response(200 if ok else 503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            # Dipoll tiap detik oleh supervisor; jangan memenuhi log
+            pass
+
+    server = ThreadingHTTPServer((HEALTH_HOST, HEALTH_PORT), HealthHandler)
+    server.daemon_threads = True
+    return server
+
+# ========== Backup ==========
+# Snapshot online lewat backup API SQLite di thread executor. Koneksi sumber memegang satu read
+# transaction (snapshot WAL), jadi handler tetap bisa menulis dan backup tidak pernah restart
+# walau database berubah di tengah jalan. Hasil di-gzip, diverifikasi, dirotasi.
+# Opsional (BACKUP_WAL_SHIP): frame WAL dikirim per segmen ke BACKUP_DIR/wal; restore memutar
+# ulang segmen di atas snapshot sampai waktu tertentu (point-in-time recovery).
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+
+def open_snapshot_source():
+    src = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+    src.execute("BEGIN")
+    src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    return src
+
+def gzip_file(source, target):
+    with open(source, "rb") as f, gzip.open(target + ".tmp", "wb", compresslevel=6) as out:
+        shutil.copyfileobj(f, out, 1 << 20)
+    os.replace(target + ".tmp", target)
+
+def gunzip_file(source, target):
+    with gzip.open(source, "rb") as f, open(target, "wb") as out:
+        shutil.copyfileobj(f, out, 1 << 20)
+
+def parse_segment_name(name):
+    # {seq}-{unix time}-{salt WAL}-{offset}.wal.gz
+    seq, ts, salt, offset = name[:-len(".wal.gz")].split("-")
+    return int(seq), int(ts), salt, int(offset)
+
+class WalShipper:
+    # Reader yang selalu terbuka menahan WAL agar tidak direstart (ditimpa dari awal) oleh
+    # checkpoint siapa pun; hanya shipper yang membuka jalan restart, setelah semua frame terkirim.
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.reader = None
+        self.writer = None
+        self.salt = None
+        self.offset = 0
+        self.seq = 0
+        self.epoch_seq = 0          # segmen pertama epoch WAL saat ini
+        self.pending = deque()      # (path, frame) sudah dibaca, belum ditulis
+        self.segments = 0
+        self.shipped_bytes = 0
+
+    @property
+    def running(self):
+        return self.reader is not None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".wal.gz"))
+        self.seq = self.epoch_seq = parse_segment_name(names[-1])[0] + 1 if names else 0
+        self.reader = open_snapshot_source()
+        self.writer = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+        logger.info("WAL shipping to %s from segment %d.", self.directory, self.seq)
+
+    def stop(self):
+        if not self.running:
+            return
+        self.ship()
+        self.reader.close()
+        self.writer.close()
+        self.reader = self.writer = None
+
+    def ship(self, on_locked=None):
+        # Sinkron (thread executor). Lock tulis database hanya ditahan selama membaca ekor WAL ke
+        # memori: tidak ada frame yang setengah ditulis, dan snapshot on_locked dimulai tepat di
+        # ujung yang terbaca. gzip & tulis file terjadi setelah lock dilepas.
+        with self.lock:
+            self.flush()
+            marker, frames = self.read_locked(on_locked)
+            self.flush()
+            # Checkpoint hanya saat ekor kosong (semua frame sudah di disk); di bawah beban dicoba
+            # beberapa ronde, sisanya menunggu pengiriman berikutnya
+            rounds = 0
+            while frames > BACKUP_WAL_CHECKPOINT_PAGES and rounds < BACKUP_WAL_CHECKPOINT_ROUNDS:
+                _, frames = self.read_locked(checkpoint=True)
+                self.flush()
+                rounds += 1
+        return marker
+
+    def read_locked(self, on_locked=None, checkpoint=False):
+        # -> (marker on_locked, jumlah frame epoch ini yang sudah terbaca)
+        self.writer.execute("BEGIN IMMEDIATE")
+        try:
+            new_frames, frames = self.read_tail()
+            marker = on_locked() if on_locked else None
+            if checkpoint and not new_frames:
+                # Semua frame sudah terkirim & writer tertahan: checkpoint penuh lalu biarkan
+                # writer berikutnya merestart WAL (epoch baru, salt baru)
+                self.reader.execute("COMMIT")
+                try:
+                    self.reader.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+                finally:
+                    self.reader.execute("BEGIN")
+                    self.reader.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                frames = 0
+        finally:
+            self.writer.execute("ROLLBACK")
+        return marker, frames
+
+    def read_tail(self):
+        # Frame baru sejak offset terakhir; berhenti di frame bersalt lain (sisa epoch lama).
+        # Segmen diberi nomor di sini dan diantre di self.pending untuk flush()
+        try:
+            f = open(DB_PATH + "-wal", "rb")
+        except FileNotFoundError:
+            return 0, 0
+        with f:
+            header = f.read(WAL_HEADER_SIZE)
+            if len(header) < WAL_HEADER_SIZE:
+                return 0, 0
+            salt = header[16:24]
+            if salt != self.salt:
+                self.salt, self.offset, self.epoch_seq = salt, 0, self.seq
+            frame_size = WAL_FRAME_HEADER_SIZE + int.from_bytes(header[8:12], "big")
+            start = max(self.offset, WAL_HEADER_SIZE)
+            f.seek(start)
+            chunks = []
+            while True:
+                frame = f.read(frame_size)
+                if len(frame) < frame_size or frame[8:16] != salt:
+                    break
+                chunks.append(frame)
+        end = start + len(chunks) * frame_size
+        if chunks:
+            data = (header if self.offset == 0 else b"") + b"".join(chunks)
+            name = f"{self.seq:010d}-{int(time.time())}-{salt.hex()}-{self.offset:010d}.wal.gz"
+            self.pending.append((os.path.join(self.directory, name), data))
+            self.seq += 1
+            self.offset = end
+        return len(chunks), (end - WAL_HEADER_SIZE) // frame_size
+
+    def flush(self):
+        # Segmen yang gagal ditulis tetap di antrean dan dicoba lagi sebelum segmen berikutnya
+        while self.pending:
+            path, data = self.pending[0]
+            with gzip.open(path + ".tmp", "wb", compresslevel=6) as out:
+                out.write(data)
+            os.replace(path + ".tmp", path)
+            self.pending.popleft()
+            self.segments += 1
+            self.shipped_bytes += len(data)
+
+wal_shipper = WalShipper(os.path.join(BACKUP_DIR, "wal"))
+# /backup, job harian & shutdown bisa memicu backup bersamaan; satu per satu per proses
+backup_lock = threading.Lock()
+
+def take_backup():
+    # Sinkron, untuk thread executor / CLI. -> (path, byte terkompresi, detik)
+    with backup_lock:
+        return write_backup()
+
+def write_backup():
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    started = time.monotonic()
+    name = f"bot-{datetime.now():%Y%m%d-%H%M%S}"
+    while os.path.exists(os.path.join(BACKUP_DIR, name + ".db.gz")):
+        # Nama per detik: backup kedua di detik yang sama menunggu detik berikutnya
+        time.sleep(0.1)
+        name = f"bot-{datetime.now():%Y%m%d-%H%M%S}"
+    path = os.path.join(BACKUP_DIR, name + ".db.gz")
+    raw = os.path.join(BACKUP_DIR, name + ".db.tmp")
+    meta = {"created_at": int(time.time()), "schema": SCHEMA_VERSION}
+    sources = []
+
+    def begin():
+        sources.append(open_snapshot_source())
+        return wal_shipper.epoch_seq
+
+    if wal_shipper.running:
+        # Snapshot dimulai saat writer tertahan, tepat di ujung WAL yang sudah terkirim
+        meta["wal_seq"] = wal_shipper.ship(on_locked=begin)
+    else:
+        begin()
+    src = sources[0]
+    dst = sqlite3.connect(raw)
+    try:
+        src.backup(dst, pages=BACKUP_PAGES_PER_STEP, progress=lambda status, remaining, total: time.sleep(BACKUP_STEP_SLEEP))
+    finally:
+        src.close()
+        dst.close()
+    gzip_file(raw, path)
+    os.remove(raw)
+    with open(os.path.join(BACKUP_DIR, name + ".json"), "w") as f:
+        json.dump(meta, f)
+    if BACKUP_VERIFY:
+        verify_backup(path)
+    rotate_backups()
+    return path, os.path.getsize(path), time.monotonic() - started
+
+def list_backups():
+    return sorted(os.path.join(BACKUP_DIR, name) for name in os.listdir(BACKUP_DIR) if name.endswith(".db.gz"))
+
+def backup_meta(path):
+    with open(path[:-len(".db.gz")] + ".json") as f:
+        return json.load(f)
+
+def rotate_backups():
+    backups = list_backups()
+    for path in backups[:-BACKUP_KEEP]:
+        os.remove(path)
+        os.remove(path[:-len(".db.gz")] + ".json")
+    # Segmen WAL sebelum epoch snapshot tertua tidak bisa dipakai lagi
+    oldest = backup_meta(backups[-BACKUP_KEEP:][0]).get("wal_seq") if backups else None
+    if oldest is not None and os.path.isdir(wal_shipper.directory):
+        for name in os.listdir(wal_shipper.directory):
+            if name.endswith(".wal.gz") and parse_segment_name(name)[0] < oldest:
+                os.remove(os.path.join(wal_shipper.directory, name))
+
+def wal_epochs(first_seq, until=None):
+    # Segmen berurutan sejak first_seq, dikelompokkan per epoch (salt); berhenti di celah
+    names = sorted(name for name in os.listdir(wal_shipper.directory) if name.endswith(".wal.gz"))
+    epochs = []
+    expected = None
+    for name in names:
+        seq, ts, salt, offset = parse_segment_name(name)
+        if seq < first_seq:
             continue
+        if until is not None and ts > until:
+            break
+        if offset == 0:
+            # Epoch yang sama dikirim ulang dari awal oleh proses baru: versi baru menggantikan
+            if epochs and epochs[-1][0] == salt:
+                epochs.pop()
+            epochs.append((salt, []))
+        elif not epochs or epochs[-1][0] != salt or offset != expected:
+            logger.warning("WAL gap before %s; replay stops here.", name)
+            break
+        with gzip.open(os.path.join(wal_shipper.directory, name), "rb") as f:
+            data = f.read()
+        epochs[-1][1].append(data)
+        expected = offset + len(data)
+    return [b"".join(chunks) for _, chunks in epochs]
+
+def restore_backup(path, target, until=None, replay_wal=True):
+    # -> jumlah epoch WAL yang diputar ulang; ValueError bila hasil tidak lolos integrity_check
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    gunzip_file(path, target)
+    first_seq = backup_meta(path).get("wal_seq")
+    epochs = wal_epochs(first_seq, until) if replay_wal and first_seq is not None and os.path.isdir(wal_shipper.directory) else []
+    for frames in epochs:
+        with open(target + "-wal", "wb") as f:
+            f.write(frames)
+        conn = sqlite3.connect(target)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        conn.close()
+    conn = sqlite3.connect(target)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise ValueError(f"integrity_check {path}: {result}")
+    return len(epochs)
+
+def verify_backup(path):
+    # Salinan uji per backup: proses CLI & bot tidak saling menimpa
+    target = path[:-len(".db.gz")] + ".verify.db"
+    try:
+        restore_backup(path, target, replay_wal=False)
+        conn = sqlite3.connect(target)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        conn.close()
+        if version != SCHEMA_VERSION:
+            raise ValueError(f"schema v{version} in {path}, expected v{SCHEMA_VERSION}")
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(target + suffix):
+                os.remove(target + suffix)
+
+async def run_backup():
+    path, size, seconds = await asyncio.get_running_loop().run_in_executor(None, take_backup)
+    logger.info("Backup %s written (%.1f MB, %.1fs).", path, size / 1e6, seconds)
+    return path, size, seconds
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await run_backup()
+    except Exception as e:
+        logger.exception("Backup failed.")
+        outbox.send(PRIO_OWNER, "send_message", OWNER_ID, f"💾 Backup gagal: {e}")
+
+async def wal_ship_job(context: ContextTypes.DEFAULT_TYPE):
+    await asyncio.get_running_loop().run_in_executor(None, wal_shipper.ship)
+
+# ========== Scheduler ==========
+# Job yang harus jalan tepat sekali per jatuh tempo, dengan jadwal & run terakhir di tabel
+# scheduled_jobs. Run yang terlewat selama bot mati dikejar sekali (digabung, bukan per jatuh
+# tempo) bila masih dalam jendela catch-up. Satu jatuh tempo diklaim lewat lease di barisnya:
+# UPDATE bersyarat hanya berhasil untuk satu worker. Worker yang mati di tengah run melepas
+# jatuh temponya saat lease kedaluwarsa. Jadwal di kode hanya default saat baris pertama dibuat;
+# setelahnya baris (/jobs schedule) yang berlaku.
+# Format jadwal: "daily HH:MM" (jam dinding di zona baris) atau "every <detik>".
+class ScheduledJob:
+    __slots__ = ("name", "callback", "schedule", "catchup", "jitter", "lease")
+
+    def __init__(self, name, callback, schedule, catchup=None, jitter=0, lease=SCHEDULER_LEASE):
+        self.name = name
+        self.callback = callback    # async callback(since, now): since = awal run sukses terakhir, None = belum pernah
+        self.schedule = schedule
+        self.catchup = catchup      # detik; terlambat lebih dari ini = dilewati, None = selalu dikejar
+        self.jitter = jitter        # detik acak ditambahkan ke jatuh tempo berikutnya
+        self.lease = lease
+
+def next_occurrence(schedule, timezone, after):
+    kind, _, arg = schedule.partition(" ")
+    if kind == "every" and arg.isdigit() and int(arg) > 0:
+        return after + int(arg)
+    if kind == "daily" and re.fullmatch(r"([01]?\d|2[0-3]):[0-5]\d", arg):
+        try:
+            zone = ZoneInfo(timezone)
+        except (KeyError, ValueError):
+            raise ValueError(f"zona waktu tidak dikenal: {timezone}")
+        hour, minute = map(int, arg.split(":"))
+        day = datetime.fromtimestamp(after, zone).date()
+        # Dihitung per tanggal lokal, jadi pergantian DST tidak menggeser jam jalan
+        for date in (day, day + timedelta(days=1)):
+            at = int(datetime(date.year, date.month, date.day, hour, minute, tzinfo=zone).timestamp())
+            if at > after:
+                return at
+    raise ValueError(f"jadwal tidak dikenal: {schedule} (daily HH:MM atau every <detik>)")
+
+class Scheduler:
+    def __init__(self, jobs):
+        self.jobs = {job.name: job for job in jobs}
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.running = {}           # name -> task
+        self.task = None
+
+    def sync(self):
+        # Baris untuk job baru; baris yang sudah ada (mungkin diubah owner) tidak disentuh
+        now = int(time.time())
+        with db() as conn:
+            conn.executemany("INSERT OR IGNORE INTO scheduled_jobs (name, schedule, timezone, next_run_at) VALUES (?,?,?,?)",
+                             [(job.name, job.schedule, SCHEDULER_TIMEZONE, next_occurrence(job.schedule, SCHEDULER_TIMEZONE, now) + random.randint(0, job.jitter))
+                              for job in self.jobs.values()])
+            conn.commit()
+
+    def start(self):
+        self.sync()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self, timeout):
+        # Run yang sedang jalan diberi waktu selesai; sisanya dibatalkan dan lease-nya dilepas
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        running = list(self.running.values())
+        if not running:
+            return
+        _, pending = await asyncio.wait(running, timeout=timeout) if timeout else (None, running)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def run(self):
+        while True:
+            try:
+                self.tick(int(time.time()))
+            except Exception:
+                logger.exception("Scheduler tick failed.")
+            await asyncio.sleep(SCHEDULER_TICK)
+
+    def tick(self, now):
+        with db() as conn:
+            due = conn.execute("SELECT name, schedule, timezone, next_run_at, last_run_at FROM scheduled_jobs "
+                               "WHERE enabled=1 AND next_run_at<=? AND COALESCE(lease_until, 0)<? ORDER BY next_run_at", (now, now)).fetchall()
+        for name, schedule, timezone, due_at, last_run_at in due:
+            job = self.jobs.get(name)
+            if job is None or name in self.running:
+                continue
+            if len(self.running) >= SCHEDULER_MAX_CONCURRENT:
+                break
+            if self.claim(job, due_at, now):
+                self.running[name] = asyncio.create_task(self.execute(job, schedule, timezone, due_at, last_run_at))
+
+    def claim(self, job, due_at, now):
+        # next_run_at=? : worker yang terlambat membaca tidak bisa mengklaim jatuh tempo yang sudah dijalankan
+        with db() as conn:
+            claimed = conn.execute("UPDATE scheduled_jobs SET lease_owner=?, lease_until=? WHERE name=? AND next_run_at=? AND COALESCE(lease_until, 0)<?",
+                                   (self.worker, now + job.lease, job.name, due_at, now)).rowcount
+            conn.commit()
+        return claimed == 1
+
+    async def renew(self, job):
+        while True:
+            await asyncio.sleep(job.lease / 3)
+            self.update(job.name, lease_until=int(time.time()) + job.lease)
+
+    async def execute(self, job, schedule, timezone, due_at, last_run_at):
+        started = time.time()
+        late = int(started) - due_at
+        renewing = asyncio.create_task(self.renew(job))
+        try:
+            if job.catchup is not None and late > job.catchup:
+                logger.warning("Scheduled job %s skipped: %ds late (catch-up window %ds).", job.name, late, job.catchup)
+                status = "skipped"
+            else:
+                await job.callback(last_run_at, int(started))
+                status = "ok"
+        except asyncio.CancelledError:
+            # Shutdown: jatuh tempo tidak maju, worker berikutnya langsung bisa mengklaim
+            self.update(job.name, lease_owner=None, lease_until=None)
+            raise
+        except Exception as e:
+            logger.exception("Scheduled job %s failed.", job.name)
+            status = f"error: {e}"
+        finally:
+            renewing.cancel()
+            self.running.pop(job.name, None)
+        self.finish(job, schedule, timezone, status, started)
+
+    def finish(self, job, schedule, timezone, status, started):
+        now = int(time.time())
+        failed = status.startswith("error")
+        if failed:
+            next_run_at = now + SCHEDULER_RETRY_DELAY
+        else:
+            next_run_at = next_occurrence(schedule, timezone, now) + random.randint(0, job.jitter)
+        with db() as conn:
+            finished = conn.execute("""UPDATE scheduled_jobs SET next_run_at=?, last_status=?, last_duration=?, runs=runs+?, failures=failures+?,
+                                       last_run_at=CASE WHEN ? THEN ? ELSE last_run_at END, lease_owner=NULL, lease_until=NULL
+                                       WHERE name=? AND lease_owner=?""",
+                                    (next_run_at, status[:200], round(time.time() - started, 3), int(status != "skipped"), int(failed),
+                                     status == "ok", int(started), job.name, self.worker)).rowcount
+            conn.commit()
+        if not finished:
+            logger.warning("Scheduled job %s finished after its lease was taken over.", job.name)
+
+    def update(self, name, **fields):
+        # Perubahan lease hanya untuk lease milik worker ini
+        owned = " AND lease_owner=?" if "lease_until" in fields else ""
+        with db() as conn:
+            conn.execute(f"UPDATE scheduled_jobs SET {', '.join(f'{key}=?' for key in fields)} WHERE name=?{owned}",
+                         (*fields.values(), name) + ((self.worker,) if owned else ()))
+            conn.commit()
+
+    def rows(self):
+        with db() as conn:
+            return conn.execute("SELECT name, schedule, timezone, enabled, next_run_at, last_run_at, last_status, runs, failures, lease_owner "
+                                "FROM scheduled_jobs ORDER BY name").fetchall()
+
+    def summary(self):
+        return [{"name": name, "schedule": schedule, "enabled": bool(enabled), "next_run_at": next_run_at, "last_run_at": last_run_at,
+                 "last_status": last_status, "runs": runs, "failures": failures, "lease_owner": lease_owner}
+                for name, schedule, _, enabled, next_run_at, last_run_at, last_status, runs, failures, lease_owner in self.rows()]
+
+async def pro_expiry_job(since, now):
+    # Pro yang habis di (since, now], termasuk selama bot mati; run pertama tidak mengungkit yang lama
+    if since is None:
+        return
+    expired = await storage.pro_expired_between(since, now)
+    for user_id in expired:
+        event_log.append("pro_expired", user_id)
+        outbox.send(PRIO_NOTIFY, "send_message", user_id, tr(user_id, "pro_expired"))
+    if expired:
+        logger.info("Pro expired for %d users.", len(expired))
+
+# Event yang dibaca replay_events (ban, unban, pro_grant, points) tidak pernah dihapus
+RETENTION_QUERIES = {
+    "events": ("DELETE FROM events WHERE id IN (SELECT id FROM events WHERE ts<? AND kind NOT IN ('ban', 'unban', 'pro_grant', 'points') LIMIT ?)",
+               RETENTION_EVENTS_DAYS),
+    "reports": ("DELETE FROM reports WHERE id IN (SELECT id FROM reports WHERE timestamp<? LIMIT ?)", RETENTION_REPORTS_DAYS),
+}
+
+def purge_expired_rows(now):
+    # Per batch, satu transaksi pendek per batch: writer lain hanya menunggu satu batch
+    deleted = {}
+    for table, (query, days) in RETENTION_QUERIES.items():
+        deleted[table] = 0
+        while True:
+            with db() as conn:
+                count = conn.execute(query, (now - days * 86400, RETENTION_BATCH)).rowcount
+                conn.commit()
+            deleted[table] += count
+            if count < RETENTION_BATCH:
+                break
+    return deleted
+
+async def retention_job(since, now):
+    deleted = await asyncio.get_running_loop().run_in_executor(None, purge_expired_rows, now)
+    logger.info("Retention purge: %s.", ", ".join(f"{table}={count}" for table, count in deleted.items()))
+
+scheduler = Scheduler([
+    ScheduledJob("leaderboard", daily_leaderboard_job, "daily 23:59", catchup=6 * 3600),
+    ScheduledJob("quiz_round", quiz_round_job, "daily 20:00", catchup=3600),
+    ScheduledJob("pro_expiry", pro_expiry_job, "every 900", jitter=60),
+    ScheduledJob("retention", retention_job, "daily 03:30", jitter=1800),
+])
 
 # ========== Handler Registrasi ==========
-def main():
-    init_db()
-    application = Application.builder().token(BOT_TOKEN).build()
-
-    # Command
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_cmd))
-    application.add_handler(CommandHandler("profile", profile_cmd))
-    application.add_handler(CommandHandler("upgrade", help_cmd)) # implementasi payment bisa tambah
-    application.add_handler(CommandHandler("find", start))
-    application.add_handler(CommandHandler("searchpro", search_pro_cmd))
-    application.add_handler(CommandHandler("playquiz", play_quiz_cmd))
-    application.add_handler(CommandHandler("answer", answer_quiz_cmd))
-    application.add_handler(CommandHandler("tukarpro7", tukarpro7_cmd))
-    application.add_handler(CommandHandler("redeem", redeem_points_cmd))
-    application.add_handler(CommandHandler("joingroup", join_group_cmd))
-    application.add_handler(CommandHandler("leavegroup", leave_group_cmd))
-    application.add_handler(CommandHandler("next", next_cmd))
-    application.add_handler(CommandHandler("stop", stop_cmd))
-    application.add_handler(CommandHandler("report", report_cmd))
-    application.add_handler(CommandHandler("feedback", feedback_cmd))
-    application.add_handler(CommandHandler("poll", poll_cmd))
-    application.add_handler(CommandHandler("secretmode", secret_mode_cmd))
-    
+async def post_init(application: Application):
+    outbox.start(application.bot)
+    config.load()
+    await storage.open()
+    await load_match_pool()
+    await load_waiting_room()
+    media_blocklist.load()
+    load_polls(application.job_queue)
+    restore_runtime_state()
+    scheduler.start()
+    if BLOCK_DETECT:
+        block_detector.start()
+    if BACKUP_WAL_SHIP:
+        wal_shipper.start()
+    health.start(application)
+    health.phase = "running"
+
+async def post_stop(application: Application):
+    await drain_for_shutdown()
+
+async def post_shutdown(application: Application):
+    # Cadangan bila post_stop tidak sempat jalan (mis. gagal saat start)
+    owner_alerts.flush()
+    poll_registry.flush()
+    if event_log.flushing is not None:
+        await event_log.flushing
+    event_log.flush()
+    if profiler.tracing:
+        logger.info(await profiler.stop())
+    await scheduler.stop(0)
+    health.stop()
+    block_detector.stop()
+    await outbox.stop()
+    await storage.close()
+    moderator.stop()
+    # Terakhir: semua tulisan sudah masuk WAL dan ikut terkirim
+    wal_shipper.stop()
+
+def build_application(request=None):
+    builder = (Application.builder().application_class(TracedApplication).token(BOT_TOKEN)
+               .post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown)
+               .persistence(RuntimePersistence()))
+    builder = builder.request(request if request is not None else TracedRequest(connection_pool_size=256))
+    application = builder.build()
+
+    # Anti-flood di depan semua handler
+    application.add_handler(TypeHandler(Update, rate_limit_guard), group=-1)
+
+    check_routes()
+
     # Profile Conversation
     profile_conv = ConversationHandler(
-        entry_points=[CommandHandler("profile", profile_cmd)],
+        entry_points=[CommandHandler("profile", profile_cmd), MessageHandler(filters.Text(button_labels("profile")), profile_cmd)],
         states={
             PROFILE_GENDER: [MessageHandler(filters.TEXT, profile_gender)],
             PROFILE_AGE: [MessageHandler(filters.TEXT, profile_age)],
@@ -1816,13 +4973,14 @@ def main():
             PROFILE_LANG: [MessageHandler(filters.TEXT, profile_lang)],
             PROFILE_HOBBY: [MessageHandler(filters.TEXT, profile_hobby)],
         },
-        fallbacks=[CommandHandler("cancel", profile_cancel)]
+        fallbacks=[CommandHandler("cancel", profile_cancel)],
+        name="profile", persistent=True
     )
     application.add_handler(profile_conv)
 
     # Search Pro Conversation
     search_conv = ConversationHandler(
-        entry_points=[CommandHandler("searchpro", search_pro_cmd)],
+        entry_points=[CommandHandler("searchpro", search_pro_cmd), MessageHandler(filters.Text(button_labels("search_pro")), search_pro_cmd)],
         states={
             SEARCH_TYPE: [CallbackQueryHandler(search_type_callback)],
             SEARCH_GENDER: [MessageHandler(filters.TEXT, search_gender_step)],
@@ -1830,7 +4988,8 @@ def main():
             SEARCH_AGE_MIN: [MessageHandler(filters.TEXT, search_age_min_step)],
             SEARCH_AGE_MAX: [MessageHandler(filters.TEXT, search_age_max_step)],
         },
-        fallbacks=[]
+        fallbacks=[],
+        name="search_pro", persistent=True
     )
     application.add_handler(search_conv)
 
@@ -1844,32 +5003,46 @@ def main():
     application.add_handler(CallbackQueryHandler(feedback_callback, pattern=r"^fb_"))
 
     # Polling
-    application.add_handler(MessageHandler(filters.Regex("^Poll$"), poll_cmd))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, poll_message))
-
-    # Forward message (media, teks, voice dsb)
-    application.add_handler(MessageHandler(
-        filters.ALL & ~filters.COMMAND, forward_message
-    ))
-
-    # Group chat
-    application.add_handler(MessageHandler(filters.Regex("^Join Group$"), join_group_cmd))
-    application.add_handler(MessageHandler(filters.Regex("^Leave Group$"), leave_group_cmd))
-
-    # Secret mode
-    application.add_handler(MessageHandler(filters.Regex("^Secret Mode$"), secret_mode_cmd))
+    poll_conv = ConversationHandler(
+        entry_points=[CommandHandler("poll", poll_cmd), MessageHandler(filters.Text(button_labels("poll")), poll_cmd)],
+        states={
+            POLL_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, poll_message)],
+        },
+        fallbacks=[CommandHandler("cancel", poll_cancel)],
+        name="poll", persistent=True
+    )
+    application.add_handler(poll_conv)
+    application.add_handler(PollAnswerHandler(poll_answer_handler))
 
-    # Feedback
-    application.add_handler(MessageHandler(filters.Regex("^Feedback$"), feedback_cmd))
+    # Perintah, tombol menu & relay teks (lihat TEXT_ROUTES); harus setelah semua conversation
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT, route_text))
 
-    # Next/Stop
-    application.add_handler(MessageHandler(filters.Regex("^Next$"), next_cmd))
-    application.add_handler(MessageHandler(filters.Regex("^Stop$"), stop_cmd))
+    # Forward message (media, voice dsb)
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & ~filters.TEXT, forward_message))
 
-    # Leaderboard daily job
+    # Job in-process; leaderboard, ronde quiz, expiry Pro & retensi ada di scheduler (tabel scheduled_jobs)
     job_queue = application.job_queue
-    job_queue.run_daily(daily_leaderboard_job, time=datetime.now().replace(hour=23, minute=59, second=0))
+    job_queue.run_repeating(alert_digest_job, interval=ALERT_DIGEST_INTERVAL, first=ALERT_DIGEST_INTERVAL)
+    job_queue.run_repeating(poll_flush_job, interval=POLL_FLUSH_INTERVAL, first=POLL_FLUSH_INTERVAL)
+    job_queue.run_repeating(match_pool_check_job, interval=MATCH_POOL_CHECK_INTERVAL, first=MATCH_POOL_CHECK_INTERVAL)
+    job_queue.run_repeating(event_flush_job, interval=EVENT_FLUSH_INTERVAL, first=EVENT_FLUSH_INTERVAL)
+    job_queue.run_repeating(config_reload_job, interval=CONFIG_RELOAD_INTERVAL, first=CONFIG_RELOAD_INTERVAL)
+    job_queue.run_repeating(backup_job, interval=BACKUP_INTERVAL, first=BACKUP_INTERVAL)
+    if BACKUP_WAL_SHIP:
+        job_queue.run_repeating(wal_ship_job, interval=BACKUP_WAL_INTERVAL, first=BACKUP_WAL_INTERVAL)
+    return application
 
+def main():
+    global instance_lock
+    if len(sys.argv) > 1:
+        run_cli(sys.argv[1:])
+        return
+    init_db()
+    application = build_application()
+    try:
+        instance_lock = acquire_instance_lock(LIFECYCLE_LOCK_PATH)
+    except TimeoutError as e:
+        raise SystemExit(str(e))
     logger.info("Bot started.")
     application.run_polling()
 